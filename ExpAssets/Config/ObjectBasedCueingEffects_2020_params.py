@@ -7,6 +7,15 @@ from klibs import P
 #########################################
 collect_demographics = True
 manual_demographics_collection = False
+
+# To resume an interrupted session at the trial it stopped at, set this to the id of the
+# participant (e.g. resume_participant = 12), then set it back to None afterwards. The
+# session to be resumed is shown on screen at launch, and demographics aren't collected
+# again for it.
+resume_participant = None
+if resume_participant:
+    manual_demographics_collection = True
+
 manual_trial_generation = False
 run_practice_blocks = True
 multi_user = False
@@ -43,6 +52,24 @@ saccadic_motion_threshold = 0.15
 saccade_response_cond = P.condition == 'saccade'  # Defaults to 'keypress' unless specified
 keypress_response_cond = (saccade_response_cond == False)
 
+# If True, every gaze sample since the last check is tested against the fixation boundary
+# (instead of only the current gaze position)
+gaze_sample_batching = True
+
+# If True, data is only committed to the database at the end of each block instead of after every trial
+defer_db_commits = False
+
+# If True, every raw gaze sample of each trial is recorded to ExpAssets/Data/gaze
+record_gaze_samples = False
+
+# If True, running error rates, RTs, and saccade accuracy for each cell are printed to the
+# console at each block break
+print_block_stats = True
+
+# If True, the time spent in each phase of the session is traced and saved as a Chrome
+# trace (viewable in chrome://tracing or ui.perfetto.dev) to ExpAssets/Data/traces
+trace_session = False
+
 
 #########################################
 # Experiment Structure
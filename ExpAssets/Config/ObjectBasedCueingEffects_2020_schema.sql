@@ -33,6 +33,12 @@ while within the root of your project folder. This will export all participant a
 data in the database to text files found in ObjectBasedCueingEffects_2020/ExpAssets/Data.
 
 
+This project's databases can also be upgraded in place instead: add a migration for your
+change to migrations.py (which increases SCHEMA_VERSION), update the 'user_version' at the
+end of this file to match, and existing databases will be upgraded the next time the
+experiment is launched (or by running 'python -m tools.migrate_db').
+
+
 Note that you *really* do not need to be concerned about datatypes when adding columns;
 in the end, everything will be a string when the data is exported. The *only* reason you
 would use a datatype other than 'text' would be to ensure that the program will throw an
@@ -60,7 +66,7 @@ CREATE TABLE trials (
 	cue_location text not null,
 	target_location text not null,
 	target_acquired text not null,
-	keypress_rt text not null,
+	keypress_rt real,
 	moved_eyes text not null
 );
 
@@ -73,7 +79,8 @@ CREATE TABLE trials_err (
 	box_alignment text not null,
 	cue_location text not null,
 	target_location text not null,
-	err_type text not null
+	err_type text not null,
+	fixation_break_time text not null
 );
 
 CREATE TABLE saccades (
@@ -88,4 +95,63 @@ CREATE TABLE saccades (
 	end_x integer not null,
 	end_y integer not null,
 	duration float not null
-);
\ No newline at end of file
+);
+
+CREATE TABLE frame_timing (
+	id integer primary key autoincrement not null,
+	participant_id integer not null references participants(id),
+	trial_id integer not null,
+	block_num integer not null,
+	trial_num integer not null,
+	refresh_ms float not null,
+	cue_onset_error text not null,
+	cue_duration text not null,
+	soa text not null,
+	target_onset_error text not null,
+	late_frames integer not null,
+	dropped_frames integer not null
+);
+
+CREATE TABLE gaze_index (
+	id integer primary key autoincrement not null,
+	participant_id integer not null references participants(id),
+	trial_id integer not null,
+	block_num integer not null,
+	trial_num integer not null,
+	file text not null,
+	sample_offset integer not null,
+	sample_count integer not null,
+	dropped_samples integer not null,
+	target_onset text not null
+);
+
+CREATE TABLE session_sequence (
+	id integer primary key autoincrement not null,
+	participant_id integer not null references participants(id),
+	block_num integer not null,
+	block_pos integer not null,
+	box_alignment text not null,
+	cue_location text not null,
+	target_location text not null
+);
+
+CREATE TABLE session_checkpoints (
+	id integer primary key autoincrement not null,
+	participant_id integer not null references participants(id),
+	trial_id integer not null,
+	block_num integer not null,
+	block_pos integer not null,
+	trial_num integer not null
+);
+
+CREATE INDEX trials_participant ON trials (participant_id, block_num, trial_num);
+CREATE INDEX trials_err_participant ON trials_err (participant_id, session_type, err_type);
+CREATE INDEX saccades_participant ON saccades (participant_id, trial_id, rt);
+CREATE INDEX saccades_trial ON saccades (trial_id);
+CREATE INDEX frame_timing_trial ON frame_timing (trial_id);
+CREATE INDEX gaze_index_trial ON gaze_index (trial_id);
+CREATE INDEX session_sequence_participant ON session_sequence (participant_id, block_num, block_pos);
+CREATE INDEX session_checkpoints_participant ON session_checkpoints (participant_id);
+
+-- Databases created from this file are at the latest version in migrations.py
+PRAGMA user_version = 3;
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+
+GEOMETRY_FILE = "geometry.json"
+
+
+def source_digest(paths):
+    """Returns a hash of the contents of the given source files (for compiled
+    modules, of their .py files if they're present).
+
+    """
+    sha = hashlib.sha1()
+    for path in paths:
+        base, ext = os.path.splitext(path)
+        if ext in ('.pyc', '.pyo') and os.path.isfile(base + '.py'):
+            path = base + '.py'
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def bundle_key(screen_size, diagonal, view_distance, sizes, sources=()):
+    """Returns the name of the asset bundle for a given screen resolution, diagonal
+    size (in inches) and viewing distance (in cm), a given set of stimulus sizes
+    (in degrees), and the source files of the code that draws and saves the
+    stimuli (so that any change to that code gets a new bundle).
+
+    """
+    spec = json.dumps([sorted(sizes.items()), source_digest(sources)])
+    digest = hashlib.sha1(spec.encode('utf-8')).hexdigest()[:8]
+    return "{0}x{1}_{2}in_{3}cm_{4}".format(
+        int(screen_size[0]), int(screen_size[1]), diagonal, view_distance, digest
+    )
+
+
+class AssetBundle(object):
+    """Stimulus geometry and prerendered stimulus surfaces for one screen setup,
+    saved to disk so that later launches on the same setup can skip building them.
+
+    Geometry is stored as JSON and each surface as a .npy file, which is memory-
+    mapped (rather than read & parsed) when the bundle is loaded.
+
+    Args:
+        path (str): The folder the bundle is (or will be) saved in.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.geometry = {}
+        self.surfaces = {}
+
+    def exists(self):
+        return os.path.isfile(os.path.join(self.path, GEOMETRY_FILE))
+
+    def load(self):
+        """Loads the bundle from disk, returning False if there isn't one."""
+        if not self.exists():
+            return False
+        with open(os.path.join(self.path, GEOMETRY_FILE)) as f:
+            data = json.load(f)
+        self.geometry = data['geometry']
+        self.surfaces = {}
+        for name in data['surfaces']:
+            surface = np.load(os.path.join(self.path, name + ".npy"), mmap_mode='r')
+            self.surfaces[name] = np.asarray(surface)  # plain array view of the map
+        return True
+
+    def save(self):
+        """Saves the bundle to disk. The bundle is written to a temporary folder
+        first, so an interrupted save never leaves a partial bundle behind.
+
+        """
+        tmp_path = "{0}.tmp{1}".format(self.path, os.getpid())
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        for name, surface in self.surfaces.items():
+            np.save(os.path.join(tmp_path, name + ".npy"), np.ascontiguousarray(surface))
+        with open(os.path.join(tmp_path, GEOMETRY_FILE), 'w') as f:
+            json.dump({'geometry': self.geometry, 'surfaces': sorted(self.surfaces)}, f)
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:
+            # Another launch saved the same bundle first
+            shutil.rmtree(tmp_path)
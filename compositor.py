@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+
+class FrameCompositor(object):
+    """Keeps the static layers of each frame (e.g. fixation & placeholders) and
+    tracks what is currently on screen, so that unchanged frames don't get redrawn.
+
+    Layers are kept as the small prerendered stimulus surfaces rather than merged
+    into full-screen images, since klibs uploads every blitted surface to the GPU:
+    redrawing a frame only costs the pixels of the stimuli actually on it.
+
+    """
+
+    def __init__(self):
+        self._backgrounds = {}
+        self._on_screen = None
+
+    def add_background(self, key, layers):
+        """Stores a list of (surface, location) layers, drawn in order beneath the
+        overlays of every frame with the given key.
+
+        """
+        self._backgrounds[key] = list(layers)
+
+    def background(self, key):
+        return self._backgrounds[key]
+
+    def frame(self, key, overlays=()):
+        """Returns the (surface, location) layers needed to draw the requested frame,
+        or None if that exact frame is already on screen.
+
+        Args:
+            key: The key of the background layers to draw.
+            overlays (list): (surface, location) pairs to draw over the background.
+
+        Returns:
+            list or None: The background layers followed by the overlays, in
+            drawing order, if the display needs to be redrawn, otherwise None.
+
+        """
+        content = (key, tuple((id(surface), tuple(loc)) for surface, loc in overlays))
+        if content == self._on_screen:
+            return None
+        self._on_screen = content
+        return self._backgrounds[key] + list(overlays)
+
+    def invalidate(self):
+        """Marks the screen contents as unknown (e.g. after something other than the
+        compositor has drawn to the display), forcing the next frame to be drawn.
+
+        """
+        self._on_screen = None
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import threading
+from timeit import default_timer
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+# Columns written to the 'saccades' table, in insert order
+SACCADE_COLUMNS = [
+    'participant_id', 'trial_id', 'rt', 'accuracy', 'dist_from_target',
+    'start_x', 'start_y', 'end_x', 'end_y', 'duration'
+]
+
+
+# Per-connection settings: every commit is synced to disk (with write-ahead logging,
+# see migrations.py, NORMAL would skip that, so a power cut could lose the last trials
+# written), which only costs time on the writer thread. Sorts & temporary indexes stay
+# in memory.
+PRAGMAS = [
+    ("synchronous", "FULL"),
+    ("cache_size", -16384),  # KiB
+    ("temp_store", "MEMORY")
+]
+
+
+def connect(path, timeout=30.0, uri=False):
+    """Opens a connection to the experiment database at the given path.
+
+    Since the klibs runtime keeps its own connection open to the same database, a
+    generous busy timeout is used so that writes wait for its locks instead of
+    failing. If uri is True (Python 3 only), 'file:' URIs can be used to open or
+    attach databases, e.g. read-only.
+
+    """
+    if uri:
+        db = sqlite3.connect(path, timeout=timeout, uri=True)
+    else:
+        db = sqlite3.connect(path, timeout=timeout)
+    for name, value in PRAGMAS:
+        db.execute("PRAGMA {0} = {1}".format(name, value))
+    return db
+
+
+def insert_statement(table, columns):
+    return "INSERT INTO {0} ({1}) VALUES ({2})".format(
+        table, ", ".join(columns), ", ".join(["?"] * len(columns))
+    )
+
+
+def saccade_dict(saccade):
+    """Returns a copy of a saccade dict (as recorded by record_saccades) with only
+    the fields that are columns of the 'saccades' table.
+
+    """
+    return dict((k, v) for k, v in saccade.items() if k in SACCADE_COLUMNS)
+
+
+def _item_rows(item):
+    # The number of rows in a queued item (a row, plus any child rows)
+    table, row, children = item
+    return 1 + len(children or [])
+
+
+class _Flush(object):
+    # Queue marker: signalled once everything queued before it has been committed
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class _Stop(_Flush):
+    pass
+
+
+class AsyncWriter(object):
+    """A write-behind queue that writes rows to the database on a background thread,
+    so that database I/O never blocks the presentation loop.
+
+    The presentation thread only enqueues rows; a worker thread with its own
+    connection drains the queue in batches, writing each batch in a single
+    transaction. Trial rows can be queued together with rows from other tables that
+    refer to them (e.g. saccades), in which case the worker fills in their
+    'trial_id' once the trial row has been written.
+
+    Each batch is written inside its own savepoint, so rows that fail to insert
+    (e.g. because of a constraint violation) are rolled back on their own, without
+    losing the rest of the batch or earlier batches waiting on a deferred commit.
+    The worker carries on writing after a failure, and the failure is raised by the
+    next call to flush() or close(). If the worker itself can't carry on (e.g. the
+    database can't be opened, or stays locked past the busy timeout), it stops, and
+    every call to flush() or close() from then on raises instead of waiting on it.
+
+    Args:
+        path (str): The path of the database to write to.
+        batch_size (int, optional): The maximum number of queued items to write
+            in a single transaction.
+        defer_commits (bool, optional): If True, written rows are only committed
+            when flush() is called (e.g. at the end of each block) instead of
+            after every batch.
+
+    """
+
+    def __init__(self, path, batch_size=256, defer_commits=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.defer_commits = defer_commits
+        self.queue = Queue()
+
+        self.max_depth = 0
+        self.rows_written = 0
+        self.batches_written = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.rows_failed = 0
+        self._total_latency = 0.0
+        self._errors = []
+        self._errors_lock = threading.Lock()
+        self._fatal = None  # the error that stopped the worker, if any
+        self._state_lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name="AsyncWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def depth(self):
+        """int: The number of items currently waiting in the queue."""
+        return self.queue.qsize()
+
+    def put(self, table, row):
+        """Queues a row (a {column: value} dict) to be inserted into a table."""
+        self._enqueue((table, dict(row), None))
+
+    def put_trial(self, row, children=[]):
+        """Queues a row for the 'trials' table, along with a list of (table, row)
+        tuples for rows in other tables that should have their 'trial_id' set to the
+        id of the new trial row.
+
+        """
+        self._enqueue(('trials', dict(row), [(t, dict(r)) for t, r in children]))
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far has been written to the database
+        and committed.
+
+        Raises:
+            RuntimeError: If any rows have failed to be written since the last
+                flush, or the worker thread has stopped.
+
+        """
+        self._raise_if_stopped()
+        marker = _Flush()
+        self._enqueue(marker)
+        marker.done.wait(timeout)
+        self._raise_if_failed()
+
+    def close(self, timeout=None):
+        """Flushes the queue, then stops the worker thread and closes its
+        connection.
+
+        """
+        if self._fatal is None and not self._thread.is_alive():
+            self._raise_if_failed()
+            return  # already closed
+        self._raise_if_stopped()
+        marker = _Stop()
+        self._enqueue(marker)
+        marker.done.wait(timeout)
+        self._thread.join(timeout)
+        self._raise_if_failed()
+
+    def metrics(self):
+        """Returns a dict of the writer's queue depth and write latency statistics
+        (latencies are per batch, in milliseconds).
+
+        """
+        mean = self._total_latency / self.batches_written if self.batches_written else 0.0
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'rows_written': self.rows_written,
+            'rows_failed': self.rows_failed,
+            'batches_written': self.batches_written,
+            'last_latency_ms': self.last_latency * 1000,
+            'mean_latency_ms': mean * 1000,
+            'max_latency_ms': self.max_latency * 1000
+        }
+
+    def _enqueue(self, item):
+        with self._state_lock:
+            if self._fatal is not None:
+                # Nothing is left to write it, so it's lost (and markers are done)
+                self._discard([item], self._fatal)
+                return
+            self.queue.put(item)
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _raise_if_failed(self):
+        # Raises (and clears) the failures since the last check, if there were any
+        with self._errors_lock:
+            errors, self._errors = self._errors, []
+        if len(errors):
+            lost = sum(n for n, e in errors)
+            raise RuntimeError("Database writer failed to write {0} rows: {1}".format(
+                lost, "; ".join(sorted(set(str(e) for n, e in errors)))
+            ))
+
+    def _raise_if_stopped(self):
+        # Raises instead of waiting on a worker that's no longer running
+        if self._fatal is not None or not self._thread.is_alive():
+            self._raise_if_failed()
+            raise RuntimeError("Database writer has stopped{0}".format(
+                "" if self._fatal is None else ": {0}".format(self._fatal)
+            ))
+
+    def _failed(self, rows, error):
+        self.rows_failed += rows
+        with self._errors_lock:
+            self._errors.append((rows, error))
+
+    def _discard(self, items, error):
+        # Records queued rows as lost to an error and signals any markers among them
+        lost = 0
+        for item in items:
+            if isinstance(item, _Flush):
+                item.done.set()
+            else:
+                lost += _item_rows(item)
+        if lost:
+            self._failed(lost, error)
+
+    def _run(self):
+        db = None
+        batch = []
+        pending = 0  # rows written since the last commit
+        committed = 0  # rows_written as of the last commit
+        try:
+            db = connect(self.path)
+            db.isolation_level = None  # transactions & savepoints are managed explicitly
+            in_transaction = False
+            stopping = False
+            while not stopping:
+                batch = [self.queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+
+                rows = [item for item in batch if not isinstance(item, _Flush)]
+                markers = [item for item in batch if isinstance(item, _Flush)]
+                if len(rows):
+                    start = default_timer()
+                    if not in_transaction:
+                        db.execute("BEGIN")
+                        in_transaction = True
+                    pending += self._write_batch(db, rows)
+                    batch = markers
+                    if not self.defer_commits:
+                        self._commit(db, pending)
+                        in_transaction, pending = False, 0
+                        committed = self.rows_written
+                    self._record_latency(default_timer() - start)
+                if len(markers) and in_transaction:
+                    self._commit(db, pending)
+                    in_transaction, pending = False, 0
+                    committed = self.rows_written
+                for marker in markers:
+                    stopping = stopping or isinstance(marker, _Stop)
+                    marker.done.set()
+                batch = []
+        except Exception as e:
+            # The uncommitted rows & everything still queued are lost: record them,
+            # release anything waiting on a marker, and discard anything queued later
+            with self._state_lock:
+                self._fatal = e
+                self.rows_written = committed
+                if pending:
+                    self._failed(pending, e)
+                while True:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+                self._discard(batch, e)
+        finally:
+            if db is not None:
+                db.close()
+
+    def _write_batch(self, db, items):
+        # Writes a batch inside a savepoint. If it fails, it's rolled back and each
+        # item is retried in a savepoint of its own, so only the items that fail
+        # are lost. Returns the number of rows written.
+        written = self._write_savepoint(db, items)
+        if written is None:
+            written = 0
+            for item in items:
+                written += self._write_savepoint(db, [item], report=True) or 0
+        return written
+
+    def _write_savepoint(self, db, items, report=False):
+        # Returns the number of rows written, or None if they were rolled back
+        before = self.rows_written
+        db.execute("SAVEPOINT batch")
+        try:
+            self._write(db, items)
+        except Exception as e:
+            db.execute("ROLLBACK TO batch")
+            db.execute("RELEASE batch")
+            self.rows_written = before
+            if report:
+                self._failed(sum(_item_rows(item) for item in items), e)
+            return None
+        db.execute("RELEASE batch")
+        return self.rows_written - before
+
+    def _commit(self, db, pending):
+        # Commits the open transaction, in which the given number of rows were written
+        try:
+            db.execute("COMMIT")
+        except Exception as e:
+            try:
+                db.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass  # already rolled back by SQLite
+            self.rows_written -= pending
+            self._failed(pending, e)
+
+    def _write(self, db, items):
+        # Consecutive plain rows for the same table & columns are written with a
+        # single executemany, trial rows are written individually so that their
+        # ids can be given to their child rows
+        run_key, run = None, []
+        for table, row, children in items:
+            key = (table, tuple(sorted(row.keys())))
+            if children is None and key == run_key:
+                run.append(row)
+                continue
+            self._write_rows(db, run_key, run)
+            run_key, run = (None, [])
+            if children is None:
+                run_key, run = key, [row]
+                continue
+            cursor = db.execute(insert_statement(table, key[1]), [row[c] for c in key[1]])
+            self.rows_written += 1
+            child_runs = {}
+            for child_table, child in children:
+                child['trial_id'] = cursor.lastrowid
+                child_key = (child_table, tuple(sorted(child.keys())))
+                child_runs.setdefault(child_key, []).append(child)
+            for child_key, child_rows in child_runs.items():
+                self._write_rows(db, child_key, child_rows)
+        self._write_rows(db, run_key, run)
+
+    def _write_rows(self, db, key, rows):
+        if not len(rows):
+            return
+        table, columns = key
+        values = [[row[c] for c in columns] for row in rows]
+        db.executemany(insert_statement(table, columns), values)
+        self.rows_written += len(rows)
+
+    def _record_latency(self, latency):
+        self.batches_written += 1
+        self.last_latency = latency
+        self._total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
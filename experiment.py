@@ -8,20 +8,33 @@ from klibs.KLExceptions import TrialException
 from klibs.KLConstants import EL_SACCADE_END, EL_FALSE, NA, RC_KEYPRESS, CIRCLE_BOUNDARY, TIMEOUT, STROKE_CENTER
 from klibs.KLUtilities import deg_to_px, flush, iterable, smart_sleep, boolean_to_logical, pump
 from klibs.KLUtilities import line_segment_len as lsl
-from klibs.KLKeyMap import KeyMap
-from klibs.KLUserInterface import key_pressed
 from klibs.KLGraphics import fill, flip, blit, clear
-from klibs.KLGraphics.KLDraw import Rectangle, Circle, SquareAsterisk, FixationCross
 from klibs.KLCommunication import any_key, message
+from klibs.KLUserInterface import ui_request
 from klibs.KLBoundary import BoundaryInspector
 from klibs.KLDatabase import EntryTemplate
 
+from stimuli import StimulusCache, render_surface
+from assets import AssetBundle, bundle_key
+from compositor import FrameCompositor
+from geometry import TargetGeometryTable, stimulus_locations, factor_levels
+from datastore import AsyncWriter, saccade_dict
+from migrations import migrate
+from tracing import Tracer, NullTracer, traced
+from livestats import SessionMonitor
+from timing import FramePacer, FlipTimer, FRAME_CUE, FRAME_TARGET
+from gaze import TrackerSampleSource, FixationMonitor, GazeRecorder, score_saccade
+from keypresses import KeypressCapture, sdl_keydown_source, sdl_hotkey_source
+from session import SessionSequence, TrialIterators, load_session
+
+import os
+import time
+import inspect
+from imp import load_source
 from math import pi, cos, sin
-from sdl2 import SDLK_SPACE
+from sdl2 import SDLK_SPACE, SDL_PumpEvents
 
 import numpy as np
-from PIL import Image, ImageDraw
-import aggdraw
 
 BLACK = (0, 0, 0, 255)
 WHITE = (255, 255, 255, 255)
@@ -38,15 +51,51 @@ SACC_OUTSIDE = "outside"
 HORIZONTAL = 'horizontal'
 VERTICAL = 'vertical'
 
+# Trial timeline (ms after drift check)
+CUE_ON = 1000       # Cue appears 1000ms after drift check
+CUE_OFF = 1100      # Cue removed after 100ms
+TARGET_ON = 1960    # Target appears 860ms after cue removal
+TASK_END = 4460     # 2500ms to respond to target before trial aborts
+
+RESPONSE_TIMEOUT = TASK_END - TARGET_ON  # ms from target onset to respond before trial ends
+POST_RESPONSE_BLANK = 1000  # ms of blank screen after each response
+
+# Stimulus sizes (degrees of visual angle)
+STIMULUS_SIZES = {
+    'target_diameter': 1.0,
+    'cue_seg_len': 1.7,
+    'cue_seg_thick': 0.4,
+    'rect_long_side': 11.4,
+    'rect_short_side': 1.7,
+    'rect_thickness': 0.2,
+    'fix_width': 1.0,
+    'fix_thickness': 0.2,
+    'location_offset': 4.8,  # Offset between center of placeholders & fixation
+    'gaze_boundary': 3.0  # Radius of fixation & target boundaries
+}
+
+FACTORS = ['box_alignment', 'cue_location', 'target_location']
 
 
 class ObjectBasedCueingEffects_2020(klibs.Experiment):
     # trial data
     saccades = []
     target_acquired = False
+    tracer = NullTracer()
 
     def setup(self):
 
+        # If enabled, each phase of the session is recorded as a span (see tracing.py)
+        # and exported as a Chrome trace at the end of the session
+        if P.trace_session:
+            self.tracer = Tracer()
+        self.tracer.begin('setup')
+
+        # When resuming an interrupted session (see params), klibs doesn't collect
+        # demographics, so carry on as the participant whose session it was
+        if P.resume_participant:
+            P.participant_id = P.p_id = int(P.resume_participant)
+
         # Generate messages to be displayed during experiment
         self.err_msgs = {}
         if P.saccade_response_cond:
@@ -58,57 +107,159 @@ class ObjectBasedCueingEffects_2020(klibs.Experiment):
             self.err_msgs['key'] = "Please respond with the spacebar only."
             self.err_msgs['early'] = "Responded too soon!"
 
-        # Stimulus sizes
-        self.target_diameter = deg_to_px(1.0)
-
-        self.cue_seg_len = deg_to_px(1.7)
-        self.cue_seg_thick = deg_to_px(0.4)
-
-        self.rect_long_side = deg_to_px(11.4)
-        self.rect_short_side = deg_to_px(1.7)
-        self.rect_thickness = deg_to_px(0.2)
-
-        self.fix_width = deg_to_px(1.0)
-        self.fix_thickness = deg_to_px(0.2)
-
-        # Stimulus drawbjects
-        # NOTE: too many properties of placeholders & cue vary trial-by-trial, easier to construct during trial_prep()
-        self.fix = FixationCross(size=self.fix_width, thickness=self.fix_thickness, fill=RED)
-        self.target = Circle(diameter=self.target_diameter, fill=WHITE)
-
-        # Offset between center of placeholders & fixation
-        offset = deg_to_px(4.8)
-
-        # Use offsets to establish possible stimulus locations
-        self.locations = {
-            "left": [P.screen_c[0] - offset, P.screen_c[1]],
-            'right': [P.screen_c[0] + offset, P.screen_c[1]],
-            'top': [P.screen_c[0], P.screen_c[1] - offset],
-            'bottom': [P.screen_c[0], P.screen_c[1] + offset],
-            'top_left': [P.screen_c[0] - offset, P.screen_c[1] - offset],
-            'top_right': [P.screen_c[0] + offset, P.screen_c[1] - offset],
-            'bottom_left': [P.screen_c[0] - offset, P.screen_c[1] + offset],
-            'bottom_right': [P.screen_c[0] + offset, P.screen_c[1] + offset]
+        # Feedback for the end of keypress trials, rendered ahead of time
+        self.feedback = {
+            'early': message(self.err_msgs['early'], blit_txt=False),
+            'moved_eyes': message("Moved eyes during response interval!", blit_txt=False)
         }
 
-        # Define keymap for ResponseCollector
-        self.keymap = KeyMap(
-            "speeded response",  # Name
-            ["spacebar"],  # UI Label
-            ["spacebar"],  # Data Label
-            [SDLK_SPACE]  # SDL2 Keycode
+        # Get the levels of each factor from the independent variables file
+        ind_vars = load_source("ind_vars", P.ind_vars_file_path)
+        ind_vars = getattr(ind_vars, P.project_name + "_ind_vars")
+        levels = factor_levels(ind_vars, FACTORS)
+        alignments = levels['box_alignment']
+
+        # Stimulus sizes & locations in pixels and every prerendered stimulus are
+        # loaded from a bundle saved by an earlier launch on the same screen setup,
+        # or built (and saved for next time) if there isn't one yet
+        diagonal = getattr(P, 'screen_diagonal_in', None)
+        bundle_dir = os.path.join(os.path.dirname(os.path.dirname(P.ind_vars_file_path)), "Bundles")
+        sizes = dict(STIMULUS_SIZES, ppd=P.ppd)  # ppd included so the key covers deg_to_px()
+        # The stimuli are drawn by this file and stimuli.py and saved by assets.py, so
+        # changes to any of them give a new key (and a freshly built bundle)
+        sources = [__file__, inspect.getsourcefile(StimulusCache), inspect.getsourcefile(AssetBundle)]
+        self.assets = AssetBundle(os.path.join(
+            bundle_dir, bundle_key(P.screen_x_y, diagonal, P.view_distance, sizes, sources)
+        ))
+        with self.tracer.span('load_assets'):
+            if not self.assets.load():
+                with self.tracer.span('build_assets'):
+                    self.build_assets(alignments)
+                    self.assets.save()
+        for name, size in self.assets.geometry['sizes'].items():
+            setattr(self, name, size)
+        surfaces = self.assets.surfaces
+
+        # NOTE: fixation is red until drift correct is done and white afterwards
+        self.fixations = {RED: surfaces['fixation_red'], WHITE: surfaces['fixation_white']}
+        self.fix_color = RED
+        self.target = surfaces['target']
+
+        # Possible stimulus locations, given the offset between the centres of the
+        # placeholders & fixation
+        self.locations = dict(
+            (name, tuple(loc)) for name, loc in self.assets.geometry['locations'].items()
+        )
+
+        # Precompute (and validate) the cue, target & placeholder positions for every
+        # combination of factors, so trial_prep() only needs a lookup
+        self.geometry = TargetGeometryTable(
+            self.locations, alignments, levels['cue_location'], levels['target_location']
+        )
+
+        # Placeholders & cue vary trial-by-trial, so every variant is prerendered
+        rendered = dict(
+            (a, (surfaces['placeholder_' + a], surfaces['cue_' + a])) for a in alignments
         )
+        self.stim = StimulusCache(
+            alignments, levels['cue_location'], self.construct_placeholder,
+            self.construct_cue, rendered
+        )
+        if P.development_mode:
+            mismatches = self.stim.verify()
+            if len(mismatches):
+                raise RuntimeError(
+                    "Cached stimuli differ from per-trial stimuli: {0} (bundle: {1})".format(
+                        mismatches, self.assets.path)
+                )
+
+        # Fixation & placeholders make up the static background of each frame, for
+        # each combination of box alignment and fixation colour
+        self.frames = FrameCompositor()
+        for alignment in alignments:
+            box1_loc, box2_loc = self.geometry.box_centres(alignment)
+            placeholder = self.stim.placeholder(alignment)
+            for color, fix in self.fixations.items():
+                self.frames.add_background((alignment, color), [
+                    (fix, P.screen_c), (placeholder, box1_loc), (placeholder, box2_loc)
+                ])
+
+        # Key presses are collected on their own thread, so keypress RTs don't
+        # depend on how often the main loop gets around to checking for them. KLibs
+        # hotkeys (e.g. quit & calibrate) are left for the main thread to pass on.
+        self.keys = KeypressCapture(sdl_keydown_source())
+        self.hotkeys = sdl_hotkey_source()
+        self.keys.start()
+        self.input_pacer = FramePacer(self.keys.poll_interval * 1000)
 
         # Instantiate boundary inspector to handle drift checks & target acquisitions (for saccade responses)
         self.bi = BoundaryInspector()
-        self.gaze_boundary = deg_to_px(3.0)  # Radius of 3.0º of visual angle
         self.bi.add_boundary(label="drift_correct", bounds=[P.screen_c, self.gaze_boundary], shape="Circle")
 
+        # If enabled, every gaze sample from drift correct to the end of the response
+        # interval is recorded to a per-participant binary file (see 'gaze_index')
+        self.gaze_recorder = None
+        if P.record_gaze_samples:
+            gaze_dir = os.path.join(P.data_dir, "gaze")
+            if not os.path.isdir(gaze_dir):
+                os.makedirs(gaze_dir)
+            gaze_file = "p{0}_gaze.bin".format(P.participant_id)
+            self.gaze_recorder = GazeRecorder(os.path.join(gaze_dir, gaze_file))
+
+        # Checks every buffered gaze sample against the fixation boundary at once
+        self.gaze_samples = TrackerSampleSource(self.el, self.gaze_recorder, [EL_SACCADE_END])
+        self.fixation = FixationMonitor(P.screen_c, self.gaze_boundary)
+
+        # Bring databases made with older versions of the schema up to date (without
+        # losing their data), then write all trial, error & saccade rows to it from a
+        # background thread, so that disk stalls never hold up the presentation loop
+        with self.tracer.span('migrate_db'):
+            migrate(P.database_path, P.schema_file_path)
+        self.writer = AsyncWriter(P.database_path, defer_commits=P.defer_db_commits)
+        self.trial_row = None
+
+        # Running per-cell statistics for the experimenter's console at block breaks
+        self.stats = SessionMonitor(alignments, levels['target_location'])
+
+        # Polls for saccades once per refresh during the response interval
+        self.response_pacer = FramePacer(P.refresh_time)
+
+        # Timestamps every flip, to record when the cue & target actually appeared
+        self.flip_timer = FlipTimer()
+        self.timing_trial = False
+
+        # The session's whole trial sequence is generated up front and stored, and
+        # progress is checkpointed after every trial, so that an interrupted session
+        # can be resumed at the trial it stopped at
+        self.blocks = self.trial_factory.export_trials()
+        self.iterators = TrialIterators(self.blocks)
+        self.sequence = SessionSequence(self.writer, P.participant_id, FACTORS)
+        self.recycled = False
+        self.resumed_trials = 0
+        with self.tracer.span('session_sequence'):
+            if P.resume_participant:
+                self.restore_session()
+            else:
+                self.sequence.store(self.iterators.sequence())
+                self.writer.flush()
+
+        self.tracer.end()
+
+    @traced('block')
     def block(self):
 
         block_num = P.block_number
         block_count = P.blocks_per_experiment
 
+        # Make sure all data from the previous block has been written to disk
+        with self.tracer.span('writer_flush'):
+            self.writer.flush()
+        if P.development_mode:
+            print "\ndatabase writer: {0}".format(self.writer.metrics())
+        if P.print_block_stats and block_num > 1:
+            print "\nafter block {0} of {1}:".format(block_num - 1, block_count)
+            print self.stats.summary()
+
         # Display progress messages at start of blocks
         if block_num > 1:
             flush()
@@ -117,18 +268,27 @@ class ObjectBasedCueingEffects_2020(klibs.Experiment):
             block_msg = block_msg.format(block_num - 1, block_count)
             message(block_msg, registration=5, location=P.screen_c)
             flip()
-            any_key()
+            with self.tracer.span('block_message'):
+                any_key()
 
     def setup_response_collector(self):
-        self.rc.uses(RC_KEYPRESS)
-        self.rc.end_collection_event = "task_end"
-        self.rc.display_callback = self.display_refresh
-        self.rc.display_kwargs = {'target': True}
-        self.rc.keypress_listener.key_map = self.keymap
-        self.rc.keypress_listener.interrupts = True
+        # Keypress responses are collected by collect_keypress() instead
+        pass
 
+    @traced('trial_prep')
     def trial_prep(self):
 
+        if self.resumed_trials:
+            # klibs numbers trials from 1 in every block, so count on from the trials
+            # already completed in the block being resumed
+            P.trial_number += self.resumed_trials
+            self.resumed_trials = 0
+        if self.recycled:
+            # The last trial was recycled, reshuffling the rest of the block
+            trials, position = self.iterators.current()
+            self.sequence.recycled(P.block_number, trials, position - 1)
+            self.recycled = False
+
         if P.development_mode:
             print "\ntrial factors"
             print "======================"
@@ -147,79 +307,108 @@ class ObjectBasedCueingEffects_2020(klibs.Experiment):
             any_key()
 
 
-        self.placeholder = self.construct_placeholder()
-        self.cue = self.construct_cue()
-
-        self.cue_loc = self.locations[self.cue_location]
+        self.placeholder = self.stim.placeholder(self.box_alignment)
+        self.cue = self.stim.cue(self.box_alignment, self.cue_location)
 
-        self.set_box_positions()
+        geometry = self.geometry.lookup(self.box_alignment, self.cue_location, self.target_location)
+        self.cue_loc = geometry.cue
+        self.box1_loc, self.box2_loc = geometry.box1, geometry.box2
 
         self.target_trial = False
 
         if self.target_location != 'catch':
             self.target_trial = True
-            self.target_loc = self.get_target_location()
+            self.target_loc = geometry.target
 
         self.evm.register_tickets([
-            ('cue_on', 1000),       # Cue appears 1000ms after drift check
-            ('cue_off', 1100),      # Cue removed after 100ms
-            ('target_on', 1960),    # Target appears 860ms after cue removal
-            ('task_end', 4460)     # 2500ms to respond to target before trial aborts
+            ('cue_on', CUE_ON),
+            ('cue_off', CUE_OFF),
+            ('target_on', TARGET_ON),
+            ('task_end', TASK_END)
         ])
 
         # Reset trial flags
         self.before_target = True
         self.target_acquired = False
         self.moved_eyes_during_rc = False
+        self.fixation_break_time = None
+        self.target_onset = None
+        self.target_time = None
 
+        self.frames.invalidate()
         self.display_refresh()
-        self.el.drift_correct(fill_color=BLACK, draw_target=EL_FALSE)
-        self.fix.fill = WHITE
+        if self.gaze_recorder is not None:
+            self.gaze_recorder.begin()
+        with self.tracer.span('drift_correct'):
+            self.el.drift_correct(fill_color=BLACK, draw_target=EL_FALSE)
+        self.frames.invalidate()
+        self.fix_color = WHITE
         self.display_refresh()
         flush()
+        self.gaze_samples.discard()
+        self.keys.arm()
 
+    @traced('trial')
     def trial(self):
 
+        self.flip_timer.begin_trial()
+        self.timing_trial = True
 
-        while self.evm.before('cue_on'):
-            self.wait_time()
+
+        with self.tracer.span('wait_cue'):
+            while self.evm.before('cue_on'):
+                self.wait_time()
 
         self.display_refresh(cue=True)
 
-        while self.evm.before('cue_off'):
-            self.wait_time()
+        with self.tracer.span('wait_target'):
+            while self.evm.before('cue_off'):
+                self.wait_time()
 
 
-        self.display_refresh()
+            self.display_refresh()
 
-        while self.evm.before('target_on'):
-            self.wait_time()
+            while self.evm.before('target_on'):
+                self.wait_time()
 
+        # Keypress RTs are measured from the flip that presented the target or, on
+        # catch trials (where nothing changes on screen, so nothing is flipped), from
+        # when the target would have appeared
+        self.target_time = self.flip_timer.clock()
         flush()
 
-        self.display_refresh(target=True)
+        if self.display_refresh(target=True):
+            self.target_time = self.flip_timer.last_flip
 
-        if P.saccade_response_cond:
-            self.record_saccades()
-            keypress_rt = 'NA'
+        with self.tracer.span('response'):
+            if P.saccade_response_cond:
+                self.record_saccades()
+                keypress_rt = None
 
-        if P.keypress_response_cond:
-            self.rc.collect()
-            keypress_rt = self.rc.keypress_listener.response(rt=True, value=False)
+            if P.keypress_response_cond:
+                keypress_rt = self.collect_keypress()
 
+        self.keys.disarm()
+        if self.gaze_recorder is not None:
+            self.gaze_samples.read()  # last samples of the response interval
+            self.gaze_recorder.stop()
         clear()
-        smart_sleep(1000)
 
+        with self.tracer.span('post_response_blank'):
+            smart_sleep(POST_RESPONSE_BLANK)
+
+        feedback = None
         if P.keypress_response_cond:
             if self.target_location == "catch" and keypress_rt != TIMEOUT:
-                fill()
-                message(self.err_msgs['early'], registration=5, location=P.screen_c)
-                flip()
-                any_key()
+                feedback = self.feedback['early']
             elif self.moved_eyes_during_rc:
-                fill()
-                message("Moved eyes during response interval!", registration=5, location=P.screen_c)
-                flip()
+                feedback = self.feedback['moved_eyes']
+
+        if feedback is not None:
+            fill()
+            blit(feedback, registration=5, location=P.screen_c)
+            flip()
+            with self.tracer.span('feedback'):
                 any_key()
 
         return {
@@ -230,127 +419,179 @@ class ObjectBasedCueingEffects_2020(klibs.Experiment):
             'cue_location': self.cue_location,
             'target_location': self.target_location,
             'target_acquired': str(self.target_acquired).upper() if P.saccade_response_cond else NA,
-            'keypress_rt': keypress_rt if P.keypress_response_cond else NA,
+            'keypress_rt': None if keypress_rt == TIMEOUT else keypress_rt,  # NULL if no RT
             'moved_eyes': str(self.moved_eyes_during_rc).upper() if P.keypress_response_cond else NA
 
         }
 
 
+    def __log_trial__(self, trial_data):
+        # Rather than having klibs write the trial row here, hold onto it so it can be
+        # queued for the background writer along with the trial's saccades.
+        self.trial_row = dict(trial_data, participant_id=P.participant_id)
+        return P.trial_number  # stands in for P.trial_id until the row is written
+
+    @traced('trial_clean_up')
     def trial_clean_up(self):
-        if P.trial_id and P.saccade_response_cond:  # won't exist if trial recycled
+        self.timing_trial = False
+        if P.trial_id:  # won't exist if trial recycled
+            children = []
             for s in self.saccades:
-                trial_template = EntryTemplate('saccades')
-                s['trial_id'] = self.db.last_id_from('trials')
-                s['participant_id'] = P.participant_id
-                for f in s:
-                    if f == "end_time":
-                        continue
-                    trial_template.log(f, s[f])
-                self.db.insert(trial_template)
+                s = dict(saccade_dict(s), participant_id=P.participant_id)
+                children.append(('saccades', s))
+            children.append(('frame_timing', self.frame_timing()))
+            if self.gaze_recorder is not None:
+                children.append(('gaze_index', self.gaze_index()))
+            self.stats.add_trial(self.trial_row, self.saccades)
+            checkpoint = self.sequence.checkpoint(
+                P.block_number, self.iterators.current()[1], P.trial_number
+            )
+            children.append(('session_checkpoints', checkpoint))
+            self.writer.put_trial(self.trial_row, children)
+        else:
+            # klibs only reshuffles the block after this, so the new order is
+            # stored at the start of the next trial
+            self.recycled = True
+            if self.gaze_recorder is not None:
+                self.gaze_recorder.discard()
+        self.trial_row = None
         self.saccades = []
         self.target_acquired = False
 
-        self.fix.fill = RED
+        self.fix_color = RED
 
 
 
     def clean_up(self):
-        pass
+        self.keys.stop()
+        self.writer.close()
+        if self.tracer.enabled:
+            trace_dir = os.path.join(P.data_dir, "traces")
+            if not os.path.isdir(trace_dir):
+                os.makedirs(trace_dir)
+            trace_file = "p{0}_{1}_trace.json".format(
+                P.participant_id, time.strftime("%Y%m%d_%H%M%S")
+            )
+            self.tracer.export(os.path.join(trace_dir, trace_file), {
+                'participant_id': P.participant_id,
+                'condition': 'saccade' if P.saccade_response_cond else 'keypress'
+            })
 
     def display_refresh(self, cue=False, target=False):
         # In keypress condition, after target presented, check that gaze
         # is still within fixation bounds and print message at end if not
         if P.keypress_response_cond and not self.before_target:
 
-            gaze = self.el.gaze()
-            if not self.bi.within_boundary(label='drift_correct', p=gaze):
+            if self.check_fixation() is not None:
                 self.moved_eyes_during_rc = True
 
-        fill()
-
-        blit(self.fix, registration=5, location=P.screen_c)
-
-        blit(self.placeholder, registration=5, location=self.box1_loc)
-        blit(self.placeholder, registration=5, location=self.box2_loc)
+        overlays = []
 
         if cue:
-            blit(self.cue, registration=5, location=self.cue_loc)
+            overlays.append((self.cue, self.cue_loc))
 
         if target:
             if self.target_location != 'catch':
-                blit(self.target, registration=5, location=self.target_loc)
+                overlays.append((self.target, self.target_loc))
 
             if self.before_target:
                 self.before_target = False
 
-        flip()
-
-    def set_box_positions(self):
-
-        if self.box_alignment == VERTICAL:
-            self.box1_loc = self.locations['left']
-            self.box2_loc = self.locations['right']
-
-        else:
-            self.box1_loc = self.locations['top']
-            self.box2_loc = self.locations['bottom']
-
-    def get_target_location(self):
-
-        box1 = None
-        box2 = None
-
-        if self.box_alignment == VERTICAL:
-
-            box1 = [self.locations['top_left'], self.locations['bottom_left']]
-            box2 = [self.locations['top_right'], self.locations['bottom_right']]
-
-        else:
-            box1 = [self.locations['top_left'], self.locations['top_right']]
-            box2 = [self.locations['bottom_left'], self.locations['bottom_right']]
-
+        # If the requested frame is already on screen, there's nothing to redraw
+        layers = self.frames.frame((self.box_alignment, self.fix_color), overlays)
+        if layers is None:
+            return False
 
-        if self.target_location == 'cued_location':
-            target_loc = self.cue_loc
-
-        if self.target_location == 'cued_object':
-
-            target_box = self.which_list(self.cue_loc, True, box1, box2)
-            target_box.remove(self.cue_loc)
-            target_loc = target_box[0]
-
-        else:
-            target_box = self.which_list(self.cue_loc, False, box1, box2)
-
-            if self.target_location == 'uncued_adjacent':
-
-                if self.box_alignment == HORIZONTAL:
-
-                    target_loc = self.which_list(self.cue_loc[0], True, target_box[0], target_box[1])
-                else:
-
-                    target_loc = self.which_list(self.cue_loc[1], True, target_box[0], target_box[1])
+        fill()
+        for stim, loc in layers:
+            blit(stim, registration=5, location=loc)
+        content = 0
+        for stim, loc in overlays:
+            content |= FRAME_CUE if stim is self.cue else FRAME_TARGET
 
-            else:
+        self.flip_timer.start()
+        flip()
+        self.tracer.incr('flips')
+        trial_ms = self.evm.trial_time_ms if self.timing_trial else float('nan')
+        self.flip_timer.stop(content, trial_ms)
+        return True
+
+    def frame_timing(self):
+        # Actual cue & target timing on the trial, measured from flip timestamps
+        timing = self.flip_timer.summary(P.refresh_time, CUE_ON, CUE_OFF, TARGET_ON)
+        row = {
+            'participant_id': P.participant_id,
+            'block_num': P.block_number,
+            'trial_num': P.trial_number
+        }
+        for col, value in timing.items():
+            row[col] = NA if value is None else value
+        return row
 
-                if self.box_alignment == HORIZONTAL:
+    def gaze_index(self):
+        # Writes the trial's recorded gaze samples & returns where to find them
+        offset, count, dropped = self.gaze_recorder.flush()
+        return {
+            'participant_id': P.participant_id,
+            'block_num': P.block_number,
+            'trial_num': P.trial_number,
+            'file': os.path.basename(self.gaze_recorder.path),
+            'sample_offset': offset,
+            'sample_count': count,
+            'dropped_samples': dropped,
+            'target_onset': NA if self.target_onset is None else self.target_onset
+        }
 
-                    target_loc = self.which_list(self.cue_loc[0], False, target_box[0], target_box[1])
+    def restore_session(self):
+        """
+        Replaces the freshly generated trial sequence with the one stored for the
+        participant being resumed, and moves klibs' block & trial iterators on to
+        the first trial after the participant's last checkpoint.
 
-                else:
+        """
+        stored, checkpoint = load_session(P.database_path, P.participant_id, FACTORS)
+        block_num, self.resumed_trials = self.iterators.restore(stored, checkpoint)
 
-                    target_loc = self.which_list(self.cue_loc[1], False, target_box[0], target_box[1])
+        # Make sure the session being resumed is the intended one (resume_participant
+        # has to be set back to None in the params file once it's done)
+        msg = "Resuming the session of participant {0} at block {1}, trial {2}.".format(
+            P.participant_id, block_num, self.resumed_trials + 1)
+        fill()
+        message(msg + "\n\nPress any key to continue.", registration=5, location=P.screen_c)
+        flip()
+        any_key()
 
+    def build_assets(self, alignments):
+        # Converts stimulus sizes to pixels & renders every stimulus into the asset
+        # bundle. Only needed the first time the experiment runs on a screen setup,
+        # so the drawing libraries are only imported here.
+        from klibs.KLGraphics.KLDraw import Circle, FixationCross
+
+        sizes = dict((name, deg_to_px(deg)) for name, deg in STIMULUS_SIZES.items())
+        for name, size in sizes.items():
+            setattr(self, name, size)
+
+        surfaces = {'target': render_surface(Circle(diameter=self.target_diameter, fill=WHITE))}
+        for name, color in (('fixation_red', RED), ('fixation_white', WHITE)):
+            fix = FixationCross(size=self.fix_width, thickness=self.fix_thickness, fill=color)
+            surfaces[name] = render_surface(fix)
+        for alignment in alignments:
+            surfaces['placeholder_' + alignment] = render_surface(self.construct_placeholder(alignment))
+            surfaces['cue_' + alignment] = render_surface(self.construct_cue(alignment))
+
+        self.assets.geometry = {
+            'sizes': sizes,
+            'locations': stimulus_locations(P.screen_c, self.location_offset)
+        }
+        self.assets.surfaces = surfaces
 
-        return target_loc
+    def construct_placeholder(self, alignment):
+        from klibs.KLGraphics.KLDraw import Rectangle
 
-    def construct_placeholder(self):
         stroke = [self.rect_thickness, WHITE, STROKE_CENTER]
-        # width = None
-        # height = None
 
         # Horizontal/vertical indicates directionality of placeholders length
-        if self.box_alignment == VERTICAL:
+        if alignment == VERTICAL:
             width, height = self.rect_short_side, self.rect_long_side
 
         else:
@@ -358,10 +599,9 @@ class ObjectBasedCueingEffects_2020(klibs.Experiment):
 
         return Rectangle(width=width, height=height, stroke=stroke)
 
-    def construct_cue(self):
-
-        self.cue_seg_len = deg_to_px(1.7)
-        self.cue_seg_thick = deg_to_px(0.4)
+    def construct_cue(self, alignment):
+        from PIL import Image
+        import aggdraw
 
         canvas_size = [self.cue_seg_len, self.cue_seg_len]
 
@@ -374,7 +614,7 @@ class ObjectBasedCueingEffects_2020(klibs.Experiment):
         xy = [(0, 0, 0, self.cue_seg_len), (0, 0, self.cue_seg_len, 0)]
 
         # Add missing segment, dependent on orientation
-        if self.box_alignment == VERTICAL:
+        if alignment == VERTICAL:
             xy.append((self.cue_seg_len, self.cue_seg_len, 0, self.cue_seg_len))
 
         else:
@@ -387,16 +627,7 @@ class ObjectBasedCueingEffects_2020(klibs.Experiment):
 
         return np.asarray(canvas)
 
-    def which_list(self, x, contains, l1, l2):
-
-        if x in l1:
-            return l1 if contains else l2
-        elif x in l2:
-            return l2 if contains else l1
-        else:
-            print "element not in either list"
-            return None
-
+    @traced('log_and_recycle_trial')
     def log_and_recycle_trial(self, err_type):
         """
         Renders an error message to the screen and wait for a response. When a
@@ -404,11 +635,13 @@ class ObjectBasedCueingEffects_2020(klibs.Experiment):
         table and the trial is recycled.
 
         """
+        self.keys.disarm()  # let any_key() see key presses again
         flush()
         fill()
         message(self.err_msgs[err_type], registration=5, location=P.screen_c)
         flip()
-        any_key()
+        with self.tracer.span('error_message'):
+            any_key()
         err_data = {
             "participant_id": P.participant_id,
             "block_num": P.block_number,
@@ -417,72 +650,143 @@ class ObjectBasedCueingEffects_2020(klibs.Experiment):
             "cue_location": self.cue_location,
             "target_location": self.target_location,
             "box_alignment": self.box_alignment,
-            "err_type": err_type
+            "err_type": err_type,
+            "fixation_break_time": self.fixation_break_time if err_type == 'eye' else NA
         }
-        self.database.insert(data=err_data, table="trials_err")
+        self.stats.add_error(err_data)
+        self.writer.put('trials_err', err_data)
         raise TrialException(self.err_msgs[err_type])
 
     def wait_time(self):
         # Appropriated verbatim from original code written by John Christie
         if self.before_target:
-            gaze = self.el.gaze()
-            if not self.bi.within_boundary(label='drift_correct', p=gaze):
+            violation = self.check_fixation()
+            if violation is not None:
+                self.fixation_break_time = int(violation[0])
+                self.el.write("FIXATION_BREAK %d" % self.fixation_break_time)
                 self.log_and_recycle_trial('eye')
-            q = pump(True)
-            if key_pressed(queue=q):
-                if key_pressed(SDLK_SPACE, queue=q):
+            SDL_PumpEvents()
+            self.handle_hotkeys()
+            press = self.keys.next_press()
+            if press is not None:
+                if press[1] == SDLK_SPACE:
                     self.log_and_recycle_trial('early')
                 else:
                     self.log_and_recycle_trial('key')
 
+    def handle_hotkeys(self):
+        # Passes any KLibs hotkeys pressed while the capture thread is armed (which
+        # it leaves in SDL's queue) on to KLibs. SDL events must already be pumped.
+        hotkeys = self.hotkeys()
+        if len(hotkeys):
+            ui_request(queue=hotkeys)
+            # The pause & recalibration screens draw over the display, so the next
+            # frame has to be drawn in full
+            self.frames.invalidate()
+
+    def check_fixation(self):
+        """
+        Checks whether gaze has left the fixation boundary, returning the first
+        [timestamp, x, y] gaze sample outside of it (or None if gaze stayed inside).
+
+        If P.gaze_sample_batching is True, every sample the tracker has buffered
+        since the last check is tested, so brief excursions between checks don't
+        go unnoticed. Otherwise, only the current gaze position is checked.
+
+        """
+        self.tracer.incr('gaze_polls')
+        if P.gaze_sample_batching:
+            return self.fixation.first_violation(self.gaze_samples.read())
+
+        gaze = self.el.gaze()
+        if not self.bi.within_boundary(label='drift_correct', p=gaze):
+            return (self.el.now(), gaze[0], gaze[1])
+        return None
+
+    def collect_keypress(self):
+        """
+        Waits for a spacebar press until the end of the response interval, returning
+        the RT (in ms, from target onset) or TIMEOUT.
+
+        Presses are collected by the capture thread, so this loop only needs to
+        keep SDL's event queue pumped (which can only be done on the main thread),
+        pass on any hotkeys and check fixation; the display is only redrawn if its
+        content changes.
+
+        """
+        onset = self.target_time
+        self.input_pacer.start()
+        while True:
+            press = self.keys.first_press([SDLK_SPACE], after=onset)
+            if press is not None:
+                return (press[0] - onset) * 1000.0
+            if not self.evm.before('task_end'):
+                return TIMEOUT
+            SDL_PumpEvents()
+            self.handle_hotkeys()
+            self.display_refresh(target=True)
+            self.input_pacer.wait()
+
     def record_saccades(self):
         # Following code a rehashing of code borrowed from John Christie's original code
 
         # Get & write time of target onset
         target_onset = self.el.now()
+        self.target_onset = target_onset
         self.el.write("TARGET_ON %d" % target_onset)
-
-        # Until 2500ms post target onset, or until target fixated
-        while self.el.now() - 2500 and not self.target_acquired:
-            self.display_refresh(target=True)
+        self.el.write("TARGET_POS %d %d" % tuple(self.target_loc))
+
+        # Until 2500ms post target onset, or until target fixated, poll the tracker
+        # once per refresh (rather than spinning) for the end points of saccades made
+        deadline = target_onset + RESPONSE_TIMEOUT
+        polls = 0
+        frames = 0
+        self.gaze_samples.events()  # drop any saccades from before target onset
+        self.response_pacer.start()
+        while self.el.now() < deadline and not self.target_acquired:
+            # Only re-presents the frame if something on it has changed
+            if self.display_refresh(target=True):
+                frames += 1
             pump()
-            # Get end point of saccades made
-            queue = self.el.get_event_queue([EL_SACCADE_END])
+            self.handle_hotkeys()
+            if self.gaze_samples.buffered:
+                # Samples & events share the tracker's buffer, so drain them together
+                self.gaze_samples.read()
+                queue = self.gaze_samples.events()
+            else:
+                queue = self.el.get_event_queue([EL_SACCADE_END])
+            polls += 1
+            self.tracer.incr('gaze_polls')
             # Check to see if saccade was made to target
             for saccade in queue:
-                # Get end point of saccade
-                gaze = saccade.getEndGaze()
-                # Check if gaze fell outside fixation boundary
-                if lsl(gaze, P.screen_c) > self.gaze_boundary:
-                    # Get distance between gaze and target
-                    dist_from_target = lsl(gaze, self.target_loc)
-                    # Log if saccade is inside or outside boundary around target
-                    accuracy = SACC_OUTSIDE if dist_from_target > self.gaze_boundary else SACC_INSIDE
-
-                    # If more than one saccade
-                    if len(self.saccades):
-                        # Grab duration of saccade, relative to the previous saccade
-                        # Not entirely sure why 4 is added....
-                        duration = saccade.getStartTime() + 4 - self.saccades[-1]['end_time']
-                    # Otherwise, get duration of saccade relative to target onset
-                    else:
-                        duration = saccade.getStartTime() + 4 - target_onset
-
-                    # Write saccade info to database
-                    if len(self.saccades) < 3:
-                        self.saccades.append({
-                            "rt": saccade.getStartTime() - target_onset,
-                            "accuracy": accuracy,
-                            "dist_from_target": dist_from_target,
-                            "start_x": saccade.getStartGaze()[0],
-                            "start_y": saccade.getStartGaze()[1],
-                            "end_x": saccade.getEndGaze()[0],
-                            "end_y": saccade.getEndGaze()[1],
-                            "end_time": saccade.getEndTime(),
-                            "duration": duration
-                        })
-
-                    # Target found = True if gaze within boundary surrounding target
-                    if dist_from_target <= self.gaze_boundary:
-                        self.target_acquired = True
-                        break
+                self.process_saccade(saccade, target_onset)
+                if self.target_acquired:
+                    break
+            if not self.target_acquired:
+                self.response_pacer.wait()
+
+        self.response_loop_stats = {'polls': polls, 'frames': frames}
+        self.el.write("RESPONSE_LOOP polls=%d frames=%d" % (polls, frames))
+        if P.development_mode:
+            print "response loop: {0} polls, {1} frames".format(polls, frames)
+
+    def process_saccade(self, saccade, target_onset):
+        # Scored by score_saccade() so that offline re-detection (tools/redetect_saccades.py)
+        # scores saccades exactly the same way
+        previous = self.saccades[-1] if len(self.saccades) else None
+        scored = score_saccade(
+            saccade.getStartTime(), saccade.getEndTime(), saccade.getStartGaze(),
+            saccade.getEndGaze(), target_onset, previous, P.screen_c, self.target_loc,
+            self.gaze_boundary
+        )
+        # Ignore saccades that ended within the fixation boundary
+        if scored is None:
+            return
+
+        # Write saccade info to database
+        if len(self.saccades) < 3:
+            self.saccades.append(scored)
+
+        # Target found = True if gaze within boundary surrounding target
+        if scored['dist_from_target'] <= self.gaze_boundary:
+            self.target_acquired = True
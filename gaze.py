@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+import os
+import math
+
+import numpy as np
+
+try:
+    from pylink import SAMPLE_TYPE, MISSING_DATA
+    from pylink import STARTBLINK, ENDBLINK, STARTSACC, ENDSACC, STARTFIX, ENDFIX
+except ImportError:
+    SAMPLE_TYPE = 200
+    MISSING_DATA = -32768
+    STARTBLINK, ENDBLINK, STARTSACC, ENDSACC, STARTFIX, ENDFIX = 3, 4, 5, 6, 7, 8
+
+# Eye movement phase of each recorded sample, from the tracker's parsed events
+PHASE_NONE = 0
+PHASE_FIXATION = 1
+PHASE_SACCADE = 2
+PHASE_BLINK = 3
+
+EVENT_PHASES = {
+    STARTFIX: PHASE_FIXATION, ENDFIX: PHASE_NONE,
+    STARTSACC: PHASE_SACCADE, ENDSACC: PHASE_NONE,
+    STARTBLINK: PHASE_BLINK, ENDBLINK: PHASE_NONE
+}
+
+# Whether a saccade landed inside or outside the boundary around the target
+SACC_INSIDE = "inside"
+SACC_OUTSIDE = "outside"
+
+# On-disk layout of recorded gaze samples (21 bytes per sample)
+SAMPLE_DTYPE = np.dtype([
+    ('t', '<f8'), ('x', '<f4'), ('y', '<f4'), ('pupil', '<f4'), ('phase', 'u1')
+])
+
+
+def score_saccade(start_time, end_time, start_xy, end_xy, target_onset, previous,
+                  centre, target_xy, boundary):
+    """Scores a saccade made during the response interval, the same way online and
+    offline.
+
+    Args:
+        start_time (float): Tracker time of saccade onset.
+        end_time (float): Tracker time of saccade offset.
+        start_xy (tuple): Gaze position at saccade onset.
+        end_xy (tuple): Gaze position at saccade offset.
+        target_onset (float): Tracker time of target onset.
+        previous (dict): The last saccade scored on the trial, or None.
+        centre (tuple): The centre of the fixation boundary.
+        target_xy (tuple): The location of the target.
+        boundary (float): The radius of the fixation & target boundaries.
+
+    Returns:
+        dict: The saccade's fields for the 'saccades' table (plus its 'end_time'),
+        or None if the saccade ended within the fixation boundary.
+
+    """
+    if math.hypot(end_xy[0] - centre[0], end_xy[1] - centre[1]) <= boundary:
+        return None
+
+    # Distance between gaze and target, and whether gaze landed within the target boundary
+    dist_from_target = math.hypot(end_xy[0] - target_xy[0], end_xy[1] - target_xy[1])
+    accuracy = SACC_OUTSIDE if dist_from_target > boundary else SACC_INSIDE
+
+    # Duration is relative to the end of the previous saccade if there was one,
+    # otherwise relative to target onset. Not entirely sure why 4 is added....
+    if previous is not None:
+        duration = start_time + 4 - previous['end_time']
+    else:
+        duration = start_time + 4 - target_onset
+
+    return {
+        "rt": start_time - target_onset,
+        "accuracy": accuracy,
+        "dist_from_target": dist_from_target,
+        "start_x": start_xy[0],
+        "start_y": start_xy[1],
+        "end_x": end_xy[0],
+        "end_y": end_xy[1],
+        "end_time": end_time,
+        "duration": duration
+    }
+
+
+class TrackerSampleSource(object):
+    """Reads every gaze sample the eye tracker has buffered since the last read.
+
+    Samples are returned as an (n, 3) float array of [timestamp, x, y] rows. When
+    no sample buffer is available (e.g. when using the mouse as a stand-in for an
+    eye tracker), the current gaze position is returned as a single sample.
+
+    Since samples and events come off the same link buffer, any events of the
+    given types are kept while reading so that they can be retrieved with events()
+    instead of being lost. If a recorder is given, every sample read while it's
+    recording is also passed to it, along with its pupil size and eye movement
+    phase.
+
+    Args:
+        el: The klibs EyeLink object for the experiment.
+        recorder (:obj:`GazeRecorder`, optional): Records every sample read.
+        event_types (list, optional): Types of tracker events to keep.
+
+    """
+
+    def __init__(self, el, recorder=None, event_types=[]):
+        self.el = el
+        self.recorder = recorder
+        self.event_types = set(event_types)
+        self.buffered = hasattr(el, 'getNextData') and hasattr(el, 'getFloatData')
+        self.phase = PHASE_NONE
+        self._events = []
+
+    def read(self):
+        if not self.buffered:
+            x, y = self.el.gaze()
+            rows = np.array([[self.el.now(), x, y, np.nan, PHASE_NONE]], dtype=np.float64)
+            self._record(rows)
+            return rows[:, :3]
+
+        rows = []
+        while True:
+            data_type = self.el.getNextData()
+            if not data_type:
+                break
+            if data_type != SAMPLE_TYPE:
+                self.phase = EVENT_PHASES.get(data_type, self.phase)
+                if data_type in self.event_types:
+                    self._events.append(self.el.getFloatData())
+                continue
+            sample = self.el.getFloatData()
+            if sample is None:
+                continue
+            eye = sample.getRightEye() if sample.isRightSample() else sample.getLeftEye()
+            x, y = eye.getGaze()
+            rows.append((sample.getTime(), x, y, eye.getPupilSize(), self.phase))
+        rows = np.array(rows, dtype=np.float64).reshape(-1, 5)
+        self._record(rows)
+        return rows[:, :3]
+
+    def events(self):
+        """Returns (and forgets) the events of the kept types read since the last
+        call to events() or discard().
+
+        """
+        events, self._events = self._events, []
+        return events
+
+    def discard(self):
+        """Throws away any samples and events currently in the buffer."""
+        if self.buffered:
+            self.read()
+        self._events = []
+
+    def _record(self, rows):
+        if self.recorder is not None and self.recorder.recording:
+            self.recorder.add(rows)
+
+
+class GazeRecorder(object):
+    """Records every gaze sample of a trial into a preallocated structured ring
+    buffer, and appends the samples of each completed trial to a per-participant
+    binary file of SAMPLE_DTYPE records.
+
+    Each flush returns the offset (in samples) of the trial's samples within the
+    file, so they can be indexed by trial and memory-mapped back in with
+    load_gaze_samples(). If a trial has more samples than the buffer can hold,
+    the oldest ones are overwritten and counted as dropped.
+
+    Args:
+        path (str): The path of the file to append samples to.
+        capacity (int, optional): The number of samples the buffer can hold.
+
+    """
+
+    def __init__(self, path, capacity=32768):
+        self.path = path
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self.count = 0
+        self.recording = False
+        self.offset = 0
+        if os.path.exists(path):
+            self.offset = os.path.getsize(path) // SAMPLE_DTYPE.itemsize
+
+    @property
+    def dropped(self):
+        """int: The number of samples overwritten since the last flush."""
+        return max(0, self.count - self.capacity)
+
+    def begin(self):
+        """Clears the buffer and starts recording."""
+        self.count = 0
+        self.recording = True
+
+    def stop(self):
+        self.recording = False
+
+    def add(self, rows):
+        """Adds an (n, 5) array of [timestamp, x, y, pupil, phase] rows."""
+        n = len(rows)
+        if not n:
+            return
+        if n > self.capacity:
+            self.count += n - self.capacity
+            rows = rows[-self.capacity:]
+            n = self.capacity
+        idx = (self.count + np.arange(n)) % self.capacity
+        for i, field in enumerate(SAMPLE_DTYPE.names):
+            self.buffer[field][idx] = rows[:, i]
+        self.count += n
+
+    def samples(self):
+        """Returns the buffered samples in the order they were recorded."""
+        if self.count <= self.capacity:
+            return self.buffer[:self.count]
+        i = self.count % self.capacity
+        return np.concatenate([self.buffer[i:], self.buffer[:i]])
+
+    def flush(self):
+        """Appends the buffered samples to the file and clears the buffer.
+
+        Returns:
+            tuple: The (offset, count, dropped) of the samples written.
+
+        """
+        samples = self.samples()
+        result = (self.offset, len(samples), self.dropped)
+        with open(self.path, 'ab') as f:
+            samples.tofile(f)
+        self.offset += len(samples)
+        self.discard()
+        return result
+
+    def discard(self):
+        """Throws away the buffered samples and stops recording."""
+        self.count = 0
+        self.recording = False
+
+
+def load_gaze_samples(path, offset, count):
+    """Memory-maps the samples of a single trial from a gaze sample file written by
+    a GazeRecorder, returning them as an array of SAMPLE_DTYPE records.
+
+    """
+    if count == 0:
+        return np.zeros(0, dtype=SAMPLE_DTYPE)
+    samples = np.memmap(path, dtype=SAMPLE_DTYPE, mode='r')
+    return samples[offset:offset + count]
+
+
+class FixationMonitor(object):
+    """Checks batches of gaze samples against a circular fixation boundary all at
+    once.
+
+    Samples with missing gaze data (e.g. during blinks) are ignored.
+
+    Args:
+        centre (tuple): The (x, y) centre of the fixation boundary, in pixels.
+        radius (float): The radius of the fixation boundary, in pixels.
+
+    """
+
+    def __init__(self, centre, radius):
+        self.centre = np.asarray(centre, dtype=np.float64)
+        self.radius = float(radius)
+
+    def first_violation(self, samples):
+        """Returns the first [timestamp, x, y] sample in an (n, 3) array of samples
+        that falls outside the fixation boundary, or None if all samples are within
+        it.
+
+        """
+        if not len(samples):
+            return None
+        xy = samples[:, 1:3]
+        valid = np.all(np.isfinite(xy) & (xy != MISSING_DATA), axis=1)
+        offset = xy - self.centre
+        outside = valid & ((offset * offset).sum(axis=1) > self.radius ** 2)
+        if not outside.any():
+            return None
+        return samples[np.argmax(outside)]
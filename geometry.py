@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import math
+from collections import namedtuple
+
+HORIZONTAL = 'horizontal'
+VERTICAL = 'vertical'
+
+CUED_LOCATION = 'cued_location'
+CUED_OBJECT = 'cued_object'
+UNCUED_ADJACENT = 'uncued_adjacent'
+UNCUED_OPPOSITE = 'uncued_opposite'
+CATCH = 'catch'
+
+# Names of the locations of the centres of the two placeholders for each alignment
+# (vertical placeholders sit left & right of fixation, horizontal ones above & below)
+BOX_CENTRES = {
+    VERTICAL: ('left', 'right'),
+    HORIZONTAL: ('top', 'bottom')
+}
+
+# Names of the locations of the two ends of each placeholder for each alignment
+BOX_ENDS = {
+    VERTICAL: (('top_left', 'bottom_left'), ('top_right', 'bottom_right')),
+    HORIZONTAL: (('top_left', 'top_right'), ('bottom_left', 'bottom_right'))
+}
+
+
+TrialGeometry = namedtuple('TrialGeometry', ['cue', 'target', 'box1', 'box2'])
+
+
+def stimulus_locations(screen_c, offset):
+    """Returns the pixel coordinates of every possible stimulus location, given the
+    centre of the screen and the offset (in px) between fixation and placeholders.
+
+    """
+    cx, cy = screen_c
+    return {
+        'left': (cx - offset, cy),
+        'right': (cx + offset, cy),
+        'top': (cx, cy - offset),
+        'bottom': (cx, cy + offset),
+        'top_left': (cx - offset, cy - offset),
+        'top_right': (cx + offset, cy - offset),
+        'bottom_left': (cx - offset, cy + offset),
+        'bottom_right': (cx + offset, cy + offset)
+    }
+
+
+def pixels_per_degree(screen_size, diagonal_in, view_distance):
+    """Returns the number of pixels per degree of visual angle for a screen of a
+    given resolution and diagonal size (in inches) at a given viewing distance (in
+    cm).
+
+    """
+    diagonal_px = math.sqrt(screen_size[0] ** 2 + screen_size[1] ** 2)
+    px_per_cm = diagonal_px / (diagonal_in * 2.54)
+    return px_per_cm * view_distance * math.tan(math.radians(1))
+
+
+def factor_levels(ind_vars, names):
+    """Returns a {factor: [levels]} dict for the given factors of a klibs
+    IndependentVariableSet.
+
+    """
+    levels = {}
+    for name in names:
+        values = []
+        for v in ind_vars[name].values:
+            # Values can be stored as [value, frequency] pairs
+            values.append(v[0] if isinstance(v, (list, tuple)) else v)
+        levels[name] = values
+    return levels
+
+
+def target_location_name(alignment, cue_location, target_location):
+    """Returns the name of the location (e.g. 'top_left') a target appears at for a
+    given box alignment, cue location, and cue-target relation, or None for catch
+    trials.
+
+    """
+    if target_location == CATCH:
+        return None
+
+    cued_box, uncued_box = BOX_ENDS[alignment]
+    if cue_location not in cued_box:
+        cued_box, uncued_box = uncued_box, cued_box
+    if cue_location not in cued_box:
+        raise ValueError("Unknown cue location '{0}'".format(cue_location))
+
+    if target_location == CUED_LOCATION:
+        return cue_location
+    elif target_location == CUED_OBJECT:
+        return cued_box[1 - cued_box.index(cue_location)]
+
+    # The adjacent end of the uncued box is the one on the same side as the cue
+    # (same vertical half for vertical boxes, same horizontal half for horizontal)
+    side = cue_location.split('_')[0 if alignment == VERTICAL else 1]
+    adjacent = [end for end in uncued_box if side in end.split('_')][0]
+    if target_location == UNCUED_ADJACENT:
+        return adjacent
+    elif target_location == UNCUED_OPPOSITE:
+        return [end for end in uncued_box if end != adjacent][0]
+
+    raise ValueError("Unknown target location '{0}'".format(target_location))
+
+
+class TargetGeometryTable(object):
+    """Precomputed cue position, target position, and placeholder centres for every
+    combination of box alignment, cue location, and target location.
+
+    Args:
+        locations (dict): Pixel coordinates of each named stimulus location (see
+            stimulus_locations).
+        alignments (list): Box alignments to build the table for.
+        cue_locations (list): Cue locations to build the table for.
+        target_locations (list): Target locations (cue-target relations) to build
+            the table for.
+
+    """
+
+    def __init__(self, locations, alignments, cue_locations, target_locations):
+        self.locations = dict((k, tuple(v)) for k, v in locations.items())
+        self.table = {}
+        for alignment in alignments:
+            box1, box2 = self.box_centres(alignment)
+            for cue in cue_locations:
+                for target in target_locations:
+                    name = target_location_name(alignment, cue, target)
+                    target_loc = None if name is None else self.locations[name]
+                    self.table[(alignment, cue, target)] = TrialGeometry(
+                        self.locations[cue], target_loc, box1, box2
+                    )
+        self.validate(alignments, cue_locations, target_locations)
+
+    def __getitem__(self, key):
+        return self.table[key]
+
+    def __len__(self):
+        return len(self.table)
+
+    def lookup(self, alignment, cue_location, target_location):
+        return self.table[(alignment, cue_location, target_location)]
+
+    def box_centres(self, alignment):
+        return tuple(self.locations[name] for name in BOX_CENTRES[alignment])
+
+    def validate(self, alignments, cue_locations, target_locations):
+        """Checks every combination of factor levels against the rules of the
+        paradigm, raising a ValueError on the first combination that breaks one.
+
+        """
+        def fail(key, problem):
+            raise ValueError("Invalid target geometry for {0}: {1}".format(key, problem))
+
+        for alignment in alignments:
+            box_ends = [
+                set(self.locations[n] for n in ends) for ends in BOX_ENDS[alignment]
+            ]
+            for cue in cue_locations:
+                seen = {}
+                for target in target_locations:
+                    key = (alignment, cue, target)
+                    if key not in self.table:
+                        fail(key, "combination missing from table")
+                    geo = self.table[key]
+                    if geo.box1 == geo.box2:
+                        fail(key, "placeholders overlap")
+                    if target == CATCH:
+                        if geo.target is not None:
+                            fail(key, "catch trial has a target location")
+                        continue
+                    if geo.target in seen.values():
+                        fail(key, "target location shared with another condition")
+                    seen[target] = geo.target
+
+                    cued_box = [ends for ends in box_ends if geo.cue in ends]
+                    if len(cued_box) != 1:
+                        fail(key, "cue is not at the end of exactly one placeholder")
+                    same_box = geo.target in cued_box[0]
+                    if target == CUED_LOCATION and geo.target != geo.cue:
+                        fail(key, "target not at cued location")
+                    if target == CUED_OBJECT and (not same_box or geo.target == geo.cue):
+                        fail(key, "target not at other end of cued placeholder")
+                    if target in (UNCUED_ADJACENT, UNCUED_OPPOSITE) and same_box:
+                        fail(key, "target not in uncued placeholder")
+                    if target == UNCUED_ADJACENT or target == UNCUED_OPPOSITE:
+                        # Adjacent shares the cue's x (horizontal) or y (vertical)
+                        axis = 1 if alignment == VERTICAL else 0
+                        aligned = geo.target[axis] == geo.cue[axis]
+                        if aligned != (target == UNCUED_ADJACENT):
+                            fail(key, "target on wrong side of uncued placeholder")
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import threading
+
+from timing import clock
+
+
+def ticks_to_clock(timestamp, ticks, now):
+    """Converts an SDL event timestamp (in milliseconds of SDL_GetTicks(), which
+    wraps around at 2**32) to a time on another clock, given a reading of that
+    clock (in seconds) taken at the same time as a reading of SDL_GetTicks().
+
+    """
+    return now - ((ticks - timestamp) & 0xFFFFFFFF) / 1000.0
+
+
+def _is_hotkey(event):
+    # KLibs hotkeys (e.g. quit and calibrate) are pressed with Ctrl or Cmd held
+    import sdl2
+    return bool(event.key.keysym.mod & (sdl2.KMOD_CTRL | sdl2.KMOD_GUI))
+
+
+def _peek_keydowns(events):
+    import sdl2
+    n = sdl2.SDL_PeepEvents(
+        events, len(events), sdl2.SDL_PEEKEVENT, sdl2.SDL_KEYDOWN, sdl2.SDL_KEYDOWN
+    )
+    return max(n, 0)
+
+
+def _get_keydowns(events, n):
+    import sdl2
+    if n > 0:
+        n = sdl2.SDL_PeepEvents(events, n, sdl2.SDL_GETEVENT, sdl2.SDL_KEYDOWN, sdl2.SDL_KEYDOWN)
+    return max(n, 0)
+
+
+def sdl_keydown_source(max_events=16, clock=clock):
+    """Returns a function that removes new key-down events from SDL's event queue
+    and returns them as a list of (timestamp, keycode) presses.
+
+    Presses are timestamped with the time SDL queued their events, converted to the
+    given clock, so timestamps don't depend on how soon the events are read (only
+    on how often SDL_PumpEvents is called). Presses of KLibs hotkeys are left in
+    the queue, along with any key-downs queued after them, until they're taken by
+    the main thread (see sdl_hotkey_source).
+
+    SDL_PeepEvents is thread-safe, so this can be called from a background thread.
+    However, SDL only moves new events from the OS into its queue when
+    SDL_PumpEvents is called, which must happen on the main thread.
+
+    """
+    import sdl2
+    events = (sdl2.SDL_Event * max_events)()
+
+    def read():
+        # Only take the key-downs queued before the first hotkey (the main thread
+        # only takes hotkeys from the front of the queue, so neither thread can take
+        # the other's events)
+        n = _peek_keydowns(events)
+        presses = next((i for i in range(n) if _is_hotkey(events[i])), n)
+        n = _get_keydowns(events, presses)
+        now, ticks = clock(), sdl2.SDL_GetTicks()
+        return [
+            (ticks_to_clock(events[i].key.timestamp, ticks, now), events[i].key.keysym.sym)
+            for i in range(n) if not events[i].key.repeat
+        ]
+
+    return read
+
+
+def sdl_hotkey_source(max_events=16):
+    """Returns a function for the main thread that removes any presses of KLibs
+    hotkeys from the front of SDL's key-down events (where sdl_keydown_source
+    leaves them) and returns copies of their events, to be handed to KLibs with
+    ui_request(queue=...).
+
+    """
+    import sdl2
+    events = (sdl2.SDL_Event * max_events)()
+
+    def read():
+        n = _peek_keydowns(events)
+        hotkeys = next((i for i in range(n) if not _is_hotkey(events[i])), n)
+        n = _get_keydowns(events, hotkeys)
+        return [sdl2.SDL_Event.from_buffer_copy(events[i]) for i in range(n)]
+
+    return read
+
+
+class KeypressCapture(object):
+    """Timestamps key presses on a dedicated high-priority thread, independent of
+    how often the display is redrawn.
+
+    While armed, the capture thread polls for new key presses every poll_interval
+    seconds. Presses come from the source already timestamped on the same
+    monotonic high-resolution clock used to timestamp flips. To keep polling
+    regular, the interpreter's thread switch interval is lowered while armed.
+
+    Args:
+        source (callable): Returns a list of (timestamp, keycode) tuples for any
+            new key presses (see sdl_keydown_source).
+        poll_interval (float, optional): Seconds between polls of the source.
+
+    """
+
+    def __init__(self, source, poll_interval=0.0005):
+        self.source = source
+        self.poll_interval = poll_interval
+        self.armed = False
+        self._presses = []
+        self._checked = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._switch_interval = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="KeypressCapture")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.disarm()
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def arm(self):
+        """Clears any previous presses and starts capturing new ones."""
+        with self._lock:
+            self._presses = []
+            self._checked = 0
+        if self._switch_interval is None:
+            self._switch_interval = _get_switch_interval()
+            _set_switch_interval(self.poll_interval / 2.0)
+        self.armed = True
+
+    def disarm(self):
+        """Stops capturing presses (leaving key events in the SDL queue)."""
+        self.armed = False
+        if self._switch_interval is not None:
+            _set_switch_interval(self._switch_interval)
+            self._switch_interval = None
+
+    def presses(self):
+        """Returns a list of (timestamp, keycode) tuples for all captured presses."""
+        with self._lock:
+            return list(self._presses)
+
+    def next_press(self):
+        """Returns the oldest (timestamp, keycode) press not yet returned by this
+        method, or None if there isn't one.
+
+        """
+        with self._lock:
+            if self._checked < len(self._presses):
+                self._checked += 1
+                return self._presses[self._checked - 1]
+        return None
+
+    def first_press(self, keys=None, after=None):
+        """Returns the first (timestamp, keycode) press of any of the given keys
+        (or of any key, if keys is None) at or after a given time, or None if there
+        hasn't been one.
+
+        """
+        with self._lock:
+            for t, key in self._presses:
+                if (keys is None or key in keys) and (after is None or t >= after):
+                    return (t, key)
+        return None
+
+    def _run(self):
+        while self._running:
+            if self.armed:
+                presses = self.source()
+                if len(presses):
+                    with self._lock:
+                        self._presses.extend(presses)
+            time.sleep(self.poll_interval)
+
+
+def _get_switch_interval():
+    if hasattr(sys, 'getswitchinterval'):
+        return sys.getswitchinterval()
+    return sys.getcheckinterval()
+
+
+def _set_switch_interval(value):
+    if hasattr(sys, 'setswitchinterval'):
+        sys.setswitchinterval(value)
+    else:
+        # Python 2 counts bytecode instructions between switches instead of time
+        sys.setcheckinterval(10 if value < 0.005 else value)
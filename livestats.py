@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+import math
+from collections import OrderedDict
+
+NA = 'NA'
+
+
+class RunningStats(object):
+    """Count, mean and variance of a stream of values, updated in constant time
+    (Welford's algorithm).
+
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+    @property
+    def sd(self):
+        return math.sqrt(self._m2 / (self.n - 1)) if self.n > 1 else float('nan')
+
+
+class P2Quantile(object):
+    """Estimates a quantile of a stream of values in constant time and space, using
+    the five markers of the P-square algorithm (Jain & Chlamtac, 1985).
+
+    Args:
+        p (float): The quantile to estimate (e.g. 0.5 for the median).
+
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.n = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2.0, p, (1 + p) / 2.0, 1]
+
+    def add(self, x):
+        self.n += 1
+        q = self.heights
+        if self.n <= 5:
+            q.append(x)
+            q.sort()
+            return
+
+        # Find the cell the value falls in, extending the extremes if needed
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        n = self.positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / float(n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / float(n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / float(n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / float(n[i] - n[i - 1])
+        )
+
+    @property
+    def value(self):
+        """float: The current estimate (exact until there are more than 5 values)."""
+        if self.n == 0:
+            return float('nan')
+        if self.n <= 5:
+            return self.heights[int(round(self.p * (self.n - 1)))]
+        return self.heights[2]
+
+
+class CellStats(object):
+    """Running statistics for one (box_alignment, target_location) cell."""
+
+    def __init__(self):
+        self.trials = 0
+        self.hits = 0  # targets acquired / responded to, or false alarms for catch trials
+        self.rt = RunningStats()
+        self.median_rt = P2Quantile(0.5)
+        self.first_saccades = 0
+        self.inside = 0  # first saccades that landed inside the target boundary
+
+    def add(self, hit, rt, accuracy):
+        self.trials += 1
+        self.hits += int(hit)
+        if rt is not None:
+            self.rt.add(rt)
+            self.median_rt.add(rt)
+        if accuracy is not None:
+            self.first_saccades += 1
+            self.inside += int(accuracy == 'inside')
+
+
+class SessionMonitor(object):
+    """Keeps running per-cell statistics for the session from each completed trial's
+    data and each recycled trial's error data, without touching the database, and
+    summarizes them for the experimenter's console.
+
+    Args:
+        alignments (list): The levels of the box_alignment factor.
+        target_locations (list): The levels of the target_location factor.
+        catch (str, optional): The target_location of catch trials.
+
+    """
+
+    def __init__(self, alignments, target_locations, catch='catch'):
+        self.catch = catch
+        self.cells = OrderedDict(
+            ((a, t), CellStats()) for a in alignments for t in target_locations
+        )
+        self.errors = OrderedDict()
+        self.moved_eyes = 0
+        self.trials = 0
+
+    def add_trial(self, data, saccades=[]):
+        """Adds a completed trial, given the dict returned by trial() and the trial's
+        saccades.
+
+        """
+        cell = self.cells[(data['box_alignment'], data['target_location'])]
+        catch = data['target_location'] == self.catch
+        if data['session_type'] == 'saccade':
+            first = saccades[0] if len(saccades) else None
+            rt = first['rt'] if first is not None else None
+            hit = first is not None if catch else data['target_acquired'] == 'TRUE'
+            accuracy = first['accuracy'] if first is not None and not catch else None
+        else:
+            rt = data['keypress_rt']
+            hit = rt is not None
+            accuracy = None
+            self.moved_eyes += int(data['moved_eyes'] == 'TRUE')
+        cell.add(hit, None if catch else rt, accuracy)
+        self.trials += 1
+
+    def add_error(self, data):
+        """Adds a recycled trial, given its row for the 'trials_err' table."""
+        err_type = data['err_type']
+        self.errors[err_type] = self.errors.get(err_type, 0) + 1
+
+    def summary(self):
+        """Returns a table of the statistics so far, for printing."""
+        recycled = sum(self.errors.values())
+        errors = ", ".join("{0}: {1}".format(k, v) for k, v in self.errors.items())
+        lines = ["{0} trials completed, {1} recycled{2}".format(
+            self.trials, recycled, " ({0})".format(errors) if recycled else ""
+        )]
+        lines.append("{0:<12}{1:<18}{2:>5}{3:>8}{4:>10}{5:>8}{6:>10}{7:>8}".format(
+            "alignment", "target", "n", "hit %", "mean RT", "sd", "median", "acc %"
+        ))
+        false_alarms, catch_trials = 0, 0
+        for (alignment, target), cell in self.cells.items():
+            if target == self.catch:
+                false_alarms += cell.hits
+                catch_trials += cell.trials
+                continue
+            lines.append("{0:<12}{1:<18}{2:>5}{3:>8}{4:>10}{5:>8}{6:>10}{7:>8}".format(
+                alignment, target, cell.trials, _percent(cell.hits, cell.trials),
+                _ms(cell.rt.mean if cell.rt.n else None), _ms(cell.rt.sd),
+                _ms(cell.median_rt.value), _percent(cell.inside, cell.first_saccades)
+            ))
+        if catch_trials:
+            lines.append("catch trials responded to: {0} of {1} ({2}%)".format(
+                false_alarms, catch_trials, _percent(false_alarms, catch_trials)
+            ))
+        if self.moved_eyes:
+            lines.append("moved eyes during response: {0}".format(self.moved_eyes))
+        return "\n".join(lines)
+
+
+def _percent(n, total):
+    return "{0:.1f}".format(100.0 * n / total) if total else NA
+
+
+def _ms(value):
+    if value is None or value != value:  # nan
+        return NA
+    return "{0:.1f}".format(value)
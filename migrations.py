@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+In-place upgrades for experiment databases created from older versions of the
+project schema.
+
+'klibs db-rebuild' can only apply schema changes by deleting the database and
+all data in it. Instead, each change made to the schema since the original
+release has a migration here, and the database's 'user_version' records how
+many of them have been applied. Databases created from the current schema file
+start at SCHEMA_VERSION (set by the PRAGMA at the end of the file), so only
+older databases are ever changed.
+
+Table and index definitions are read from the schema file, so it stays the one
+place where they're written out.
+
+"""
+
+import re
+
+from datastore import connect
+
+
+def schema_statements(schema_path):
+    """Returns the CREATE TABLE statements (by table) and CREATE INDEX statements
+    (by index) in a schema file.
+
+    """
+    with open(schema_path) as f:
+        sql = re.sub(r"/\*.*?\*/|--[^\n]*", "", f.read(), flags=re.S)
+    tables, indexes = {}, {}
+    for statement in sql.split(";"):
+        statement = statement.strip()
+        table = re.match(r"CREATE TABLE (\w+)", statement, re.I)
+        index = re.match(r"CREATE INDEX (?:IF NOT EXISTS )?(\w+)", statement, re.I)
+        if table:
+            tables[table.group(1)] = statement
+        elif index:
+            indexes[index.group(1)] = statement
+    return tables, indexes
+
+
+def _columns(db, table):
+    return [row[1] for row in db.execute("PRAGMA table_info({0})".format(table))]
+
+
+# Columns added to existing tables since the original schema, with their types and
+# the values given to rows recorded before they existed
+ADDED_COLUMNS = [
+    ('trials_err', 'fixation_break_time', 'text', "'NA'"),
+    ('gaze_index', 'target_onset', 'text', "'NA'")
+]
+
+
+def _add_tables(db, tables, indexes):
+    # Tables and columns added since the original schema: per-trial frame timing,
+    # raw gaze sample indexes, session sequences & checkpoints, and the time of
+    # fixation breaks on recycled trials
+    for name, statement in tables.items():
+        if not len(_columns(db, name)):
+            db.execute(statement)
+    for table, column, datatype, default in ADDED_COLUMNS:
+        if column not in _columns(db, table):
+            db.execute("ALTER TABLE {0} ADD COLUMN {1} {2} not null default {3}".format(
+                table, column, datatype, default
+            ))
+
+
+def _numeric_keypress_rt(db, tables, indexes):
+    # keypress_rt used to be text holding either an RT or 'NA'/'TIMEOUT'. SQLite
+    # can't change a column's type, so the trials table is rebuilt (keeping its
+    # ids) with RTs as numbers and NULL where there wasn't one.
+    columns = _columns(db, 'trials')
+    values = [
+        "CASE WHEN keypress_rt IN ('NA', 'TIMEOUT', '') THEN NULL "
+        "ELSE CAST(keypress_rt AS REAL) END" if c == 'keypress_rt' else c
+        for c in columns
+    ]
+    db.execute("ALTER TABLE trials RENAME TO trials_old")
+    db.execute(tables['trials'])
+    db.execute("INSERT INTO trials ({0}) SELECT {1} FROM trials_old".format(
+        ", ".join(columns), ", ".join(values)
+    ))
+    db.execute("DROP TABLE trials_old")
+
+
+def _add_indexes(db, tables, indexes):
+    # Indexes for the participant & trial id lookups every export and join uses
+    for statement in indexes.values():
+        db.execute(re.sub(
+            r"CREATE INDEX (?!IF NOT EXISTS)", "CREATE INDEX IF NOT EXISTS ", statement, flags=re.I
+        ))
+
+
+MIGRATIONS = [_add_tables, _numeric_keypress_rt, _add_indexes]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# The first schema version that stores keypress RTs as numbers
+NUMERIC_KEYPRESS_RT = 2
+
+
+def schema_version(db, schema='main'):
+    return db.execute("PRAGMA {0}.user_version".format(schema)).fetchone()[0]
+
+
+def keypress_rt_column(db, alias=None, schema='main'):
+    """Returns an SQL expression for the keypress RT column of the trials table as
+    a number (NULL if there was no response), whether or not the database has
+    been upgraded yet. For an attached database, schema is the name it was
+    attached as.
+
+    """
+    column = "{0}.keypress_rt".format(alias) if alias else "keypress_rt"
+    if schema_version(db, schema) >= NUMERIC_KEYPRESS_RT:
+        return column
+    # Not yet upgraded, so RTs are text alongside 'NA'/'TIMEOUT'
+    return (
+        "CASE WHEN {0} IS NULL OR {0} IN ('NA', 'TIMEOUT') THEN NULL "
+        "ELSE CAST({0} AS REAL) END".format(column)
+    )
+
+
+def migrate(db_path, schema_path):
+    """Upgrades a database to the current schema version (each migration in its own
+    transaction), and switches it to write-ahead logging.
+
+    Returns:
+        tuple: The (old, new) schema version of the database.
+
+    """
+    db = connect(db_path)
+    db.isolation_level = None  # transactions are managed explicitly below
+    try:
+        old = schema_version(db)
+        if old < SCHEMA_VERSION:
+            tables, indexes = schema_statements(schema_path)
+            for version in range(old + 1, SCHEMA_VERSION + 1):
+                db.execute("BEGIN IMMEDIATE")
+                try:
+                    MIGRATIONS[version - 1](db, tables, indexes)
+                    db.execute("PRAGMA user_version = {0}".format(version))
+                    db.execute("COMMIT")
+                except Exception:
+                    db.execute("ROLLBACK")
+                    raise
+        # WAL lets readers (e.g. the klibs connection, or an export) work alongside
+        # the background writer, and is persistent, so only needs setting once
+        db.execute("PRAGMA journal_mode = WAL")
+        return old, schema_version(db)
+    finally:
+        db.close()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+
+
+class SessionSequence(object):
+    """Keeps a copy of a session's full trial sequence and progress in the
+    database, so that an interrupted session can be resumed at the exact trial
+    it stopped at.
+
+    The sequence is written once at the start of the session ('session_sequence').
+    Whenever a trial is recycled, the reshuffled remainder of its block is written
+    again (later rows for a position replace earlier ones), and after every
+    completed trial a checkpoint row ('session_checkpoints') records the position
+    of the next trial in the block. Checkpoints are queued together with their
+    trial's row, so both are always committed in the same transaction.
+
+    Args:
+        writer (:obj:`AsyncWriter`): The writer to queue rows with.
+        participant_id (int): The id of the participant running the session.
+        factors (list): The names of the factors that make up each trial.
+
+    """
+
+    def __init__(self, writer, participant_id, factors):
+        self.writer = writer
+        self.participant_id = participant_id
+        self.factors = list(factors)
+
+    def store(self, blocks):
+        """Writes the whole trial sequence for a session (a list of lists of trial
+        dicts, one list per block).
+
+        """
+        for block_num, trials in enumerate(blocks, 1):
+            self._write(block_num, trials, 0)
+
+    def recycled(self, block_num, trials, start):
+        """Rewrites the trials from a given position in a block to its end, after a
+        recycled trial has reshuffled them.
+
+        """
+        self._write(block_num, trials[start:], start)
+
+    def checkpoint(self, block_num, position, trial_num):
+        """Returns a checkpoint row for a trial that's just been completed, given the
+        position of the next trial in its block.
+
+        """
+        return {
+            'participant_id': self.participant_id,
+            'block_num': block_num,
+            'block_pos': position,
+            'trial_num': trial_num
+        }
+
+    def _write(self, block_num, trials, start):
+        for pos, trial in enumerate(trials, start):
+            row = dict((f, trial[f]) for f in self.factors)
+            row.update({
+                'participant_id': self.participant_id, 'block_num': block_num,
+                'block_pos': pos
+            })
+            self.writer.put('session_sequence', row)
+
+
+def load_session(db_path, participant_id, factors):
+    """Reads back a participant's stored trial sequence and last checkpoint.
+
+    Returns:
+        tuple: A list of lists of trial dicts (one list per block, as reshuffled by
+        every recycle written), and the (block_num, block_pos, trial_num) of the last
+        checkpoint (or None if no trials were completed).
+
+    Raises:
+        ValueError: If there's no stored sequence for the participant.
+
+    """
+    db = sqlite3.connect(db_path)
+    try:
+        rows = db.execute(
+            "SELECT block_num, block_pos, {0} FROM session_sequence "
+            "WHERE participant_id = ? ORDER BY id".format(
+                ", ".join(factors)), (participant_id,)
+        ).fetchall()
+        checkpoint = db.execute(
+            "SELECT block_num, block_pos, trial_num FROM session_checkpoints "
+            "WHERE participant_id = ? ORDER BY id DESC LIMIT 1", (participant_id,)
+        ).fetchone()
+    finally:
+        db.close()
+    if not len(rows):
+        raise ValueError("No stored trial sequence for participant {0}".format(participant_id))
+
+    # Rows written after a recycle replace the earlier rows for their positions
+    latest = {}
+    for row in rows:
+        latest[(row[0], row[1])] = dict(zip(factors, row[2:]))
+    blocks = []
+    for block_num, pos in sorted(latest.keys()):
+        while len(blocks) < block_num:
+            blocks.append([])
+        blocks[block_num - 1].append(latest[(block_num, pos)])
+    return blocks, checkpoint
+
+
+def resume_position(blocks, checkpoint):
+    """Returns the (block_num, block_pos, trials_done) of the next pending trial
+    after a checkpoint, moving on to the start of the next block if the
+    checkpointed block was finished.
+
+    """
+    if checkpoint is None:
+        return 1, 0, 0
+    block_num, pos, trial_num = checkpoint
+    if pos >= len(blocks[block_num - 1]) and block_num < len(blocks):
+        return block_num + 1, 0, 0
+    return block_num, pos, trial_num
+
+
+class TrialIterators(object):
+    """Reads and moves klibs' block & trial iterators, which have no public API for
+    either. Everything that depends on how klibs stores them is kept here.
+
+    klibs runs a session from a BlockIterator ('blocks': a list of TrialIterators,
+    'i': the number of blocks started so far), and each block from a TrialIterator
+    ('trials': a list of trial dicts, 'i': the number of trials started so far,
+    and 'length', if present: the number of trials to run). Their shape is checked
+    on creation, so that a version of klibs that stores them differently fails
+    loudly at startup instead of resuming at the wrong trial.
+
+    Args:
+        blocks: The klibs BlockIterator running the session.
+
+    Raises:
+        RuntimeError: If the iterators don't have the expected shape.
+
+    """
+
+    def __init__(self, blocks):
+        _check_iterators(blocks)
+        self.blocks = blocks
+
+    def sequence(self):
+        """Returns the session's trial sequence, as a list of lists of trial dicts
+        (one list per block).
+
+        """
+        return [block.trials for block in self.blocks.blocks]
+
+    def current(self):
+        """Returns the trials of the block klibs is running, and the position in
+        them of the next trial to run.
+
+        """
+        block = self.blocks.blocks[self.blocks.i - 1]
+        return block.trials, block.i
+
+    def restore(self, stored, checkpoint):
+        """Replaces the session's trial sequence with a stored one (see
+        load_session) and moves the iterators on to the first trial after a
+        checkpoint, returning the (block_num, trials_done) of the block it's in.
+
+        """
+        if len(stored) != len(self.blocks.blocks):
+            raise RuntimeError("Stored sequence has {0} blocks, expected {1}".format(
+                len(stored), len(self.blocks.blocks)))
+        for block, trials in zip(self.blocks.blocks, stored):
+            block.trials[:] = trials
+            if hasattr(block, 'length'):
+                block.length = len(trials)
+        _check_iterators(self.blocks)
+
+        block_num, position, done = resume_position(stored, checkpoint)
+        self.blocks.i = block_num - 1
+        self.blocks.blocks[block_num - 1].i = position
+        return block_num, done
+
+
+def _check_iterators(blocks):
+    def fail(problem):
+        raise RuntimeError(
+            "klibs' block/trial iterators don't have the expected shape ({0}), so "
+            "session checkpoints & resuming (session.py) need updating for this "
+            "version of klibs".format(problem)
+        )
+
+    if not isinstance(getattr(blocks, 'blocks', None), list):
+        fail("no 'blocks' list of trial iterators")
+    if not isinstance(getattr(blocks, 'i', None), int):
+        fail("no 'i' block index")
+    for block in blocks.blocks:
+        trials = getattr(block, 'trials', None)
+        if not isinstance(trials, list) or not all(isinstance(t, dict) for t in trials):
+            fail("no 'trials' list of trial dicts")
+        if not isinstance(getattr(block, 'i', None), int):
+            fail("no 'i' trial index")
+        if hasattr(block, 'length') and block.length != len(trials):
+            fail("'length' doesn't match the number of trials")
@@ -0,0 +1,737 @@
+# -*- coding: utf-8 -*-
+"""
+Headless simulation of ObjectBasedCueingEffects_2020 sessions.
+
+Runs the real experiment class with the EyeLink, keyboard, display and event
+manager replaced by scripted synthetic participants. The trial timeline runs on
+a virtual clock that jumps straight to the next thing that can happen (a ticket,
+a fixation break, a key press, a saccade), so a whole session takes seconds
+instead of most of an hour. Data is written to a SQLite database built from the
+project's schema, using the same code paths as a real session, so the 'trials',
+'trials_err' and 'saccades' tables come out exactly as they would in the lab.
+
+Simulations are deterministic given a seed, and need klibs (and its
+dependencies) to be installed but never open a window, so they run on headless
+machines.
+
+"""
+
+import os
+import math
+import random
+import types
+import sqlite3
+import itertools
+from imp import load_source
+from collections import namedtuple, deque
+
+from gaze import SAMPLE_TYPE, STARTSACC, ENDSACC
+from geometry import pixels_per_degree, factor_levels
+from stimuli import render_surface
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+PROJECT_NAME = "ObjectBasedCueingEffects_2020"
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_DIR = os.path.join(PROJECT_DIR, "ExpAssets", "Config")
+
+# Trial timeline (ms from the start of the trial), as registered in trial_prep()
+CUE_ON = 1000
+TARGET_ON = 1960
+TASK_END = 4460
+
+# Simulated eye tracker sample rate (Hz) and pupil size
+SAMPLE_RATE = 500
+PUPIL_SIZE = 1000.0
+
+# A simulated session, ready to run: the experiment instance (set up, with simulated
+# hardware) and everything else that makes up the session
+SimulatedSession = namedtuple('SimulatedSession', [
+    'experiment', 'clock', 'display', 'participant', 'trial_rng'
+])
+
+# Default behaviour of a synthetic participant. RTs are ex-Gaussian (normal with
+# mean 'rt_mu' + cue-target effect and sd 'rt_sigma', plus an exponential with
+# mean 'rt_tau'), endpoint scatter is in degrees of visual angle, and all rates
+# are per-trial probabilities.
+DEFAULT_PARTICIPANT = {
+    'rt_mu': {'saccade': 220.0, 'keypress': 330.0},
+    'rt_sigma': 35.0,
+    'rt_tau': 50.0,
+    'rt_effects': {
+        'cued_location': 25.0, 'cued_object': 12.0,
+        'uncued_adjacent': 5.0, 'uncued_opposite': 0.0
+    },
+    'endpoint_sd': 0.6,
+    'undershoot_rate': 0.15,
+    'fixation_break_rate': 0.04,
+    'early_response_rate': 0.02,
+    'wrong_key_rate': 0.005,
+    'miss_rate': 0.01,
+    'catch_false_alarm_rate': 0.08,
+    'response_eye_movement_rate': 0.03
+}
+
+
+def generate_blocks(levels, factor_names, trials_per_block, block_count, rng):
+    """Generates a randomized list of trials (dicts of factor values) for each block,
+    using as many full-factorial replications as needed to fill each block.
+
+    """
+    factorial = [
+        dict(zip(factor_names, values))
+        for values in itertools.product(*[levels[f] for f in factor_names])
+    ]
+    blocks = []
+    for i in range(block_count):
+        reps = int(math.ceil(trials_per_block / float(len(factorial))))
+        trials = [dict(t) for t in factorial * reps]
+        rng.shuffle(trials)
+        blocks.append(trials[:trials_per_block])
+    return blocks
+
+
+class VirtualClock(object):
+    """A clock (in ms) that only moves when told to."""
+
+    def __init__(self, start=0.0):
+        self.time = float(start)
+
+    def now(self):
+        return self.time
+
+    def advance(self, ms):
+        self.time += max(0.0, ms)
+
+    def advance_to(self, t):
+        self.time = max(self.time, float(t))
+
+    def seconds(self):
+        return self.time / 1000.0
+
+    def sleep(self, seconds):
+        self.advance(seconds * 1000.0)
+
+
+class TrialScript(object):
+    """What a synthetic participant will do on a single trial. All times are in ms
+    from the start of the trial.
+
+    """
+
+    def __init__(self):
+        self.fixation_break = None  # time gaze leaves fixation before the target
+        self.key_press = None  # (time, keycode) of a key press before the target
+        self.saccades = []  # (start, end, start_xy, end_xy) for saccade responses
+        self.keypress_rt = None  # ms from target onset, or None for no response
+        self.response_eye_movement = None  # time gaze leaves fixation after target
+
+    def gaze_breaks(self):
+        return [t for t in (self.fixation_break, self.response_eye_movement) if t is not None]
+
+    def events(self):
+        """Returns the times of everything that happens on the trial."""
+        times = self.gaze_breaks()
+        if self.key_press:
+            times.append(self.key_press[0])
+        if self.keypress_rt is not None:
+            times.append(TARGET_ON + self.keypress_rt)
+        times += [s[1] for s in self.saccades]
+        return sorted(times)
+
+
+class SyntheticParticipant(object):
+    """Generates trial scripts for a simulated participant.
+
+    Args:
+        rng (:obj:`random.Random`): The random number generator to use.
+        config (dict, optional): Overrides for any of the defaults in
+            DEFAULT_PARTICIPANT.
+
+    """
+
+    def __init__(self, rng, config=None):
+        self.rng = rng
+        self.config = dict(DEFAULT_PARTICIPANT)
+        self.config.update(config or {})
+
+    def rt(self, session_type, target_location):
+        c = self.config
+        mu = c['rt_mu'][session_type] + c['rt_effects'].get(target_location, 0.0)
+        rt = self.rng.gauss(mu, c['rt_sigma']) + self.rng.expovariate(1.0 / c['rt_tau'])
+        return max(rt, 80.0)
+
+    def script(self, session_type, target_location, target_xy, centre, ppd, keys):
+        c = self.config
+        rng = self.rng
+        s = TrialScript()
+
+        # Anticipatory errors during the cue-target sequence
+        if rng.random() < c['fixation_break_rate']:
+            s.fixation_break = rng.uniform(0, TARGET_ON)
+        elif rng.random() < c['early_response_rate']:
+            key = keys['other'] if rng.random() < c['wrong_key_rate'] else keys['response']
+            s.key_press = (rng.uniform(CUE_ON, TARGET_ON), key)
+
+        if target_location == 'catch':
+            respond = rng.random() < c['catch_false_alarm_rate']
+            rt = rng.uniform(150, TASK_END - TARGET_ON)
+        else:
+            respond = rng.random() >= c['miss_rate']
+            rt = self.rt(session_type, target_location)
+        if not respond:
+            rt = None
+
+        if session_type == 'keypress':
+            s.keypress_rt = rt
+            if rng.random() < c['response_eye_movement_rate']:
+                s.response_eye_movement = TARGET_ON + rng.uniform(80, 400)
+        elif rt is not None:
+            # Saccade to the target, sometimes undershooting it first
+            start = TARGET_ON + rt
+            sd = c['endpoint_sd'] * ppd
+            endpoints = []
+            if rng.random() < c['undershoot_rate']:
+                frac = rng.uniform(0.45, 0.6)
+                endpoints.append((
+                    centre[0] + (target_xy[0] - centre[0]) * frac + rng.gauss(0, sd),
+                    centre[1] + (target_xy[1] - centre[1]) * frac + rng.gauss(0, sd)
+                ))
+            endpoints.append((target_xy[0] + rng.gauss(0, sd), target_xy[1] + rng.gauss(0, sd)))
+            pos = (centre[0] + rng.gauss(0, 2), centre[1] + rng.gauss(0, 2))
+            for end_xy in endpoints:
+                amplitude = math.hypot(end_xy[0] - pos[0], end_xy[1] - pos[1]) / ppd
+                duration = 21 + 2.2 * amplitude  # saccadic main sequence
+                s.saccades.append((start, start + duration, pos, end_xy))
+                pos = end_xy
+                start = start + duration + rng.uniform(120, 200)
+
+        return s
+
+
+class SimulatedSaccade(object):
+    """Stands in for a pylink end-of-saccade event."""
+
+    def __init__(self, start, end, start_xy, end_xy):
+        self._start, self._end = int(round(start)), int(round(end))
+        self._start_xy = (int(round(start_xy[0])), int(round(start_xy[1])))
+        self._end_xy = (int(round(end_xy[0])), int(round(end_xy[1])))
+
+    def getStartTime(self):
+        return self._start
+
+    def getEndTime(self):
+        return self._end
+
+    def getStartGaze(self):
+        return self._start_xy
+
+    def getEndGaze(self):
+        return self._end_xy
+
+
+class SimulatedSample(object):
+    """Stands in for a pylink gaze sample, along with its (right) eye's data."""
+
+    def __init__(self, time, xy):
+        self._time = time
+        self._xy = xy
+
+    def getTime(self):
+        return self._time
+
+    def isRightSample(self):
+        return True
+
+    def getRightEye(self):
+        return self
+
+    def getGaze(self):
+        return self._xy
+
+    def getPupilSize(self):
+        return PUPIL_SIZE
+
+
+class SimulatedEyeLink(object):
+    """Stands in for the klibs EyeLink object, reporting gaze from a trial script.
+
+    While recording, the tracker's link buffer is simulated too: getNextData() and
+    getFloatData() return a gaze sample every 1000 / sample_rate ms of virtual time
+    since the last read, with start & end of saccade events in between, the same
+    way pylink does.
+
+    """
+
+    def __init__(self, clock, centre, boundary, sample_rate=SAMPLE_RATE):
+        self.clock = clock
+        self.centre = centre
+        # Gaze position used for fixation breaks: well outside fixation boundary
+        self.away = (centre[0] + boundary * 2, centre[1])
+        self.sample_interval = 1000.0 / sample_rate
+        self.messages = []
+        self.script = None
+        self.trial_start = 0.0
+        self.recording = False
+        self._delivered = 0
+        self._next_sample = 0.0
+        self._saccade_events = deque()  # (time, type, data) not yet in the buffer
+        self._buffer = deque()
+        self._current = None
+
+    def begin_trial(self, script, trial_start):
+        self.script = script
+        self.trial_start = trial_start
+        self._delivered = 0
+        events = []
+        for s in script.saccades:
+            saccade = SimulatedSaccade(trial_start + s[0], trial_start + s[1], s[2], s[3])
+            events.append((trial_start + s[0], STARTSACC, saccade))
+            events.append((trial_start + s[1], ENDSACC, saccade))
+        self._saccade_events = deque(sorted(events, key=lambda e: e[0]))
+
+    def trial_time(self):
+        return self.clock.now() - self.trial_start
+
+    def now(self):
+        return int(self.clock.now())
+
+    def write(self, message):
+        self.messages.append((self.now(), message))
+
+    def start(self, trial_number):
+        self.write("TRIALID %d" % trial_number)
+        self.recording = True
+        self._next_sample = self.clock.now()
+        self._buffer.clear()
+
+    def stop(self):
+        self.recording = False
+        self._buffer.clear()
+
+    def drift_correct(self, *args, **kwargs):
+        pass
+
+    def gaze(self):
+        return self._gaze_at(self.trial_time())
+
+    def _gaze_at(self, t):
+        # Gaze position at a given time from the start of the trial
+        if self.script is None:
+            return self.centre
+        if any(t >= b for b in self.script.gaze_breaks()):
+            return self.away
+        landed = [s for s in self.script.saccades if t >= s[1]]
+        return landed[-1][3] if len(landed) else self.centre
+
+    def getNextData(self):
+        if not len(self._buffer):
+            self._fill_buffer()
+        if not len(self._buffer):
+            self._current = None
+            return 0
+        data_type, self._current = self._buffer.popleft()
+        return data_type
+
+    def getFloatData(self):
+        return self._current
+
+    def _fill_buffer(self):
+        # Buffers the samples (and saccade events) recorded up to the current time
+        if not self.recording:
+            return
+        now = self.clock.now()
+        events = self._saccade_events
+        while self._next_sample <= now:
+            t = self._next_sample
+            while len(events) and events[0][0] <= t:
+                time, data_type, data = events.popleft()
+                self._buffer.append((data_type, data))
+            xy = self._gaze_at(t - self.trial_start)
+            self._buffer.append((SAMPLE_TYPE, SimulatedSample(int(round(t)), xy)))
+            self._next_sample += self.sample_interval
+
+    def get_event_queue(self, include=[], exclude=[]):
+        if self.script is None:
+            return []
+        t = self.trial_time()
+        ended = [s for s in self.script.saccades if t >= s[1]]
+        new = ended[self._delivered:]
+        self._delivered = len(ended)
+        offset = self.trial_start
+        return [
+            SimulatedSaccade(offset + s[0], offset + s[1], s[2], s[3]) for s in new
+        ]
+
+
+class SimulatedEventManager(object):
+    """Stands in for the klibs EventManager. Instead of spinning until a ticket is
+    reached, each call to before() advances the virtual clock to the ticket or to the
+    next scripted event, whichever comes first.
+
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.tickets = {}
+        self.start_time = None
+        self.script = None
+
+    def register_tickets(self, tickets):
+        for label, onset in tickets:
+            self.tickets[label] = onset
+
+    def start_clock(self):
+        self.start_time = self.clock.now()
+
+    def stop_clock(self):
+        self.start_time = None
+
+    @property
+    def trial_time_ms(self):
+        return self.clock.now() - self.start_time
+
+    def before(self, label):
+        # NOTE: compared in absolute time so that jumping to an event lands exactly on it
+        now = self.clock.now()
+        onset = self.start_time + self.tickets[label]
+        if now >= onset:
+            return False
+        events = [self.start_time + t for t in self.script.events()] if self.script else []
+        upcoming = [t for t in events if now < t < onset]
+        self.clock.advance_to(min(upcoming + [onset]))
+        return True
+
+    def after(self, label):
+        return not self.before(label)
+
+
+class SimulatedKeyboard(object):
+    """Stands in for the experiment's KeypressCapture, delivering scripted key
+    presses timestamped on the virtual clock.
+
+    """
+
+    poll_interval = 0.0005
+
+    def __init__(self, eyelink, response_key):
+        self.el = eyelink
+        self.response_key = response_key
+        self.armed = False
+        self._checked = 0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.disarm()
+
+    def arm(self):
+        self.armed = True
+        self._checked = 0
+
+    def disarm(self):
+        self.armed = False
+
+    def presses(self):
+        script = self.el.script
+        if script is None:
+            return []
+        presses = []
+        if script.key_press:
+            presses.append(script.key_press)
+        if script.keypress_rt is not None:
+            presses.append((TARGET_ON + script.keypress_rt, self.response_key))
+        t = self.el.trial_time()
+        start = self.el.trial_start
+        return [((start + when) / 1000.0, key) for when, key in presses if when <= t]
+
+    def next_press(self):
+        presses = self.presses()
+        if self._checked < len(presses):
+            self._checked += 1
+            return presses[self._checked - 1]
+        return None
+
+    def first_press(self, keys=None, after=None):
+        for t, key in self.presses():
+            if (keys is None or key in keys) and (after is None or t >= after):
+                return (t, key)
+        return None
+
+    def hotkeys(self):
+        return []  # synthetic participants never press them
+
+
+class SimulatedTrialIterator(object):
+    """Mirrors the parts of a klibs TrialIterator that the experiment looks at."""
+
+    def __init__(self, trials):
+        self.trials = trials
+        self.i = 0
+
+
+class SimulatedBlockIterator(object):
+    """Mirrors the parts of a klibs BlockIterator that the experiment looks at."""
+
+    def __init__(self, blocks):
+        self.blocks = [SimulatedTrialIterator(trials) for trials in blocks]
+        self.i = 0
+
+
+class SimulatedTrialFactory(object):
+    """Stands in for the klibs TrialFactory, exporting pre-generated blocks."""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def export_trials(self):
+        return SimulatedBlockIterator([list(trials) for trials in self.blocks])
+
+
+class SimulatedDisplay(object):
+    """Stands in for the klibs drawing functions, counting flips and the bytes of
+    pixel data blitted (which klibs uploads to the GPU on every blit).
+
+    """
+
+    def __init__(self):
+        self.flips = 0
+        self.blitted = 0
+
+    def flip(self):
+        self.flips += 1
+
+    def blit(self, surface, *args, **kwargs):
+        if surface is not None:  # e.g. text from the (stubbed out) message()
+            self.blitted += render_surface(surface).nbytes
+
+    def nothing(self, *args, **kwargs):
+        pass
+
+
+class SessionSimulator(object):
+    """Runs full simulated sessions of the experiment into a SQLite database.
+
+    Args:
+        db_path (str): Path of the database to write to. If it doesn't exist, it is
+            created from the project's schema.
+        condition (str): The response condition to run ('saccade' or 'keypress').
+        screen_size (tuple, optional): The simulated screen resolution.
+        diagonal_in (float, optional): The simulated screen diagonal in inches.
+        refresh_rate (float, optional): The simulated refresh rate in Hz.
+        participant (dict, optional): Overrides for the synthetic participant's
+            behaviour (see DEFAULT_PARTICIPANT).
+
+    """
+
+    def __init__(self, db_path, condition, screen_size=(1920, 1080), diagonal_in=24.0,
+                 refresh_rate=60.0, participant=None):
+        self.db_path = db_path
+        self.condition = condition
+        self.screen_size = screen_size
+        self.diagonal_in = diagonal_in
+        self.refresh_rate = refresh_rate
+        self.participant_config = participant or {}
+        self._load_experiment()
+        if not os.path.exists(db_path):
+            self._create_db()
+
+    def _load_experiment(self):
+        from klibs import P
+        self.P = P
+
+        P.project_name = PROJECT_NAME
+        P.condition = self.condition
+        P.development_mode = False
+        P.eye_tracking = True
+        P.eye_tracker_available = True
+        P.database_path = self.db_path
+        P.ind_vars_file_path = os.path.join(CONFIG_DIR, PROJECT_NAME + "_independent_variables.py")
+        P.schema_file_path = os.path.join(CONFIG_DIR, PROJECT_NAME + "_schema.sql")
+
+        # Load project params over the klibs defaults, the same way klibs does
+        params = load_source("sim_params", os.path.join(CONFIG_DIR, PROJECT_NAME + "_params.py"))
+        for name in dir(params):
+            value = getattr(params, name)
+            if not name.startswith('_') and name != 'P' and not isinstance(value, types.ModuleType):
+                setattr(P, name, value)
+
+        P.print_block_stats = False  # keep the console output to one line per session
+
+        P.screen_x_y = tuple(self.screen_size)
+        P.screen_x, P.screen_y = self.screen_size
+        P.screen_c = (self.screen_size[0] // 2, self.screen_size[1] // 2)
+        P.view_distance = getattr(P, 'view_distance', 57)
+        P.ppd = pixels_per_degree(self.screen_size, self.diagonal_in, P.view_distance)
+        P.refresh_rate = self.refresh_rate
+        P.refresh_time = 1000.0 / self.refresh_rate
+
+        self.module = load_source("sim_experiment", os.path.join(PROJECT_DIR, "experiment.py"))
+        ind_vars = load_source("sim_ind_vars", P.ind_vars_file_path)
+        ind_vars = getattr(ind_vars, PROJECT_NAME + "_ind_vars")
+        self.levels = factor_levels(ind_vars, self.module.FACTORS)
+        from klibs.KLExceptions import TrialException
+        self.TrialException = TrialException
+
+        base = getattr(self.module, PROJECT_NAME)
+
+        class SimulatedExperiment(base):
+            # Plain attributes shadow the klibs environment properties
+            el = None
+            evm = None
+            rc = None
+            db = None
+            database = None
+            txtm = None
+
+        self.experiment_class = SimulatedExperiment
+
+    def _create_db(self):
+        db = sqlite3.connect(self.db_path)
+        with open(self.P.schema_file_path) as f:
+            db.executescript(f.read())
+        db.commit()
+        db.close()
+
+    def _add_participant(self, seed):
+        db = sqlite3.connect(self.db_path)
+        cursor = db.execute(
+            "INSERT INTO participants (userhash, gender, age, handedness, created) "
+            "VALUES (?, 'n', -1, 'a', 'simulated')", ("simulated-{0}".format(seed),)
+        )
+        db.commit()
+        pid = cursor.lastrowid
+        db.close()
+        return pid
+
+    def _patch_module(self, display, keyboard, clock):
+        m = self.module
+        for name in ('fill', 'clear', 'message', 'flush', 'any_key'):
+            setattr(m, name, display.nothing)
+        m.blit = display.blit
+        m.flip = display.flip
+        m.smart_sleep = clock.advance
+        m.pump = display.nothing
+        m.SDL_PumpEvents = display.nothing
+        m.sdl_keydown_source = display.nothing
+        m.sdl_hotkey_source = lambda: keyboard.hotkeys
+        m.KeypressCapture = lambda source: keyboard
+
+    def run(self, seed, stop_after=None, resume=None):
+        """Simulates a full session for one participant using the given seed,
+        returning a dict of summary counts.
+
+        Args:
+            seed (int): The seed for the session's trial order & participant.
+            stop_after (int, optional): If given, the session is interrupted (as if
+                the program had crashed) after this many trials, including recycled
+                ones.
+            resume (int, optional): The id of a participant whose interrupted session
+                should be resumed, instead of starting a new participant.
+
+        """
+        P = self.P
+        exp, clock, display, participant, trial_rng = self.start_session(seed, resume)
+        session_type = 'saccade' if P.saccade_response_cond else 'keypress'
+        keys = {'response': self.module.SDLK_SPACE, 'other': self.module.SDLK_SPACE + 1}
+
+        # Runs the blocks the same way klibs does, from wherever setup() left the
+        # block & trial iterators (i.e. part way through, if resuming)
+        summary = {'trials': 0, 'recycled': 0, 'flips': 0, 'interrupted': False}
+        blocks = exp.blocks
+        attempts = 0
+        while blocks.i < len(blocks.blocks) and not summary['interrupted']:
+            block = blocks.blocks[blocks.i]
+            blocks.i += 1
+            P.block_number = blocks.i
+            exp.block()
+            P.trial_number = 1
+            trials = block.trials
+            while block.i < len(trials):
+                if stop_after is not None and attempts >= stop_after:
+                    summary['interrupted'] = True
+                    break
+                attempts += 1
+                trial = trials[block.i]
+                block.i += 1
+                P.trial_id = False
+                for factor, value in trial.items():
+                    setattr(exp, factor, value)
+
+                exp.setup_response_collector()
+                exp.trial_prep()
+                geometry = exp.geometry.lookup(
+                    trial['box_alignment'], trial['cue_location'], trial['target_location']
+                )
+                script = participant.script(
+                    session_type, trial['target_location'], geometry.target,
+                    P.screen_c, P.ppd, keys
+                )
+                exp.evm.start_clock()
+                exp.evm.script = script
+                exp.el.begin_trial(script, clock.now())
+                exp.el.start(P.trial_number)
+                try:
+                    data = exp.trial()
+                    P.trial_id = exp.__log_trial__(data)
+                    exp.trial_clean_up()
+                    P.trial_number += 1
+                    summary['trials'] += 1
+                except self.TrialException:
+                    P.trial_id = False
+                    exp.trial_clean_up()
+                    # Recycle the trial to a random later point in the block
+                    remaining = trials[block.i:] + [trial]
+                    trial_rng.shuffle(remaining)
+                    trials[block.i:] = remaining
+                    summary['recycled'] += 1
+                exp.evm.stop_clock()
+                exp.el.stop()
+
+        exp.clean_up()
+        summary['flips'] = display.flips
+        summary['participant_id'] = P.participant_id
+        summary['session_ms'] = clock.now()
+        return summary
+
+    def start_session(self, seed, resume=None):
+        """Creates an instance of the experiment with simulated hardware and runs its
+        setup(), returning it as part of a SimulatedSession. Takes the same seed &
+        resume arguments as run().
+
+        """
+        P = self.P
+        rng = random.Random(seed)
+        trial_rng = random.Random(rng.random())
+        participant = SyntheticParticipant(random.Random(rng.random()), self.participant_config)
+
+        clock = VirtualClock()
+        exp = self.experiment_class.__new__(self.experiment_class)
+        display = SimulatedDisplay()
+
+        P.resume_participant = resume
+        if not resume:
+            P.participant_id = self._add_participant(seed)
+        P.block_number = 0
+        P.trial_number = 0
+        P.trial_id = False
+
+        # Set up simulated hardware, then run the experiment's own setup
+        factors = self.module.FACTORS
+        levels = dict((f, sorted(self.levels[f])) for f in factors)
+        exp.trial_factory = SimulatedTrialFactory(generate_blocks(
+            levels, factors, P.trials_per_block, P.blocks_per_experiment, trial_rng
+        ))
+        exp.evm = SimulatedEventManager(clock)
+        exp.el = SimulatedEyeLink(clock, P.screen_c, P.ppd * 3.0)
+        keyboard = SimulatedKeyboard(exp.el, self.module.SDLK_SPACE)
+        self._patch_module(display, keyboard, clock)
+        exp.setup()
+        for pacer in (exp.response_pacer, exp.input_pacer):
+            pacer.clock = clock.seconds
+            pacer.sleep = clock.sleep
+        exp.flip_timer.clock = clock.seconds
+
+        return SimulatedSession(exp, clock, display, participant, trial_rng)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+def render_surface(stim):
+    """Returns the rendered pixels of a drawbject (or a pre-rendered numpy array)
+    as a numpy array.
+
+    """
+    if isinstance(stim, np.ndarray):
+        return stim
+    return np.asarray(stim.render())
+
+
+class StimulusCache(object):
+    """Prerendered placeholder and cue surfaces for every box alignment and cue
+    location in the experiment.
+
+    The stimulus space is tiny (2 alignments x 4 cue locations), so everything is
+    rendered once during setup() and trial_prep() only needs a dictionary lookup.
+    Surfaces that have already been rendered (e.g. loaded from an asset bundle)
+    can be passed in instead, in which case nothing is rendered unless verify() is
+    called.
+
+    Args:
+        alignments (list): Box alignments to render placeholders and cues for.
+        cue_locations (list): Cue locations to render cues for.
+        build_placeholder (callable): Takes a box alignment and returns the
+            placeholder drawbject for that alignment.
+        build_cue (callable): Takes a box alignment and returns the rendered cue
+            for that alignment.
+        rendered (dict, optional): Prerendered {alignment: (placeholder, cue)}
+            surfaces for every alignment.
+
+    """
+
+    def __init__(self, alignments, cue_locations, build_placeholder, build_cue,
+                 rendered=None):
+        self.alignments = list(alignments)
+        self.cue_locations = list(cue_locations)
+        self._build_placeholder = build_placeholder
+        self._build_cue = build_cue
+
+        self.placeholders = {}
+        self.cues = {}
+        for alignment in self.alignments:
+            if rendered is not None:
+                placeholder, cue = rendered[alignment]
+            else:
+                placeholder = build_placeholder(alignment)
+                cue = build_cue(alignment)
+            self.placeholders[alignment] = render_surface(placeholder)
+            # NOTE: the cue's shape currently only depends on the box alignment, so
+            # all cue locations for an alignment share a single rendered surface.
+            cue = render_surface(cue)
+            for location in self.cue_locations:
+                self.cues[(alignment, location)] = cue
+
+    def placeholder(self, alignment):
+        return self.placeholders[alignment]
+
+    def cue(self, alignment, location):
+        return self.cues[(alignment, location)]
+
+    def verify(self):
+        """Re-renders every cached stimulus with the per-trial construction code and
+        checks that the cached surfaces are byte-identical to the fresh ones.
+
+        Returns:
+            list: The keys of any cached surfaces that don't match, e.g.
+            ('placeholder', 'vertical') or ('cue', 'vertical', 'top_left'). An empty
+            list means the cache is identical to per-trial construction.
+
+        """
+        mismatches = []
+        for alignment in self.alignments:
+            fresh = render_surface(self._build_placeholder(alignment))
+            if not _identical(self.placeholders[alignment], fresh):
+                mismatches.append(('placeholder', alignment))
+            fresh = render_surface(self._build_cue(alignment))
+            for location in self.cue_locations:
+                if not _identical(self.cues[(alignment, location)], fresh):
+                    mismatches.append(('cue', alignment, location))
+        return mismatches
+
+
+def _identical(a, b):
+    a, b = np.asarray(a), np.asarray(b)
+    return a.shape == b.shape and a.dtype == b.dtype and a.tobytes() == b.tobytes()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from assets import AssetBundle, bundle_key
+
+SIZES = {'target_diameter': 1.0, 'ppd': 40.0}
+
+
+def write(path, text):
+    with open(str(path), 'w') as f:
+        f.write(text)
+    return str(path)
+
+
+def test_key_covers_setup_and_sizes(tmpdir):
+    source = write(tmpdir.join("draw.py"), "x = 1\n")
+    key = bundle_key((1920, 1080), 24.0, 57, SIZES, [source])
+    assert key.startswith("1920x1080_24.0in_57cm_")
+    assert key == bundle_key((1920, 1080), 24.0, 57, dict(SIZES), [source])
+    assert key != bundle_key((1920, 1080), 24.0, 57, dict(SIZES, ppd=41.0), [source])
+
+
+def test_key_changes_with_drawing_source(tmpdir):
+    source = write(tmpdir.join("draw.py"), "x = 1\n")
+    before = bundle_key((1920, 1080), 24.0, 57, SIZES, [source])
+    write(source, "x = 2\n")
+    assert bundle_key((1920, 1080), 24.0, 57, SIZES, [source]) != before
+
+
+def test_compiled_modules_are_keyed_on_their_source(tmpdir):
+    source = write(tmpdir.join("draw.py"), "x = 1\n")
+    write(tmpdir.join("draw.pyc"), "compiled")
+    compiled = str(tmpdir.join("draw.pyc"))
+    assert bundle_key((800, 600), 15.0, 57, SIZES, [compiled]) == \
+        bundle_key((800, 600), 15.0, 57, SIZES, [source])
+
+
+def test_save_and_load(tmpdir):
+    path = str(tmpdir.join("bundle"))
+    bundle = AssetBundle(path)
+    assert not bundle.load()
+    bundle.geometry = {'sizes': {'target_diameter': 40}}
+    bundle.surfaces = {'target': np.arange(24, dtype=np.uint8).reshape(2, 3, 4)}
+    bundle.save()
+    assert tmpdir.join("bundle").check(dir=True)
+
+    loaded = AssetBundle(path)
+    assert loaded.load()
+    assert loaded.geometry == {'sizes': {'target_diameter': 40}}
+    assert np.array_equal(loaded.surfaces['target'], bundle.surfaces['target'])
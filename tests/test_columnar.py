@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from tools.columnar import ColumnWriter, ColumnReader
+
+
+def chunk(ids, rts, names):
+    return OrderedDict([
+        ('id', np.array(ids, dtype='i8')),
+        ('rt', np.array(rts, dtype='f8')),
+        ('name', np.array(names, dtype='U')),
+    ])
+
+
+def test_round_trip(tmpdir):
+    path = str(tmpdir.join("test.cols"))
+    with ColumnWriter(path) as writer:
+        writer.write('trials', chunk([1, 2], [250.5, np.nan], [u'a', u'bb']))
+        # Later chunks can have wider strings than the first
+        writer.write('trials', chunk([3], [300.0], [u'cued_location']))
+        writer.write('other', OrderedDict([('x', np.arange(5))]))
+
+    with ColumnReader(path) as reader:
+        assert reader.tables == ['trials', 'other']
+        assert reader.columns('trials') == ['id', 'rt', 'name']
+        assert reader.schema['trials']['rows'] == 3
+        assert reader.schema['trials']['chunks'] == 2
+        table = reader.read('trials')
+        assert list(table.keys()) == ['id', 'rt', 'name']
+        assert table['id'].tolist() == [1, 2, 3]
+        assert table['id'].dtype == np.dtype('i8')
+        assert table['rt'][0] == 250.5 and np.isnan(table['rt'][1])
+        assert table['name'].tolist() == [u'a', u'bb', u'cued_location']
+        assert reader.read('other')['x'].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_read_selected_columns(tmpdir):
+    path = str(tmpdir.join("test.cols"))
+    with ColumnWriter(path, compress=False) as writer:
+        writer.write('trials', chunk([1, 2], [1.0, 2.0], [u'a', u'b']))
+        writer.write('trials', chunk([3, 4], [3.0, 4.0], [u'c', u'd']))
+    with ColumnReader(path) as reader:
+        table = reader.read('trials', ['rt'])
+        assert list(table.keys()) == ['rt']
+        assert table['rt'].tolist() == [1.0, 2.0, 3.0, 4.0]
+        chunks = list(reader.chunks('trials', ['id']))
+        assert [c['id'].tolist() for c in chunks] == [[1, 2], [3, 4]]
+
+
+def test_empty_table(tmpdir):
+    path = str(tmpdir.join("test.cols"))
+    with ColumnWriter(path) as writer:
+        writer.write('trials', chunk([], [], []))
+    with ColumnReader(path) as reader:
+        assert reader.schema['trials']['rows'] == 0
+        assert len(reader.read('trials')['id']) == 0
+
+
+def test_invalid_chunks_raise(tmpdir):
+    path = str(tmpdir.join("test.cols"))
+    with ColumnWriter(path) as writer:
+        with pytest.raises(ValueError):
+            writer.write('trials', OrderedDict([('a', [1, 2]), ('b', [1])]))
+        writer.write('trials', chunk([1], [1.0], [u'a']))
+        with pytest.raises(ValueError):
+            writer.write('trials', OrderedDict([('id', [2]), ('rt', [2.0])]))
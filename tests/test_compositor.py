@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from compositor import FrameCompositor
+
+
+def make_compositor():
+    fix = np.zeros((4, 4, 4), dtype=np.uint8)
+    box = np.zeros((8, 2, 4), dtype=np.uint8)
+    frames = FrameCompositor()
+    frames.add_background('vertical', [(fix, (50, 50)), (box, (20, 50)), (box, (80, 50))])
+    return frames, fix, box
+
+
+def test_frame_returns_background_then_overlays():
+    frames, fix, box = make_compositor()
+    cue = np.ones((8, 2, 4), dtype=np.uint8)
+    layers = frames.frame('vertical', [(cue, (20, 50))])
+    assert [loc for surface, loc in layers] == [(50, 50), (20, 50), (80, 50), (20, 50)]
+    assert layers[0][0] is fix and layers[-1][0] is cue
+
+
+def test_unchanged_frame_is_skipped():
+    frames, fix, box = make_compositor()
+    cue = np.ones((8, 2, 4), dtype=np.uint8)
+    assert frames.frame('vertical') is not None
+    assert frames.frame('vertical') is None
+    assert frames.frame('vertical', [(cue, (20, 50))]) is not None
+    assert frames.frame('vertical', [(cue, (20, 50))]) is None
+    # Same surface somewhere else, then back to the plain background
+    assert frames.frame('vertical', [(cue, (80, 50))]) is not None
+    assert frames.frame('vertical') is not None
+
+
+def test_changed_key_is_redrawn():
+    frames, fix, box = make_compositor()
+    frames.add_background('horizontal', [(fix, (50, 50))])
+    assert frames.frame('vertical') is not None
+    assert frames.frame('horizontal') == [(fix, (50, 50))]
+
+
+def test_invalidate_forces_redraw():
+    frames, fix, box = make_compositor()
+    frames.frame('vertical')
+    frames.invalidate()
+    assert frames.frame('vertical') is not None
+
+
+def test_frame_does_not_modify_background():
+    frames, fix, box = make_compositor()
+    cue = np.ones((8, 2, 4), dtype=np.uint8)
+    frames.frame('vertical', [(cue, (20, 50))])
+    assert len(frames.background('vertical')) == 3
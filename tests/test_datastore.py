@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import time
+import sqlite3
+
+import pytest
+
+from datastore import AsyncWriter
+
+SCHEMA = """
+CREATE TABLE trials (
+    id integer primary key autoincrement not null,
+    block_num integer not null,
+    trial_num integer not null
+);
+CREATE TABLE saccades (
+    id integer primary key autoincrement not null,
+    trial_id integer not null references trials(id),
+    rt float not null
+);
+"""
+
+
+@pytest.fixture
+def db_path(tmpdir):
+    path = str(tmpdir.join("test.db"))
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    db.close()
+    return path
+
+
+def select(path, query):
+    db = sqlite3.connect(path)
+    try:
+        return db.execute(query).fetchall()
+    finally:
+        db.close()
+
+
+def test_rows_and_children_are_written(db_path):
+    writer = AsyncWriter(db_path, batch_size=4)
+    for i in range(10):
+        saccades = [('saccades', {'rt': 200.0 + i}), ('saccades', {'rt': 300.0 + i})]
+        writer.put_trial({'block_num': 1, 'trial_num': i + 1}, saccades)
+    writer.put('trials', {'block_num': 2, 'trial_num': 1})
+    writer.flush()
+    assert writer.rows_written == 31
+    assert writer.batches_written >= 3  # 11 items, at most 4 per batch
+    rows = select(db_path,
+        "SELECT t.trial_num, s.rt FROM saccades s JOIN trials t ON t.id = s.trial_id "
+        "ORDER BY s.id")
+    assert rows[:2] == [(1, 200.0), (1, 300.0)]
+    assert rows[-1] == (10, 309.0)
+    writer.close()
+
+
+def test_deferred_rows_are_committed_at_flush(db_path):
+    writer = AsyncWriter(db_path, batch_size=1, defer_commits=True)
+    for i in range(3):
+        writer.put('trials', {'block_num': 1, 'trial_num': i + 1})
+    deadline = time.time() + 5
+    while writer.rows_written < 3 and time.time() < deadline:
+        time.sleep(0.001)
+    assert select(db_path, "SELECT COUNT(*) FROM trials") == [(0,)]
+    writer.flush()
+    assert select(db_path, "SELECT COUNT(*) FROM trials") == [(3,)]
+    writer.close()
+
+
+def test_failed_batch_keeps_earlier_deferred_batches(db_path):
+    writer = AsyncWriter(db_path, batch_size=1, defer_commits=True)
+    writer.put('trials', {'block_num': 1, 'trial_num': 1})
+    writer.put('trials', {'block_num': 1, 'trial_num': None})  # violates NOT NULL
+    writer.put('trials', {'block_num': 1, 'trial_num': 3})  # queued after the failure
+    with pytest.raises(RuntimeError) as e:
+        writer.flush()
+    assert "1 rows" in str(e.value)
+    assert select(db_path, "SELECT trial_num FROM trials ORDER BY id") == [(1,), (3,)]
+    assert writer.rows_failed == 1
+
+    # The failure is only reported once, and the writer carries on
+    writer.put('trials', {'block_num': 2, 'trial_num': 1})
+    writer.flush()
+    assert select(db_path, "SELECT COUNT(*) FROM trials") == [(3,)]
+    writer.close()
+
+
+def test_failed_item_loses_only_its_own_rows(db_path):
+    writer = AsyncWriter(db_path, batch_size=256)
+    writer.put_trial({'block_num': 1, 'trial_num': 1}, [('saccades', {'rt': 200.0})])
+    writer.put_trial({'block_num': 1, 'trial_num': 2}, [('saccades', {'rt': None})])
+    writer.put_trial({'block_num': 1, 'trial_num': 3}, [('saccades', {'rt': 250.0})])
+    with pytest.raises(RuntimeError) as e:
+        writer.flush()
+    assert "2 rows" in str(e.value)  # the trial and its saccade
+    rows = select(db_path,
+        "SELECT t.trial_num, s.rt FROM trials t JOIN saccades s ON s.trial_id = t.id "
+        "ORDER BY t.id")
+    assert rows == [(1, 200.0), (3, 250.0)]
+    assert select(db_path, "SELECT COUNT(*) FROM trials") == [(2,)]
+    writer.close()
+
+
+def test_close_reports_failures(db_path):
+    writer = AsyncWriter(db_path)
+    writer.put('no_such_table', {'x': 1})
+    with pytest.raises(RuntimeError):
+        writer.close()
+
+
+def test_unopenable_database_raises_instead_of_hanging(tmpdir):
+    writer = AsyncWriter(str(tmpdir.join("missing", "test.db")))
+    writer.put('trials', {'block_num': 1, 'trial_num': 1})
+    writer._thread.join(5)
+    assert not writer._thread.is_alive()
+    with pytest.raises(RuntimeError) as e:
+        writer.flush(timeout=5)
+    assert "failed to write 1 rows" in str(e.value)
+    assert writer.rows_failed == 1
+
+    # Rows queued from then on are lost too, and never waited on
+    writer.put_trial({'block_num': 1, 'trial_num': 2}, [('saccades', {'rt': 200.0})])
+    with pytest.raises(RuntimeError) as e:
+        writer.flush(timeout=5)
+    assert "failed to write 2 rows" in str(e.value)
+    with pytest.raises(RuntimeError) as e:
+        writer.close(timeout=5)
+    assert "has stopped" in str(e.value)
+
+
+def test_worker_failure_releases_waiting_flush(db_path, monkeypatch):
+    # An error the worker can't recover from (e.g. the database staying locked)
+    # while a flush is waiting on it
+    writer = AsyncWriter(db_path, batch_size=1, defer_commits=True)
+    writer.put('trials', {'block_num': 1, 'trial_num': 1})
+    writer.flush()
+
+    def locked(db, items):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(writer, '_write_batch', locked)
+    writer.put('trials', {'block_num': 1, 'trial_num': 2})
+    writer.put('trials', {'block_num': 1, 'trial_num': 3})
+    with pytest.raises(RuntimeError) as e:
+        writer.flush(timeout=5)
+    assert "database is locked" in str(e.value)
+    assert writer.rows_written == 1
+    assert writer.rows_failed == 2
+    assert select(db_path, "SELECT trial_num FROM trials") == [(1,)]
+    writer._thread.join(5)
+    with pytest.raises(RuntimeError):
+        writer.close(timeout=5)
+
+
+def test_flush_after_close_raises(db_path):
+    writer = AsyncWriter(db_path)
+    writer.close()
+    writer.close()  # closing twice is fine
+    with pytest.raises(RuntimeError):
+        writer.flush(timeout=5)
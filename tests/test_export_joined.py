@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+
+import numpy as np
+import pytest
+
+from tools.columnar import ColumnReader, ColumnWriter
+from tools.config import SCHEMA_PATH
+from tools.export_joined import (
+    block_errors, chunks, export_saccades, export_trials, number_saccades
+)
+from tests.test_migrations import ORIGINAL_SCHEMA
+
+# Saccades per trial, spread across chunks of 2 rows so trials straddle chunks
+SACCADES = [3, 0, 1, 4]
+RTS = [312.5, None, 280.0, None]
+
+
+def make_db(path, schema, rts):
+    db = sqlite3.connect(path)
+    db.executescript(schema)
+    db.execute(
+        "INSERT INTO participants (userhash, gender, age, handedness, created) "
+        "VALUES ('abc', 'f', 20, 'r', 'now')"
+    )
+    for n, (count, rt) in enumerate(zip(SACCADES, rts)):
+        tid = db.execute(
+            "INSERT INTO trials (participant_id, block_num, trial_num, session_type, "
+            "box_alignment, cue_location, target_location, target_acquired, keypress_rt, "
+            "moved_eyes) VALUES (1, 1, ?, 'saccade', 'vertical', 'top_left', "
+            "'cued_object', 'TRUE', ?, 'NA')", (n + 1, rt)
+        ).lastrowid
+        for i in range(count):
+            db.execute(
+                "INSERT INTO saccades (participant_id, trial_id, rt, accuracy, "
+                "dist_from_target, start_x, start_y, end_x, end_y, duration) "
+                "VALUES (1, ?, ?, 'inside', 10, 0, 0, 1, 1, 30)", (tid, 200 + i)
+            )
+    columns = [row[1] for row in db.execute("PRAGMA table_info(trials_err)")]
+    extra = ", fixation_break_time" if 'fixation_break_time' in columns else ""
+    for err_type in ['early', 'eye', 'early']:
+        db.execute(
+            "INSERT INTO trials_err (participant_id, block_num, trial_num, session_type, "
+            "box_alignment, cue_location, target_location, err_type{0}) "
+            "VALUES (1, 1, 1, 'saccade', 'vertical', 'top_left', 'cued_object', ?{1})".format(
+                extra, ", 'NA'" if extra else ""
+            ), (err_type,)
+        )
+    db.commit()
+    return db
+
+
+def export(db, path, chunk_size):
+    errors = block_errors(db)
+    with ColumnWriter(path) as writer:
+        counts = (
+            export_trials(db, writer, errors, chunk_size),
+            export_saccades(db, writer, errors, chunk_size)
+        )
+    return counts
+
+
+def test_chunks():
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE t (x)")
+    assert list(chunks(db.execute("SELECT x FROM t"), 2)) == [[]]
+    db.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(5)])
+    sizes = [len(rows) for rows in chunks(db.execute("SELECT x FROM t"), 2)]
+    assert sizes == [2, 2, 1]
+
+
+def test_number_saccades_across_chunks():
+    # (trial_id, saccade_num) rows, with trial 2's saccades split across chunks
+    row_chunks = [[(1, 0), (1, 0), (2, 0)], [(2, 0), (2, 0)], [(3, 0)], [(3, 0), (4, 0)]]
+    numbered = [row for rows in number_saccades(row_chunks, 0, 1) for row in rows]
+    assert [n for trial, n in numbered] == [1, 2, 1, 2, 3, 1, 2, 1]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 1000])
+def test_export(tmpdir, chunk_size):
+    with open(SCHEMA_PATH) as f:
+        db = make_db(str(tmpdir.join("test.db")), f.read(), RTS)
+    path = str(tmpdir.join("joined.cols"))
+    assert export(db, path, chunk_size) == (len(SACCADES), sum(SACCADES))
+    db.close()
+
+    with ColumnReader(path) as reader:
+        trials = reader.read('trials')
+        saccades = reader.read('saccades')
+    assert list(trials['n_saccades']) == SACCADES
+    assert np.allclose(trials['keypress_rt'], [312.5, np.nan, 280.0, np.nan], equal_nan=True)
+    assert list(trials['block_errors']) == [3] * 4
+    assert list(trials['block_errors_early']) == [2] * 4
+    assert list(trials['block_errors_key']) == [0] * 4
+    assert list(saccades['saccade_num']) == [1, 2, 3, 1, 1, 2, 3, 4]
+    assert list(saccades['trial_num']) == [1, 1, 1, 3, 4, 4, 4, 4]
+    assert list(saccades['rt']) == [200, 201, 202, 200, 200, 201, 202, 203]
+    assert saccades['trial_id'].dtype == np.int64
+
+
+def test_export_original_schema(tmpdir):
+    # Keypress RTs are read as numbers from databases that haven't been upgraded
+    db = make_db(str(tmpdir.join("old.db")), ORIGINAL_SCHEMA, ['312.5', 'NA', '280', 'TIMEOUT'])
+    path = str(tmpdir.join("joined.cols"))
+    export(db, path, 2)
+    db.close()
+    with ColumnReader(path) as reader:
+        rts = reader.read('trials', ['keypress_rt'])['keypress_rt']
+    assert np.allclose(rts, [312.5, np.nan, 280.0, np.nan], equal_nan=True)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+
+import numpy as np
+
+from datastore import AsyncWriter
+from gaze import (
+    SAMPLE_TYPE, MISSING_DATA, STARTSACC, ENDSACC, PHASE_NONE, PHASE_SACCADE,
+    FixationMonitor, GazeRecorder, TrackerSampleSource, load_gaze_samples
+)
+from tools.config import SCHEMA_PATH
+
+
+class FakeEye(object):
+
+    def __init__(self, x, y, pupil):
+        self.gaze = (x, y)
+        self.pupil = pupil
+
+    def getGaze(self):
+        return self.gaze
+
+    def getPupilSize(self):
+        return self.pupil
+
+
+class FakeSample(object):
+    # The parts of a pylink sample that TrackerSampleSource reads
+
+    def __init__(self, t, x, y, pupil=1000.0):
+        self.t = t
+        self.eye = FakeEye(x, y, pupil)
+
+    def getTime(self):
+        return self.t
+
+    def isRightSample(self):
+        return True
+
+    def getRightEye(self):
+        return self.eye
+
+
+class FakeEyeLink(object):
+    # A link buffer of (data_type, data) items, read as pylink's would be
+
+    def __init__(self, items=[]):
+        self.items = list(items)
+        self.current = None
+
+    def getNextData(self):
+        if not len(self.items):
+            return 0
+        data_type, self.current = self.items.pop(0)
+        return data_type
+
+    def getFloatData(self):
+        return self.current
+
+
+class FakeRecorder(object):
+
+    def __init__(self):
+        self.recording = True
+        self.rows = []
+
+    def add(self, rows):
+        self.rows.append(rows)
+
+
+def test_first_violation_is_earliest_sample_outside():
+    monitor = FixationMonitor((100, 100), 10)
+    samples = np.array([
+        [1.0, 100.0, 100.0],
+        [2.0, 109.0, 100.0],   # inside
+        [3.0, 100.0, 111.0],   # first outside
+        [4.0, 200.0, 200.0],   # further outside, but later
+    ])
+    assert list(monitor.first_violation(samples)) == [3.0, 100.0, 111.0]
+
+
+def test_first_violation_ignores_missing_data():
+    monitor = FixationMonitor((100, 100), 10)
+    samples = np.array([
+        [1.0, MISSING_DATA, MISSING_DATA],
+        [2.0, np.nan, np.nan],
+        [3.0, 100.0, np.nan],
+        [4.0, 101.0, 99.0],
+    ])
+    assert monitor.first_violation(samples) is None
+    samples[3] = [4.0, 300.0, 100.0]
+    assert list(monitor.first_violation(samples)) == [4.0, 300.0, 100.0]
+
+
+def test_first_violation_empty_batch():
+    monitor = FixationMonitor((100, 100), 10)
+    assert monitor.first_violation(np.zeros((0, 3))) is None
+
+
+def test_sample_source_drains_buffer_and_keeps_events():
+    end_saccade = object()
+    el = FakeEyeLink([
+        (SAMPLE_TYPE, FakeSample(1.0, 10.0, 20.0)),
+        (STARTSACC, object()),
+        (SAMPLE_TYPE, FakeSample(2.0, 11.0, 21.0)),
+        (SAMPLE_TYPE, None),  # no sample data
+        (ENDSACC, end_saccade),
+        (SAMPLE_TYPE, FakeSample(3.0, 12.0, 22.0, pupil=900.0)),
+    ])
+    recorder = FakeRecorder()
+    source = TrackerSampleSource(el, recorder, [ENDSACC])
+    assert source.buffered
+
+    samples = source.read()
+    assert samples.tolist() == [[1.0, 10.0, 20.0], [2.0, 11.0, 21.0], [3.0, 12.0, 22.0]]
+    assert len(el.items) == 0
+    assert source.events() == [end_saccade]
+    assert source.events() == []
+    # Recorded samples include pupil size & the phase from the tracker's events
+    recorded = recorder.rows[0]
+    assert recorded[:, 3].tolist() == [1000.0, 1000.0, 900.0]
+    assert recorded[:, 4].tolist() == [PHASE_NONE, PHASE_SACCADE, PHASE_NONE]
+
+    assert source.read().shape == (0, 3)
+
+
+def test_sample_source_discard():
+    el = FakeEyeLink([(SAMPLE_TYPE, FakeSample(1.0, 0.0, 0.0)), (ENDSACC, object())])
+    source = TrackerSampleSource(el, event_types=[ENDSACC])
+    source.discard()
+    assert len(el.items) == 0
+    assert source.events() == []
+
+
+def test_sample_source_without_buffer():
+    # e.g. the mouse standing in for an eye tracker
+    class Gaze(object):
+        def gaze(self):
+            return (5.0, 6.0)
+
+        def now(self):
+            return 42.0
+    source = TrackerSampleSource(Gaze())
+    assert not source.buffered
+    assert source.read().tolist() == [[42.0, 5.0, 6.0]]
+
+
+def sample_rows(start, n):
+    # (n, 5) rows of [timestamp, x, y, pupil, phase], numbered from start
+    t = np.arange(start, start + n, dtype=np.float64)
+    return np.column_stack([t, t + 0.5, -t, t * 2, t % 4])
+
+
+def test_recorder_round_trip(tmpdir):
+    db_path = str(tmpdir.join("test.db"))
+    db = sqlite3.connect(db_path)
+    with open(SCHEMA_PATH) as f:
+        db.executescript(f.read())
+    db.close()
+    path = str(tmpdir.join("p1_gaze.bin"))
+    recorder = GazeRecorder(path, capacity=8)
+    writer = AsyncWriter(db_path)
+
+    # Trial 1 fits in the buffer, trial 2 overflows it (in one batch and then in
+    # several), trial 3 has no samples
+    trials = [[(0, 5)], [(100, 12), (112, 3), (115, 2)], []]
+    for num, batches in enumerate(trials, 1):
+        recorder.begin()
+        for start, n in batches:
+            recorder.add(sample_rows(start, n))
+        recorder.stop()
+        offset, count, dropped = recorder.flush()
+        writer.put('gaze_index', {
+            'participant_id': 1, 'trial_id': num, 'block_num': 1, 'trial_num': num,
+            'file': os.path.basename(path), 'sample_offset': offset,
+            'sample_count': count, 'dropped_samples': dropped, 'target_onset': 'NA'
+        })
+    writer.close()
+
+    db = sqlite3.connect(db_path)
+    rows = db.execute(
+        "SELECT file, sample_offset, sample_count, dropped_samples FROM gaze_index "
+        "ORDER BY trial_num"
+    ).fetchall()
+    db.close()
+    # Only the last 8 of trial 2's 17 samples are kept
+    assert rows == [('p1_gaze.bin', 0, 5, 0), ('p1_gaze.bin', 5, 8, 9), ('p1_gaze.bin', 13, 0, 0)]
+    assert os.path.getsize(path) == 13 * 21
+
+    first = load_gaze_samples(path, 0, 5)
+    assert first['t'].tolist() == list(range(0, 5))
+    second = load_gaze_samples(str(tmpdir.join(rows[1][0])), rows[1][1], rows[1][2])
+    expected = sample_rows(109, 8)
+    assert second['t'].tolist() == list(range(109, 117))
+    assert np.allclose(second['x'], expected[:, 1])
+    assert np.allclose(second['y'], expected[:, 2])
+    assert np.allclose(second['pupil'], expected[:, 3])
+    assert second['phase'].tolist() == expected[:, 4].astype(int).tolist()
+    assert len(load_gaze_samples(path, 13, 0)) == 0
+
+    # A new session for the same participant appends after the existing samples
+    recorder = GazeRecorder(path, capacity=8)
+    recorder.begin()
+    recorder.add(sample_rows(200, 2))
+    assert recorder.flush() == (13, 2, 0)
+    assert load_gaze_samples(path, 13, 2)['t'].tolist() == [200, 201]
+    assert load_gaze_samples(path, 0, 5)['t'].tolist() == list(range(0, 5))
+
+
+def test_recorder_discard():
+    recorder = GazeRecorder(os.devnull, capacity=4)
+    recorder.begin()
+    recorder.add(sample_rows(0, 6))
+    assert recorder.dropped == 2
+    assert recorder.samples()['t'].tolist() == [2, 3, 4, 5]
+    recorder.discard()
+    assert not recorder.recording
+    assert len(recorder.samples()) == 0 and recorder.dropped == 0
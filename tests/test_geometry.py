@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from geometry import (
+    TargetGeometryTable, TrialGeometry, stimulus_locations, target_location_name,
+    HORIZONTAL, VERTICAL, CUED_LOCATION, CUED_OBJECT, UNCUED_ADJACENT, UNCUED_OPPOSITE,
+    CATCH
+)
+
+ALIGNMENTS = [VERTICAL, HORIZONTAL]
+CUE_LOCATIONS = ['top_left', 'top_right', 'bottom_left', 'bottom_right']
+TARGET_LOCATIONS = [CUED_LOCATION, CUED_OBJECT, UNCUED_ADJACENT, UNCUED_OPPOSITE, CATCH]
+
+
+def make_table():
+    locations = stimulus_locations((960, 540), 200)
+    return TargetGeometryTable(locations, ALIGNMENTS, CUE_LOCATIONS, TARGET_LOCATIONS)
+
+
+def test_cued_location_is_the_cue():
+    # get_target_location() used to fall through from the cued_location branch
+    # into the uncued branch, drawing those targets at the uncued_opposite end
+    table = make_table()
+    for alignment in ALIGNMENTS:
+        for cue in CUE_LOCATIONS:
+            geo = table.lookup(alignment, cue, CUED_LOCATION)
+            assert geo.target == geo.cue == table.locations[cue]
+            assert geo.target != table.lookup(alignment, cue, UNCUED_OPPOSITE).target
+
+
+@pytest.mark.parametrize("alignment, cue, expected", [
+    (VERTICAL, 'top_left', ['top_left', 'bottom_left', 'top_right', 'bottom_right']),
+    (VERTICAL, 'bottom_right', ['bottom_right', 'top_right', 'bottom_left', 'top_left']),
+    (HORIZONTAL, 'top_left', ['top_left', 'top_right', 'bottom_left', 'bottom_right']),
+    (HORIZONTAL, 'bottom_right', ['bottom_right', 'bottom_left', 'top_right', 'top_left']),
+])
+def test_target_location_names(alignment, cue, expected):
+    targets = [CUED_LOCATION, CUED_OBJECT, UNCUED_ADJACENT, UNCUED_OPPOSITE]
+    names = [target_location_name(alignment, cue, t) for t in targets]
+    assert names == expected
+    assert target_location_name(alignment, cue, CATCH) is None
+
+
+def test_table_has_every_combination():
+    table = make_table()
+    assert len(table) == len(ALIGNMENTS) * len(CUE_LOCATIONS) * len(TARGET_LOCATIONS)
+    geo = table[(HORIZONTAL, 'top_right', UNCUED_ADJACENT)]
+    assert geo == TrialGeometry(
+        cue=(1160, 340), target=(1160, 740), box1=(960, 340), box2=(960, 740)
+    )
+    assert table.lookup(VERTICAL, 'top_left', CATCH).target is None
+
+
+def test_box_centres():
+    table = make_table()
+    assert table.box_centres(VERTICAL) == ((760, 540), (1160, 540))
+    assert table.box_centres(HORIZONTAL) == ((960, 340), (960, 740))
+
+
+def test_unknown_levels_raise():
+    with pytest.raises(ValueError):
+        target_location_name(VERTICAL, 'left', CUED_OBJECT)
+    with pytest.raises(ValueError):
+        target_location_name(VERTICAL, 'top_left', 'elsewhere')
+
+
+def test_validate_catches_bad_geometry():
+    table = make_table()
+    key = (VERTICAL, 'top_left', CUED_OBJECT)
+    good = table[key]
+    # Target moved into the uncued placeholder
+    table.table[key] = good._replace(target=table.locations['bottom_right'])
+    with pytest.raises(ValueError):
+        table.validate(ALIGNMENTS, CUE_LOCATIONS, TARGET_LOCATIONS)
+    # Combination missing
+    del table.table[key]
+    with pytest.raises(ValueError):
+        table.validate(ALIGNMENTS, CUE_LOCATIONS, TARGET_LOCATIONS)
+    table.table[key] = good
+    table.validate(ALIGNMENTS, CUE_LOCATIONS, TARGET_LOCATIONS)
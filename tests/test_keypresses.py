@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import pytest
+
+from keypresses import KeypressCapture, ticks_to_clock
+
+
+class FakeSource(object):
+    # Hands out queued presses to the capture thread
+
+    def __init__(self):
+        self.queued = []
+        self.lock = threading.Lock()
+
+    def press(self, t, key):
+        with self.lock:
+            self.queued.append((t, key))
+
+    def __call__(self):
+        with self.lock:
+            presses, self.queued = self.queued, []
+        return presses
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+def test_ticks_to_clock():
+    # An event queued 25 ms before a reading of 2.0 s on the clock and 10000 ticks
+    assert ticks_to_clock(9975, 10000, 2.0) == pytest.approx(1.975)
+    assert ticks_to_clock(10000, 10000, 2.0) == pytest.approx(2.0)
+    # SDL_GetTicks() wrapped around between the event and the reading
+    assert ticks_to_clock(2 ** 32 - 5, 15, 2.0) == pytest.approx(1.98)
+
+
+@pytest.fixture
+def capture():
+    source = FakeSource()
+    keys = KeypressCapture(source, poll_interval=0.0005)
+    keys.start()
+    yield keys, source
+    keys.stop()
+
+
+def test_presses_are_captured_while_armed(capture):
+    keys, source = capture
+    keys.arm()
+    source.press(1.0, 'a')
+    source.press(1.5, 'space')
+    assert wait_for(lambda: len(keys.presses()) == 2)
+    assert keys.presses() == [(1.0, 'a'), (1.5, 'space')]
+    assert keys.first_press(['space']) == (1.5, 'space')
+    assert keys.first_press(after=1.2) == (1.5, 'space')
+    assert keys.first_press(['space'], after=2.0) is None
+
+
+def test_next_press_returns_each_press_once(capture):
+    keys, source = capture
+    keys.arm()
+    source.press(1.0, 'a')
+    assert wait_for(lambda: len(keys.presses()) == 1)
+    assert keys.next_press() == (1.0, 'a')
+    assert keys.next_press() is None
+    source.press(2.0, 'b')
+    assert wait_for(lambda: len(keys.presses()) == 2)
+    assert keys.next_press() == (2.0, 'b')
+
+
+def test_arming_clears_presses(capture):
+    keys, source = capture
+    keys.arm()
+    source.press(1.0, 'a')
+    assert wait_for(lambda: len(keys.presses()) == 1)
+    keys.disarm()
+    source.press(2.0, 'b')
+    time.sleep(0.01)
+    assert keys.presses() == [(1.0, 'a')]  # not polled while disarmed
+    keys.arm()
+    assert wait_for(lambda: len(keys.presses()) == 1)
+    assert keys.presses() == [(2.0, 'b')]
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+import numpy as np
+import pytest
+
+from livestats import P2Quantile, RunningStats, SessionMonitor
+
+
+def test_running_stats():
+    values = np.random.RandomState(1).normal(350, 60, 500)
+    stats = RunningStats()
+    for x in values:
+        stats.add(x)
+    assert stats.n == 500
+    assert stats.mean == pytest.approx(np.mean(values))
+    assert stats.sd == pytest.approx(np.std(values, ddof=1))
+
+
+def test_running_stats_few_values():
+    stats = RunningStats()
+    assert math.isnan(stats.sd)
+    stats.add(3)
+    assert stats.mean == 3.0
+    assert math.isnan(stats.sd)
+    stats.add(5)
+    assert stats.mean == 4.0
+    assert stats.sd == pytest.approx(math.sqrt(2))
+
+
+@pytest.mark.parametrize('p', [0.25, 0.5, 0.9])
+def test_p2_quantile(p):
+    # Skewed, like RTs
+    values = np.random.RandomState(2).lognormal(5.8, 0.3, 2000)
+    q = P2Quantile(p)
+    for x in values:
+        q.add(x)
+    exact = np.percentile(values, p * 100)
+    spread = np.percentile(values, 75) - np.percentile(values, 25)
+    assert abs(q.value - exact) < 0.05 * spread
+
+
+def test_p2_quantile_exact_for_few_values():
+    q = P2Quantile(0.5)
+    assert math.isnan(q.value)
+    for x in [400, 300, 500]:
+        q.add(x)
+    assert q.value == 400
+    for x in [100, 200]:
+        q.add(x)
+    assert q.value == 300
+
+
+def test_p2_quantile_sorted_input():
+    q = P2Quantile(0.5)
+    for x in range(1, 102):
+        q.add(float(x))
+    assert q.value == pytest.approx(51, abs=1)
+
+
+def test_session_monitor():
+    monitor = SessionMonitor(['vertical'], ['cued_object', 'catch'])
+    trial = {'session_type': 'keypress', 'box_alignment': 'vertical',
+             'target_location': 'cued_object', 'target_acquired': 'NA', 'moved_eyes': 'FALSE'}
+    monitor.add_trial(dict(trial, keypress_rt=300.0))
+    monitor.add_trial(dict(trial, keypress_rt=None, moved_eyes='TRUE'))
+    monitor.add_trial(dict(trial, target_location='catch', keypress_rt=250.0))
+    monitor.add_error({'err_type': 'early'})
+
+    cell = monitor.cells[('vertical', 'cued_object')]
+    assert (cell.trials, cell.hits, cell.rt.n, cell.rt.mean) == (2, 1, 1, 300.0)
+    catch = monitor.cells[('vertical', 'catch')]
+    assert (catch.trials, catch.hits, catch.rt.n) == (1, 1, 0)
+    summary = monitor.summary()
+    assert "3 trials completed, 1 recycled (early: 1)" in summary
+    assert "catch trials responded to: 1 of 1 (100.0%)" in summary
+    assert "moved eyes during response: 1" in summary
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import sqlite3
+
+import pytest
+
+from migrations import SCHEMA_VERSION, schema_version
+from tools import merge_db
+from tools.config import SCHEMA_PATH
+from tests.test_migrations import ORIGINAL_SCHEMA
+
+
+def make_station(path, schema=None):
+    db = sqlite3.connect(path)
+    if schema is None:
+        with open(SCHEMA_PATH) as f:
+            schema = f.read()
+    db.executescript(schema)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.commit()
+    db.close()
+    return path
+
+
+def add_participant(path, userhash, trials, rt=350.0):
+    db = sqlite3.connect(path)
+    insert_participant(db, userhash, trials, rt)
+    db.close()
+
+
+def insert_participant(db, userhash, trials, rt=350.0):
+    # Adds a participant with the given number of trials, each with one saccade
+    pid = db.execute(
+        "INSERT INTO participants (userhash, gender, age, handedness, created) "
+        "VALUES (?, 'f', 20, 'r', ?)", (userhash, "created-" + userhash)
+    ).lastrowid
+    for n in range(1, trials + 1):
+        tid = db.execute(
+            "INSERT INTO trials (participant_id, block_num, trial_num, session_type, "
+            "box_alignment, cue_location, target_location, target_acquired, keypress_rt, "
+            "moved_eyes) VALUES (?, 1, ?, 'keypress', 'vertical', 'top_left', "
+            "'cued_object', 'NA', ?, 'FALSE')", (pid, n, rt)
+        ).lastrowid
+        db.execute(
+            "INSERT INTO saccades (participant_id, trial_id, rt, accuracy, "
+            "dist_from_target, start_x, start_y, end_x, end_y, duration) "
+            "VALUES (?, ?, 200, 'inside', 10, 0, 0, 1, 1, 30)", (pid, tid)
+        )
+    db.commit()
+
+
+def file_hashes(path):
+    # Hashes of a database and its write-ahead log. Reading a WAL database can create
+    # an empty log where there wasn't one, which doesn't change its contents.
+    hashes = []
+    for suffix in ["", "-wal"]:
+        try:
+            with open(path + suffix, 'rb') as f:
+                data = f.read()
+        except IOError:
+            data = b""
+        hashes.append(hashlib.sha1(data).hexdigest())
+    return hashes
+
+
+def merge(master, stations):
+    db = merge_db.open_master(master)
+    try:
+        return merge_db.merge_batch(db, stations)
+    finally:
+        db.close()
+
+
+def linked_rows(master):
+    # Each trial and saccade with its participant's userhash, following the ids
+    db = sqlite3.connect(master)
+    trials = db.execute(
+        "SELECT p.userhash, t.trial_num FROM trials t JOIN participants p "
+        "ON p.id = t.participant_id ORDER BY 1, 2"
+    ).fetchall()
+    saccades = db.execute(
+        "SELECT p.userhash, t.trial_num FROM saccades s JOIN trials t ON t.id = s.trial_id "
+        "JOIN participants p ON p.id = s.participant_id AND p.id = t.participant_id "
+        "ORDER BY 1, 2"
+    ).fetchall()
+    db.close()
+    return trials, saccades
+
+
+@pytest.fixture(params=[True, False], ids=['read-only', 'copied'])
+def attach_mode(request, monkeypatch):
+    if request.param and not merge_db.READ_ONLY_ATTACH:
+        pytest.skip("stations can only be attached read-only under Python 3")
+    monkeypatch.setattr(merge_db, 'READ_ONLY_ATTACH', request.param)
+
+
+def test_merge_remaps_ids(tmpdir, attach_mode):
+    a = make_station(str(tmpdir.join("a.db")))
+    b = make_station(str(tmpdir.join("b.db")))
+    add_participant(a, 'p1', 3)
+    add_participant(b, 'p2', 2)  # same ids as p1's rows in station a
+    master = str(tmpdir.join("master.db"))
+
+    merged = merge(master, [('a', a), ('b', b)])
+    assert merged[0] == ('a', {
+        'participants': (1, 0), 'trials': (3, 0), 'saccades': (3, 0), 'trials_err': (0, 0),
+        'frame_timing': (0, 0), 'gaze_index': (0, 0), 'session_sequence': (0, 0),
+        'session_checkpoints': (0, 0)
+    })
+    assert merged[1][1]['trials'] == (2, 0)
+    trials, saccades = linked_rows(master)
+    expected = [('p1', 1), ('p1', 2), ('p1', 3), ('p2', 1), ('p2', 2)]
+    assert trials == saccades == expected
+
+
+def test_merge_is_incremental(tmpdir, attach_mode):
+    a = make_station(str(tmpdir.join("a.db")))
+    add_participant(a, 'p1', 2)
+    master = str(tmpdir.join("master.db"))
+    merge(master, [('a', a)])
+
+    add_participant(a, 'p2', 1)
+    merged = merge(master, [('a', a)])
+    counts = merged[0][1]
+    assert (counts['participants'], counts['trials'], counts['saccades']) == (
+        (1, 0), (1, 0), (1, 0))
+    assert merge(master, [('a', a)])[0][1]['trials'] == (0, 0)
+    trials, saccades = linked_rows(master)
+    assert trials == saccades == [('p1', 1), ('p1', 2), ('p2', 1)]
+
+
+def test_merge_matches_userhash(tmpdir, attach_mode):
+    # A session resumed on another station is merged into the same participant
+    a = make_station(str(tmpdir.join("a.db")))
+    b = make_station(str(tmpdir.join("b.db")))
+    add_participant(a, 'p1', 2)
+    add_participant(b, 'p1', 1)
+    master = str(tmpdir.join("master.db"))
+    merged = merge(master, [('a', a), ('b', b)])
+    assert merged[1][1]['participants'] == (0, 0)
+
+    db = sqlite3.connect(master)
+    assert db.execute("SELECT COUNT(*) FROM participants").fetchone()[0] == 1
+    db.close()
+    trials, saccades = linked_rows(master)
+    assert trials == [('p1', 1), ('p1', 1), ('p1', 2)]
+
+
+def test_unnamed_and_empty_stations(tmpdir, attach_mode):
+    a = make_station(str(tmpdir.join("a.db")))
+    empty = make_station(str(tmpdir.join("empty.db")))
+    add_participant(a, 'p1', 1)
+    master = str(tmpdir.join("master.db"))
+    merged = merge(master, [(None, a), (None, empty)])
+    name = merged[0][0]
+    assert len(name) == 12
+    assert merged[1] == (None, {})
+
+    # Recognized by its first participant the next time, wherever it is
+    moved = str(tmpdir.join("moved.db"))
+    tmpdir.join("a.db").copy(tmpdir.join("moved.db"))
+    assert merge(master, [(None, moved)])[0] == (name, dict(
+        (table, (0, 0)) for table in merged[0][1]
+    ))
+
+
+def test_stations_are_not_modified(tmpdir, attach_mode):
+    a = make_station(str(tmpdir.join("a.db")))
+    add_participant(a, 'p1', 5)
+    # Leave trials in the write-ahead log, as a running session would
+    writer = sqlite3.connect(a)
+    writer.execute("PRAGMA wal_autocheckpoint = 0")
+    insert_participant(writer, 'p2', 2)
+    old = make_station(str(tmpdir.join("old.db")), ORIGINAL_SCHEMA)
+    add_participant(old, 'p3', 1, rt='TIMEOUT')
+    before = [file_hashes(a), file_hashes(old)]
+
+    master = str(tmpdir.join("master.db"))
+    merge(master, [('a', a), ('old', old)])
+    assert [file_hashes(a), file_hashes(old)] == before
+    writer.close()
+
+    db = sqlite3.connect(old)
+    assert schema_version(db) == 0
+    db.close()
+    trials, saccades = linked_rows(master)
+    assert ('p2', 2) in trials and ('p3', 1) in trials
+
+
+def test_old_schema_station(tmpdir, attach_mode):
+    old = make_station(str(tmpdir.join("old.db")), ORIGINAL_SCHEMA)
+    add_participant(old, 'p1', 1, rt='512.5')
+    add_participant(old, 'p2', 1, rt='NA')
+    db = sqlite3.connect(old)
+    db.execute(
+        "INSERT INTO trials_err (participant_id, block_num, trial_num, session_type, "
+        "box_alignment, cue_location, target_location, err_type) "
+        "VALUES (1, 1, 2, 'keypress', 'vertical', 'top_left', 'cued_object', 'early')"
+    )
+    db.commit()
+    db.close()
+
+    master = str(tmpdir.join("master.db"))
+    counts = merge(master, [('old', old)])[0][1]
+    assert counts['trials_err'] == (1, 0)
+    assert 'gaze_index' not in counts
+
+    db = sqlite3.connect(master)
+    assert schema_version(db) == SCHEMA_VERSION
+    rts = db.execute("SELECT keypress_rt, typeof(keypress_rt) FROM trials ORDER BY id")
+    assert rts.fetchall() == [(512.5, 'real'), (None, 'null')]
+    # Columns added since then get their defaults
+    assert db.execute("SELECT fixation_break_time FROM trials_err").fetchall() == [('NA',)]
+    db.close()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+
+import pytest
+
+from migrations import SCHEMA_VERSION, keypress_rt_column, migrate, schema_statements
+from tools.config import SCHEMA_PATH
+
+# The tables of the original release of the schema (version 0)
+ORIGINAL_SCHEMA = """
+CREATE TABLE participants (
+    id integer primary key autoincrement not null,
+    userhash text not null,
+    gender text not null,
+    age integer not null,
+    handedness text not null,
+    created text not null
+);
+CREATE TABLE trials (
+    id integer primary key autoincrement not null,
+    participant_id integer not null references participants(id),
+    block_num integer not null,
+    trial_num integer not null,
+    session_type text not null,
+    box_alignment text not null,
+    cue_location text not null,
+    target_location text not null,
+    target_acquired text not null,
+    keypress_rt text not null,
+    moved_eyes text not null
+);
+CREATE TABLE trials_err (
+    id integer primary key autoincrement not null,
+    participant_id integer not null references participants(id),
+    block_num integer not null,
+    trial_num integer not null,
+    session_type text not null,
+    box_alignment text not null,
+    cue_location text not null,
+    target_location text not null,
+    err_type text not null
+);
+CREATE TABLE saccades (
+    id integer primary key autoincrement not null,
+    participant_id integer not null references participants(id),
+    trial_id integer not null,
+    rt float not null,
+    accuracy text not null,
+    dist_from_target float not null,
+    start_x integer not null,
+    start_y integer not null,
+    end_x integer not null,
+    end_y integer not null,
+    duration float not null
+);
+"""
+
+RTS = ['512.25', 'NA', 'TIMEOUT', '430']
+
+
+def columns(db, table):
+    return [row[1] for row in db.execute("PRAGMA table_info({0})".format(table))]
+
+
+@pytest.fixture
+def old_db(tmpdir):
+    path = str(tmpdir.join("old.db"))
+    db = sqlite3.connect(path)
+    db.executescript(ORIGINAL_SCHEMA)
+    db.execute(
+        "INSERT INTO participants (userhash, gender, age, handedness, created) "
+        "VALUES ('abc', 'f', 20, 'r', 'now')"
+    )
+    # Leave a gap in the trial ids, which the rebuilt table has to keep
+    for i, rt in enumerate(RTS):
+        db.execute(
+            "INSERT INTO trials VALUES (?, 1, 1, ?, 'keypress', 'vertical', 'top_left', "
+            "'cued_object', 'NA', ?, 'FALSE')", (i * 2 + 1, i + 1, rt)
+        )
+    db.execute(
+        "INSERT INTO trials_err (participant_id, block_num, trial_num, session_type, "
+        "box_alignment, cue_location, target_location, err_type) "
+        "VALUES (1, 1, 2, 'keypress', 'vertical', 'top_left', 'cued_object', 'early')"
+    )
+    db.commit()
+    db.close()
+    return path
+
+
+def test_schema_statements():
+    tables, indexes = schema_statements(SCHEMA_PATH)
+    assert set(['participants', 'trials', 'saccades', 'session_checkpoints']) <= set(tables)
+    assert 'trials_participant' in indexes
+    assert all(s.upper().startswith("CREATE TABLE") for s in tables.values())
+
+
+def test_migrate_from_original(old_db):
+    assert migrate(old_db, SCHEMA_PATH) == (0, SCHEMA_VERSION)
+
+    db = sqlite3.connect(old_db)
+    assert db.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    tables, indexes = schema_statements(SCHEMA_PATH)
+    for table in tables:
+        assert len(columns(db, table))
+    found = set(row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+    assert set(indexes) <= found
+    assert 'fixation_break_time' in columns(db, 'trials_err')
+    assert db.execute("SELECT fixation_break_time FROM trials_err").fetchall() == [('NA',)]
+
+    # RTs are now numbers (NULL without a response), with the trial ids kept
+    rows = db.execute("SELECT id, trial_num, keypress_rt FROM trials ORDER BY id").fetchall()
+    assert rows == [(1, 1, 512.25), (3, 2, None), (5, 3, None), (7, 4, 430.0)]
+    assert db.execute("SELECT typeof(keypress_rt) FROM trials WHERE id = 7").fetchone()[0] == 'real'
+    db.close()
+
+
+def test_migrate_is_idempotent(old_db):
+    migrate(old_db, SCHEMA_PATH)
+    db = sqlite3.connect(old_db)
+    before = db.execute("SELECT * FROM trials ORDER BY id").fetchall()
+    db.close()
+
+    assert migrate(old_db, SCHEMA_PATH) == (SCHEMA_VERSION, SCHEMA_VERSION)
+    db = sqlite3.connect(old_db)
+    assert db.execute("SELECT * FROM trials ORDER BY id").fetchall() == before
+    db.close()
+
+
+def test_new_database_is_current(tmpdir):
+    path = str(tmpdir.join("new.db"))
+    db = sqlite3.connect(path)
+    with open(SCHEMA_PATH) as f:
+        db.executescript(f.read())
+    db.close()
+    assert migrate(path, SCHEMA_PATH) == (SCHEMA_VERSION, SCHEMA_VERSION)
+
+
+def test_keypress_rt_column(old_db):
+    # Reads RTs as numbers whether or not the database has been upgraded
+    query = "SELECT {0} FROM trials t ORDER BY t.id"
+    db = sqlite3.connect(old_db)
+    old = db.execute(query.format(keypress_rt_column(db, 't'))).fetchall()
+    db.close()
+    migrate(old_db, SCHEMA_PATH)
+    db = sqlite3.connect(old_db)
+    assert keypress_rt_column(db, 't') == "t.keypress_rt"
+    new = db.execute(query.format(keypress_rt_column(db, 't'))).fetchall()
+    db.close()
+    assert old == new == [(512.25,), (None,), (None,), (430.0,)]
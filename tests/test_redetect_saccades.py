@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+
+import numpy as np
+import pytest
+
+from gaze import GazeRecorder, SACC_INSIDE, SACC_OUTSIDE
+from geometry import pixels_per_degree, stimulus_locations
+from tools.config import SCHEMA_PATH
+from tools.redetect_saccades import (
+    LOCATION_OFFSET, detect_saccades, gaze_jobs, redetect_gaze_file
+)
+
+SCREEN = (1920, 1080)
+CENTRE = (960, 540)
+SETTINGS = {'screen': (SCREEN, 24.0, 57), 'thresholds': (20, 5000, 0.15)}
+PPD = pixels_per_degree(SCREEN, 24.0, 57)
+LOCATIONS = stimulus_locations(CENTRE, int(LOCATION_OFFSET * PPD))
+
+TARGET_ONSET = 5000.0
+SACCADE_ONSET = 5200.0  # 200 ms after target onset
+SACCADE_DURATION = 40
+
+
+def trace(end_xy, onset=SACCADE_ONSET, n=1500):
+    # A 1000 Hz trace fixating the centre from 500 ms before target onset, then
+    # making a smooth (raised cosine) saccade to end_xy and staying there
+    t = TARGET_ONSET - 500 + np.arange(n, dtype=np.float64)
+    progress = np.clip((t - onset) / SACCADE_DURATION, 0, 1)
+    progress = (1 - np.cos(np.pi * progress)) / 2
+    x = CENTRE[0] + progress * (end_xy[0] - CENTRE[0])
+    y = CENTRE[1] + progress * (end_xy[1] - CENTRE[1])
+    return t, x, y
+
+
+@pytest.fixture
+def db(tmpdir):
+    db = sqlite3.connect(str(tmpdir.join("test.db")))
+    with open(SCHEMA_PATH) as f:
+        db.executescript(f.read())
+    yield db
+    db.close()
+
+
+def add_trial(db, recorder, trial_num, cue, target_location, t, x, y):
+    # Adds a saccade trial and records its gaze samples
+    tid = db.execute(
+        "INSERT INTO trials (participant_id, block_num, trial_num, session_type, "
+        "box_alignment, cue_location, target_location, target_acquired, keypress_rt, "
+        "moved_eyes) VALUES (1, 1, ?, 'saccade', 'vertical', ?, ?, 'TRUE', NULL, 'NA')",
+        (trial_num, cue, target_location)
+    ).lastrowid
+    recorder.begin()
+    recorder.add(np.column_stack([t, x, y, np.full(len(t), 1000.0), np.zeros(len(t))]))
+    offset, count, dropped = recorder.flush()
+    db.execute(
+        "INSERT INTO gaze_index (participant_id, trial_id, block_num, trial_num, file, "
+        "sample_offset, sample_count, dropped_samples, target_onset) "
+        "VALUES (1, ?, 1, ?, 'p1_gaze.bin', ?, ?, ?, ?)",
+        (tid, trial_num, offset, count, dropped, str(TARGET_ONSET))
+    )
+    db.commit()
+
+
+def test_detect_saccades_onset_and_offset():
+    t, x, y = trace(LOCATIONS['top_left'])
+    onsets, offsets = detect_saccades(t, x, y, PPD, 20, 5000, 0.15)
+    assert len(onsets) == len(offsets) == 1
+    assert abs(t[onsets[0]] - SACCADE_ONSET) <= 5
+    assert abs(t[offsets[0]] - (SACCADE_ONSET + SACCADE_DURATION)) <= 5
+
+
+def test_detect_saccades_ignores_blinks_and_small_movements():
+    t, x, y = trace(LOCATIONS['top_left'])
+    x[650:760] = np.nan  # the saccade runs into missing data
+    y[650:760] = np.nan
+    assert len(detect_saccades(t, x, y, PPD, 20, 5000, 0.15)[0]) == 0
+    t, x, y = trace((CENTRE[0] + 2, CENTRE[1]))  # below the motion threshold
+    assert len(detect_saccades(t, x, y, PPD, 20, 5000, 0.15)[0]) == 0
+
+
+def test_redetect_gaze_file(tmpdir, db):
+    recorder = GazeRecorder(str(tmpdir.join("p1_gaze.bin")))
+    # Trial 1's saccade lands on the target (the cued location), trial 2's on the
+    # placeholder diagonally opposite the target, and trial 3 has no saccade
+    add_trial(db, recorder, 1, 'top_left', 'cued_location', *trace(LOCATIONS['top_left']))
+    add_trial(db, recorder, 2, 'top_left', 'cued_location', *trace(LOCATIONS['bottom_right']))
+    add_trial(db, recorder, 3, 'top_left', 'cued_location', *trace(CENTRE))
+
+    jobs = gaze_jobs(str(tmpdir.join("test.db")), str(tmpdir), SETTINGS)
+    assert len(jobs) == 1
+    name, rows, n_trials, skipped = redetect_gaze_file(jobs[0])
+    assert (name, n_trials, skipped) == ('p1_gaze.bin', 3, 0)
+    assert [row['trial_num'] for row in rows] == [1, 2]
+
+    hit, miss = rows
+    target = LOCATIONS['top_left']
+    assert abs(hit['rt'] - 200) <= 5
+    assert hit['end_x'] == pytest.approx(target[0], abs=1)
+    assert hit['end_y'] == pytest.approx(target[1], abs=1)
+    assert hit['start_x'] == pytest.approx(CENTRE[0], abs=1)
+    assert hit['dist_from_target'] < 1
+    assert (hit['accuracy'], hit['target_acquired'], hit['saccade_num']) == (
+        SACC_INSIDE, 'TRUE', 1)
+
+    other = LOCATIONS['bottom_right']
+    assert miss['end_x'] == pytest.approx(other[0], abs=1)
+    assert miss['accuracy'] == SACC_OUTSIDE
+    assert miss['target_acquired'] == 'FALSE'
+    assert miss['dist_from_target'] == pytest.approx(
+        np.hypot(other[0] - target[0], other[1] - target[1]), abs=1)
+
+
+def test_redetect_skips_trials_without_samples(tmpdir, db):
+    recorder = GazeRecorder(str(tmpdir.join("p1_gaze.bin")))
+    empty = np.zeros(0)
+    add_trial(db, recorder, 1, 'top_left', 'cued_location', empty, empty, empty)
+    jobs = gaze_jobs(str(tmpdir.join("test.db")), str(tmpdir), SETTINGS)
+    assert redetect_gaze_file(jobs[0])[1:] == ([], 1, 1)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+
+import pytest
+
+from datastore import AsyncWriter
+from session import SessionSequence, TrialIterators, load_session, resume_position
+from tools.config import SCHEMA_PATH
+
+FACTORS = ['box_alignment', 'cue_location', 'target_location']
+
+
+def trial(n):
+    return {'box_alignment': 'vertical', 'cue_location': 'top_left',
+            'target_location': 'loc{0}'.format(n)}
+
+
+class TrialIterator(object):
+    # The parts of klibs' iterators that session.py relies on
+
+    def __init__(self, trials):
+        self.trials = trials
+        self.length = len(trials)
+        self.i = 0
+
+
+class BlockIterator(object):
+
+    def __init__(self, blocks):
+        self.blocks = [TrialIterator(trials) for trials in blocks]
+        self.i = 0
+
+
+@pytest.fixture
+def db_path(tmpdir):
+    path = str(tmpdir.join("session.db"))
+    db = sqlite3.connect(path)
+    with open(SCHEMA_PATH) as f:
+        db.executescript(f.read())
+    db.execute(
+        "INSERT INTO participants (userhash, gender, age, handedness, created) "
+        "VALUES ('p1', 'n', 20, 'r', 'now')"
+    )
+    db.commit()
+    db.close()
+    return path
+
+
+@pytest.mark.parametrize("checkpoint, expected", [
+    (None, (1, 0, 0)),             # no trials completed yet
+    ((1, 2, 2), (1, 2, 2)),        # part way through a block
+    ((1, 4, 4), (2, 0, 0)),        # block finished: start of the next one
+    ((2, 4, 4), (2, 4, 4)),        # last block finished: nothing left to run
+])
+def test_resume_position(checkpoint, expected):
+    blocks = [[trial(n) for n in range(4)] for b in range(2)]
+    assert resume_position(blocks, checkpoint) == expected
+
+
+def test_store_and_load(db_path):
+    writer = AsyncWriter(db_path)
+    sequence = SessionSequence(writer, 1, FACTORS)
+    blocks = [[trial(n) for n in range(4)], [trial(n) for n in range(4, 8)]]
+    sequence.store(blocks)
+
+    # Trial 2 of block 1 recycled: the rest of the block was reshuffled
+    reshuffled = [trial(0), trial(1), trial(3), trial(1), trial(2)]
+    sequence.recycled(1, reshuffled, 2)
+    for pos, trial_num in ((1, 1), (2, 2)):
+        row = dict(trial(trial_num), participant_id=1, block_num=1, trial_num=trial_num,
+            session_type='saccade', target_acquired='TRUE', moved_eyes='NA')
+        writer.put_trial(row, [('session_checkpoints', sequence.checkpoint(1, pos, trial_num))])
+    writer.close()
+
+    stored, checkpoint = load_session(db_path, 1, FACTORS)
+    assert stored == [reshuffled, blocks[1]]
+    assert checkpoint == (1, 2, 2)
+    with pytest.raises(ValueError):
+        load_session(db_path, 2, FACTORS)
+
+
+def test_restore_moves_iterators():
+    iterators = TrialIterators(BlockIterator([[trial(0), trial(1)], [trial(2), trial(3)]]))
+    stored = [[trial(1), trial(0), trial(0)], [trial(3), trial(2)]]
+    assert iterators.restore(stored, (1, 1, 1)) == (1, 1)
+    assert iterators.sequence() == stored
+    assert iterators.blocks.i == 0  # klibs starts block 1 next
+    assert iterators.blocks.blocks[0].i == 1
+    assert iterators.blocks.blocks[0].length == 3
+
+    # klibs starts the block and runs its next trial
+    iterators.blocks.i, iterators.blocks.blocks[0].i = 1, 2
+    assert iterators.current() == (stored[0], 2)
+
+
+def test_restore_rejects_wrong_number_of_blocks():
+    iterators = TrialIterators(BlockIterator([[trial(0)], [trial(1)]]))
+    with pytest.raises(RuntimeError):
+        iterators.restore([[trial(0)]], None)
+
+
+def test_unexpected_iterator_shape_fails_loudly():
+    blocks = BlockIterator([[trial(0)]])
+    blocks.blocks[0].trials = tuple(blocks.blocks[0].trials)
+    with pytest.raises(RuntimeError) as e:
+        TrialIterators(blocks)
+    assert "klibs" in str(e.value)
+
+    blocks = BlockIterator([[trial(0)]])
+    del blocks.i
+    with pytest.raises(RuntimeError):
+        TrialIterators(blocks)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+from gaze import ENDSACC, FixationMonitor, TrackerSampleSource
+from simulation import (
+    SimulatedEyeLink, SyntheticParticipant, TrialScript, VirtualClock, generate_blocks
+)
+
+CENTRE = (960, 540)
+BOUNDARY = 100
+
+
+def test_virtual_clock():
+    clock = VirtualClock(10)
+    assert clock.now() == 10.0
+    clock.advance(5)
+    clock.advance(-3)  # never goes backwards
+    assert clock.now() == 15.0
+    clock.advance_to(12)
+    assert clock.now() == 15.0
+    clock.advance_to(40)
+    clock.sleep(0.25)
+    assert clock.now() == 290.0
+    assert clock.seconds() == 0.29
+
+
+def saccade_script():
+    script = TrialScript()
+    script.saccades = [(2200.0, 2240.0, CENTRE, (1160.0, 540.0))]
+    return script
+
+
+def start_trial(clock, script, sample_rate=500):
+    el = SimulatedEyeLink(clock, CENTRE, BOUNDARY, sample_rate)
+    el.begin_trial(script, clock.now())
+    el.start(1)
+    return el
+
+
+def test_tracker_buffers_samples_and_saccade_events():
+    clock = VirtualClock(1000)
+    el = start_trial(clock, saccade_script())
+    source = TrackerSampleSource(el, event_types=[ENDSACC])
+    assert source.buffered
+
+    clock.advance(2000)  # a sample every 2 ms, from the start of recording
+    samples = source.read()
+    assert len(samples) == 1001
+    assert samples[0].tolist() == [1000.0, CENTRE[0], CENTRE[1]]
+    assert samples[-1][0] == 3000.0
+    assert source.read().shape == (0, 3)  # nothing new until the clock moves
+    assert source.events() == []
+
+    clock.advance(1000)
+    samples = source.read()
+    assert len(samples) == 500
+    events = source.events()
+    assert len(events) == 1
+    assert (events[0].getStartTime(), events[0].getEndTime()) == (3200, 3240)
+    assert events[0].getEndGaze() == (1160, 540)
+    # Gaze moves once the saccade has ended
+    landed = samples[samples[:, 0] >= 3240]
+    assert (landed[:, 1] == 1160).all()
+    assert (samples[samples[:, 0] < 3240][:, 1] == CENTRE[0]).all()
+
+
+def test_tracker_fixation_break_in_batch():
+    clock = VirtualClock()
+    script = TrialScript()
+    script.fixation_break = 701.0
+    el = start_trial(clock, script, sample_rate=1000)
+    source = TrackerSampleSource(el)
+    monitor = FixationMonitor(CENTRE, BOUNDARY)
+
+    clock.advance(500)
+    assert monitor.first_violation(source.read()) is None
+    # A check well after the break still finds the first sample outside
+    clock.advance(500)
+    violation = monitor.first_violation(source.read())
+    assert violation[0] == 701.0
+    assert violation[1] == CENTRE[0] + BOUNDARY * 2
+
+
+def test_tracker_only_buffers_while_recording():
+    clock = VirtualClock()
+    el = start_trial(clock, saccade_script())
+    clock.advance(100)
+    el.stop()
+    assert el.getNextData() == 0
+    assert el.getFloatData() is None
+
+
+def test_generate_blocks_is_deterministic():
+    levels = {'a': [1, 2], 'b': ['x', 'y', 'z']}
+    blocks = generate_blocks(levels, ['a', 'b'], 8, 3, random.Random(1))
+    assert [len(b) for b in blocks] == [8, 8, 8]
+    assert blocks == generate_blocks(levels, ['a', 'b'], 8, 3, random.Random(1))
+    assert all(set(t) == set(['a', 'b']) for b in blocks for t in b)
+
+
+def test_participant_saccade_script():
+    participant = SyntheticParticipant(random.Random(3), {
+        'fixation_break_rate': 0.0, 'early_response_rate': 0.0, 'miss_rate': 0.0,
+        'undershoot_rate': 1.0
+    })
+    keys = {'response': 32, 'other': 33}
+    script = participant.script('saccade', 'cued_object', (1160, 540), CENTRE, 40.0, keys)
+    assert script.fixation_break is None and script.key_press is None
+    assert len(script.saccades) == 2  # an undershoot, then the target
+    first, second = script.saccades
+    assert first[1] < second[0]
+    assert abs(second[3][0] - 1160) < 5 * 0.6 * 40
+    assert script.events() == sorted([first[1], second[1]])
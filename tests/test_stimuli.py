@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from stimuli import StimulusCache, render_surface
+
+ALIGNMENTS = ['vertical', 'horizontal']
+CUE_LOCATIONS = ['top_left', 'top_right', 'bottom_left', 'bottom_right']
+
+
+class Drawbject(object):
+    # Renders to an RGBA array, like a klibs drawbject
+
+    def __init__(self, width, height, colour):
+        self.width, self.height, self.colour = width, height, colour
+        self.renders = 0
+
+    def render(self):
+        self.renders += 1
+        surface = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        surface[1:-1, 1:-1] = self.colour
+        return surface
+
+
+class Builders(object):
+    # Stimulus construction code, with a colour that can be changed afterwards
+
+    def __init__(self):
+        self.cue_colour = (255, 255, 255, 255)
+        self.built = []
+
+    def placeholder(self, alignment):
+        self.built.append(('placeholder', alignment))
+        width, height = (20, 60) if alignment == 'vertical' else (60, 20)
+        return Drawbject(width, height, (128, 128, 128, 255))
+
+    def cue(self, alignment):
+        self.built.append(('cue', alignment))
+        width, height = (20, 60) if alignment == 'vertical' else (60, 20)
+        return render_surface(Drawbject(width, height, self.cue_colour))
+
+
+def test_render_surface():
+    stim = Drawbject(4, 3, (1, 2, 3, 4))
+    surface = render_surface(stim)
+    assert surface.shape == (3, 4, 4) and stim.renders == 1
+    assert render_surface(surface) is surface
+
+
+def test_cache_matches_fresh_renders():
+    builders = Builders()
+    cache = StimulusCache(ALIGNMENTS, CUE_LOCATIONS, builders.placeholder, builders.cue)
+    assert len(builders.built) == 4  # each stimulus is only built once
+    assert cache.placeholder('horizontal').shape == (20, 60, 4)
+    assert cache.cue('vertical', 'top_left') is cache.cue('vertical', 'bottom_right')
+    assert cache.verify() == []
+
+
+def test_verify_detects_changed_stimuli():
+    builders = Builders()
+    cache = StimulusCache(ALIGNMENTS, CUE_LOCATIONS, builders.placeholder, builders.cue)
+    builders.cue_colour = (255, 0, 0, 255)
+    mismatches = cache.verify()
+    assert len(mismatches) == len(ALIGNMENTS) * len(CUE_LOCATIONS)
+    assert ('cue', 'vertical', 'top_left') in mismatches
+    assert not any(m[0] == 'placeholder' for m in mismatches)
+
+
+def test_verify_prerendered_surfaces():
+    # e.g. surfaces loaded from an asset bundle made with different stimulus code
+    builders = Builders()
+    rendered = dict(
+        (a, (builders.placeholder(a), builders.cue(a))) for a in ALIGNMENTS
+    )
+    rendered['horizontal'] = (np.zeros((20, 60, 4), dtype=np.uint8), rendered['horizontal'][1])
+    del builders.built[:]
+    cache = StimulusCache(
+        ALIGNMENTS, CUE_LOCATIONS, builders.placeholder, builders.cue, rendered=rendered
+    )
+    assert builders.built == []  # nothing is rendered unless verified
+    assert cache.verify() == [('placeholder', 'horizontal')]
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from timing import FlipTimer, FramePacer, FRAME_CUE, FRAME_TARGET
+
+REFRESH_MS = 10.0
+
+
+class FakeClock(object):
+    # A clock (in seconds) that only moves when told to
+
+    def __init__(self):
+        self.t = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.t
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.t += seconds
+
+
+def flip(timer, clock, duration_ms, content=0, trial_ms=0.0):
+    timer.start()
+    clock.t += duration_ms / 1000.0
+    timer.stop(content, trial_ms)
+
+
+@pytest.mark.parametrize("duration_ms, dropped", [
+    (2.0, 0),    # flip returned early (no wait for vsync)
+    (10.0, 0),   # waited one refresh
+    (11.0, 0),   # within the 10% allowance for jitter
+    (12.0, 1),   # missed the first refresh
+    (20.0, 1),
+    (22.0, 2),   # missed two refreshes
+    (35.0, 3),
+])
+def test_dropped_frames(duration_ms, dropped):
+    clock = FakeClock()
+    timer = FlipTimer(clock=clock)
+    timer.begin_trial()
+    flip(timer, clock, duration_ms)
+    assert timer.summary(REFRESH_MS, 0, 0, 0)['dropped_frames'] == dropped
+
+
+def test_dropped_frames_are_summed_over_the_trial_only():
+    clock = FakeClock()
+    timer = FlipTimer(clock=clock)
+    flip(timer, clock, 50.0)  # previous trial
+    timer.begin_trial()
+    for duration_ms in (10.0, 25.0, 10.0, 30.0):
+        flip(timer, clock, duration_ms)
+    assert timer.summary(REFRESH_MS, 0, 0, 0)['dropped_frames'] == 2 + 2
+
+
+def test_stimulus_timing():
+    clock = FakeClock()
+    timer = FlipTimer(clock=clock)
+    timer.begin_trial()
+    flip(timer, clock, 10.0, 0, 0.0)
+    clock.t = 1.0
+    flip(timer, clock, 10.0, FRAME_CUE, 1003.0)
+    clock.t = 1.1
+    flip(timer, clock, 10.0, 0, 1104.0)
+    clock.t = 1.96
+    flip(timer, clock, 10.0, FRAME_TARGET, 1975.0)
+    summary = timer.summary(REFRESH_MS, 1000, 1100, 1960)
+    assert summary['cue_onset_error'] == pytest.approx(3.0)
+    assert summary['cue_duration'] == pytest.approx(100.0)
+    assert summary['soa'] == pytest.approx(960.0)
+    assert summary['target_onset_error'] == pytest.approx(15.0)
+    assert summary['late_frames'] == 1
+    assert summary['dropped_frames'] == 0
+
+
+def test_catch_trial_has_no_target_timing():
+    clock = FakeClock()
+    timer = FlipTimer(clock=clock)
+    timer.begin_trial()
+    flip(timer, clock, 10.0, FRAME_CUE, 1000.0)
+    flip(timer, clock, 10.0, 0, 1100.0)
+    summary = timer.summary(REFRESH_MS, 1000, 1100, 1960)
+    assert summary['soa'] is None and summary['target_onset_error'] is None
+
+
+def test_ring_buffer_wraps():
+    clock = FakeClock()
+    timer = FlipTimer(capacity=4, clock=clock)
+    assert timer.last_flip is None
+    timer.begin_trial()
+    for i in range(10):
+        flip(timer, clock, 30.0 if i < 6 else 20.0)
+    # Only the last 4 flips (1 dropped frame each) are still in the buffers
+    assert timer.summary(REFRESH_MS, 0, 0, 0)['dropped_frames'] == 4
+    assert timer.last_flip == pytest.approx(0.18 + 0.08)
+
+
+def test_frame_pacer_does_not_burst_after_overrun():
+    clock = FakeClock()
+    pacer = FramePacer(10.0, clock=clock, sleep=clock.sleep)
+    pacer.start()
+    pacer.wait()
+    assert clock.t == pytest.approx(0.01)
+    clock.t += 0.05  # a slow iteration
+    pacer.wait()
+    assert len(clock.slept) == 1  # no sleep for the overrun interval
+    pacer.wait()
+    assert clock.t == pytest.approx(0.07)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from tracing import NullTracer, Tracer, traced
+
+
+class FakeClock(object):
+    # Seconds, moved on by hand
+
+    def __init__(self):
+        self.t = 100.0
+
+    def __call__(self):
+        return self.t
+
+
+def test_nested_spans_and_counters():
+    clock = FakeClock()
+    tracer = Tracer(clock=clock)
+    tracer.begin('trial')
+    tracer.incr('gaze_polls')
+    clock.t += 0.5
+    with tracer.span('response'):
+        tracer.incr('gaze_polls', 2)
+        tracer.incr('frames')
+        clock.t += 0.25
+    # Counters stay in memory until the outermost span ends
+    assert tracer.count == 1
+    clock.t += 0.25
+    tracer.end()
+    assert tracer.counters == {}
+
+    events = tracer.events()
+    spans = [e for e in events if e['ph'] == 'X']
+    counters = sorted((e for e in events if e['ph'] == 'C'), key=lambda e: e['name'])
+    # The inner span is recorded first, when it ends
+    assert [(e['name'], e['ts'], e['dur']) for e in spans] == [
+        ('response', 500000.0, 250000.0), ('trial', 0.0, 1000000.0)
+    ]
+    # Counter totals are stamped at the start of the outermost span
+    assert counters == [
+        {'name': 'frames', 'ph': 'C', 'pid': 1, 'tid': 1, 'ts': 0.0, 'args': {'frames': 1}},
+        {'name': 'gaze_polls', 'ph': 'C', 'pid': 1, 'tid': 1, 'ts': 0.0,
+         'args': {'gaze_polls': 3}},
+    ]
+
+    # Each outermost span gets its own counter totals
+    clock.t += 1
+    with tracer.span('trial'):
+        tracer.incr('frames', 5)
+    last = tracer.events()[-1]
+    assert (last['name'], last['ts'], last['args']) == ('frames', 2000000.0, {'frames': 5})
+
+
+def test_full_buffer_counts_dropped_records(tmpdir):
+    tracer = Tracer(capacity=3, clock=FakeClock())
+    for i in range(3):
+        with tracer.span('trial'):
+            tracer.incr('polls')
+    # 3 spans + 3 counter values, only 3 of which fit
+    assert (tracer.count, tracer.dropped) == (3, 3)
+    assert len(tracer.events()) == 3
+
+    path = str(tmpdir.join("trace.json"))
+    tracer.export(path, {'participant': 1})
+    with open(path) as f:
+        trace = json.load(f)
+    assert trace['otherData'] == {'participant': 1, 'dropped': 3}
+    assert trace['displayTimeUnit'] == 'ms'
+    assert [e['name'] for e in trace['traceEvents']] == ['trial', 'polls', 'trial']
+
+
+def test_empty_tracer():
+    tracer = Tracer(clock=FakeClock())
+    assert tracer.events() == []
+
+
+def test_traced_and_null_tracer():
+    class Experiment(object):
+        def __init__(self, tracer):
+            self.tracer = tracer
+
+        @traced('trial_prep')
+        def trial_prep(self, x):
+            self.tracer.incr('calls')
+            return x * 2
+
+    exp = Experiment(Tracer(clock=FakeClock()))
+    assert exp.trial_prep(2) == 4
+    assert [e['name'] for e in exp.tracer.events()] == ['trial_prep', 'calls']
+    assert Experiment.trial_prep.__name__ == 'trial_prep'
+
+    exp = Experiment(NullTracer())
+    assert exp.trial_prep(3) == 6
+    with exp.tracer.span('anything'):
+        exp.tracer.begin('inner')
+        exp.tracer.end()
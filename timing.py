@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import numpy as np
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    # Python 2 has no monotonic clock, so use SDL's high-resolution counter
+    try:
+        from sdl2 import SDL_GetPerformanceCounter, SDL_GetPerformanceFrequency
+        _counter_hz = float(SDL_GetPerformanceFrequency())
+        def clock():
+            return SDL_GetPerformanceCounter() / _counter_hz
+    except ImportError:
+        from timeit import default_timer as clock
+
+
+class FramePacer(object):
+    """Paces a polling loop so that it runs once per interval instead of spinning as
+    fast as the CPU allows.
+
+    If an iteration overruns its interval, the pacer starts a new interval from the
+    current time instead of trying to catch up with a burst of iterations.
+
+    Args:
+        interval (float): The interval between iterations, in milliseconds.
+        clock (callable, optional): Returns the current time in seconds.
+        sleep (callable, optional): Sleeps for a given number of seconds.
+
+    """
+
+    def __init__(self, interval, clock=clock, sleep=time.sleep):
+        self.interval = interval / 1000.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next = None
+
+    def start(self):
+        """Starts the first interval."""
+        self._next = self.clock() + self.interval
+
+    def wait(self):
+        """Sleeps until the end of the current interval, then starts the next one."""
+        if self._next is None:
+            self.start()
+        remaining = self._next - self.clock()
+        if remaining > 0:
+            self.sleep(remaining)
+        self._next += self.interval
+        now = self.clock()
+        if self._next < now:
+            self._next = now + self.interval
+
+
+# Flags describing what was on screen after a flip
+FRAME_CUE = 1
+FRAME_TARGET = 2
+
+
+class FlipTimer(object):
+    """Records high-resolution timestamps for each flip of the display into
+    preallocated ring buffers, and summarizes the actual stimulus timing of each
+    trial from them.
+
+    Call start() immediately before a flip and stop() immediately after it. With
+    vsync enabled, a flip blocks until the next refresh, so a flip that takes
+    longer than one refresh interval has missed at least one frame.
+
+    Args:
+        capacity (int, optional): The number of flips the ring buffers can hold.
+        clock (callable, optional): Returns the current time in seconds.
+
+    """
+
+    def __init__(self, capacity=1024, clock=clock):
+        self.capacity = capacity
+        self.clock = clock
+        self.requested = np.zeros(capacity, dtype=np.float64)
+        self.completed = np.zeros(capacity, dtype=np.float64)
+        self.trial_ms = np.zeros(capacity, dtype=np.float64)
+        self.content = np.zeros(capacity, dtype=np.uint8)
+        self.count = 0
+        self._trial_start = 0
+        self._t = 0.0
+
+    def begin_trial(self):
+        """Marks the start of a trial: summary() only considers flips after this."""
+        self._trial_start = self.count
+
+    def start(self):
+        self._t = self.clock()
+
+    def stop(self, content=0, trial_ms=np.nan):
+        """Records a completed flip.
+
+        Args:
+            content (int, optional): FRAME_CUE and/or FRAME_TARGET flags for what
+                is on screen after the flip.
+            trial_ms (float, optional): The trial time of the flip, in ms.
+
+        """
+        i = self.count % self.capacity
+        self.requested[i] = self._t
+        self.completed[i] = self.clock()
+        self.content[i] = content
+        self.trial_ms[i] = trial_ms
+        self.count += 1
+
+    @property
+    def last_flip(self):
+        """float: The time at which the most recent flip completed, or None."""
+        if not self.count:
+            return None
+        return float(self.completed[(self.count - 1) % self.capacity])
+
+    def _trial_indices(self):
+        first = max(self._trial_start, self.count - self.capacity)
+        return np.arange(first, self.count) % self.capacity
+
+    def summary(self, refresh_ms, cue_on, cue_off, target_on):
+        """Summarizes the actual timing of the cue and target on the current trial.
+
+        Args:
+            refresh_ms (float): The measured refresh interval of the display.
+            cue_on (float): The scheduled cue onset (ms from trial start).
+            cue_off (float): The scheduled cue offset (ms from trial start).
+            target_on (float): The scheduled target onset (ms from trial start).
+
+        Returns:
+            dict: The actual cue duration, cue-target SOA, and cue/target onset
+            errors (all in ms), along with the number of stimulus changes that
+            appeared more than a refresh after they were scheduled ('late_frames')
+            and the number of refreshes missed by flips ('dropped_frames'). Values
+            that couldn't be measured (e.g. the target on catch trials) are None.
+
+        """
+        idx = self._trial_indices()
+        content = self.content[idx]
+        done = self.completed[idx]
+        trial_ms = self.trial_ms[idx]
+
+        def first(mask):
+            hits = np.flatnonzero(mask)
+            return hits[0] if len(hits) else None
+
+        cue_shown = (content & FRAME_CUE).astype(bool)
+        cue = first(cue_shown)
+        off = None if cue is None else first(~cue_shown & (np.arange(len(idx)) > cue))
+        target = first(content & FRAME_TARGET)
+
+        def ms(a, b):
+            return None if a is None or b is None else float(done[b] - done[a]) * 1000.0
+
+        def error(i, scheduled):
+            return None if i is None else float(trial_ms[i] - scheduled)
+
+        errors = [
+            error(cue, cue_on), error(off, cue_off), error(target, target_on)
+        ]
+        durations = (done - self.requested[idx]) * 1000.0
+        dropped = np.maximum(0, np.ceil(durations / refresh_ms - 1.1)).sum()
+
+        return {
+            'refresh_ms': refresh_ms,
+            'cue_onset_error': errors[0],
+            'cue_duration': ms(cue, off),
+            'soa': ms(cue, target),
+            'target_onset_error': errors[2],
+            'late_frames': sum(1 for e in errors if e is not None and e > refresh_ms),
+            'dropped_frames': int(dropped)
+        }
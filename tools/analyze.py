@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Computes per-participant and group cueing effects straight from the experiment
+database.
+
+Catch trials and keypress trials where the participant moved their eyes are
+excluded. RTs are keypress RTs in the keypress condition and the RT of the first
+saccade in the saccade condition. Run from the root of the project folder, e.g.:
+
+    python -m tools.analyze ExpAssets/ObjectBasedCueingEffects_2020.db -o effects.cols
+
+Participants are split across a pool of worker processes, each of which reads its
+own participants' trials and aggregates them into cells (session type x box
+alignment x target location) with numpy. Results are written as four tables to a
+columnar file (see tools/columnar.py):
+
+- 'cells': each participant's trial count, hit rate and RT mean & SD per cell
+- 'effects': each participant's cueing effects (in ms) per box alignment
+- 'group_cells' and 'group_effects': the mean, SD and SEM of the above across
+  participants
+- 'errors': each participant's count of each type of recycled trial
+
+Cueing effects are the mean RT at each target location minus the mean RT at the
+baseline location (uncued_opposite by default), plus the object-based effect
+(cued_object minus uncued_adjacent, which are the same distance from the cue).
+
+"""
+
+import sqlite3
+import argparse
+from timeit import default_timer
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from migrations import keypress_rt_column
+from tools.config import load_factors
+from tools.columnar import ColumnWriter
+
+SESSION_TYPES = ['keypress', 'saccade']
+CATCH = 'catch'
+
+
+class Design(object):
+    """The levels of each factor, and the integer codes used to group by them."""
+
+    def __init__(self, baseline):
+        factors = load_factors('keypress')
+        self.alignments = factors['box_alignment']
+        self.locations = [l for l in factors['target_location'] if l != CATCH]
+        if baseline not in self.locations:
+            raise ValueError("Unknown baseline location '{0}'".format(baseline))
+        self.baseline = baseline
+        self.shape = (len(SESSION_TYPES), len(self.alignments), len(self.locations))
+
+    def effects(self):
+        """Returns a list of (name, location, reference) tuples for each effect."""
+        effects = [(l, l, self.baseline) for l in self.locations if l != self.baseline]
+        effects.append(('object_based', 'cued_object', 'uncued_adjacent'))
+        return effects
+
+    def codes(self, values, levels):
+        lookup = dict((v, i) for i, v in enumerate(levels))
+        return np.array([lookup.get(v, -1) for v in values], dtype=np.int64)
+
+
+def load_trials(db, ids):
+    """Returns a participant's included trials as a dict of arrays."""
+    id_list = ", ".join(str(int(i)) for i in ids)
+    keypress_rt = keypress_rt_column(db)
+    trials = db.execute(
+        "SELECT id, participant_id, session_type, box_alignment, target_location, "
+        "{2}, target_acquired "
+        "FROM trials WHERE participant_id IN ({0}) AND target_location != '{1}' "
+        "AND moved_eyes != 'TRUE' ORDER BY id".format(id_list, CATCH, keypress_rt)
+    ).fetchall()
+    if not len(trials):
+        columns = [[] for i in range(7)]
+    else:
+        columns = list(zip(*trials))
+    trial_id = np.array(columns[0], dtype=np.int64)
+
+    # RT of the first saccade on each trial (rows with MIN() take the other
+    # columns from the row with the minimum)
+    first = db.execute(
+        "SELECT trial_id, MIN(id), rt FROM saccades WHERE participant_id IN ({0}) "
+        "GROUP BY trial_id".format(id_list)
+    ).fetchall()
+    saccade_rt = np.full(len(trial_id), np.nan)
+    if len(first):
+        sacc_trial = np.array([r[0] for r in first], dtype=np.int64)
+        pos = np.searchsorted(trial_id, sacc_trial)
+        found = (pos < len(trial_id)) & (trial_id[np.minimum(pos, len(trial_id) - 1)] == sacc_trial)
+        saccade_rt[pos[found]] = np.array([r[2] for r in first], dtype=np.float64)[found]
+
+    session = np.array(columns[2])
+    keypress_rt = np.array([np.nan if v is None else v for v in columns[5]], dtype=np.float64)
+    is_saccade = session == 'saccade'
+    rt = np.where(is_saccade, saccade_rt, keypress_rt)
+    hit = np.where(is_saccade, np.array(columns[6]) == 'TRUE', np.isfinite(keypress_rt))
+    return {
+        'participant_id': np.array(columns[1], dtype=np.int64),
+        'session_type': session,
+        'box_alignment': np.array(columns[3]),
+        'target_location': np.array(columns[4]),
+        'rt': rt,
+        'hit': hit.astype(np.float64)
+    }
+
+
+def cell_grid(ids, trials, design, min_rt, max_rt):
+    """Aggregates trials into a (participant, session, alignment, location) grid of
+    trial counts, hit rates, and RT counts, means & SDs.
+
+    """
+    index = dict((pid, i) for i, pid in enumerate(ids))
+    p = np.array([index[pid] for pid in trials['participant_id']], dtype=np.int64)
+    s = design.codes(trials['session_type'], SESSION_TYPES)
+    a = design.codes(trials['box_alignment'], design.alignments)
+    l = design.codes(trials['target_location'], design.locations)
+    known = (s >= 0) & (a >= 0) & (l >= 0)
+
+    shape = (len(ids),) + design.shape
+    size = int(np.prod(shape))
+    cell = np.ravel_multi_index((p[known], s[known], a[known], l[known]), shape)
+    rt = trials['rt'][known]
+    with np.errstate(invalid='ignore'):
+        valid = np.isfinite(rt) & (rt >= min_rt) & (rt <= max_rt)
+
+    n = np.bincount(cell, minlength=size).astype(np.float64)
+    hits = np.bincount(cell, trials['hit'][known], minlength=size)
+    n_rt = np.bincount(cell[valid], minlength=size).astype(np.float64)
+    total = np.bincount(cell[valid], rt[valid], minlength=size)
+    mean = total / np.where(n_rt > 0, n_rt, np.nan)
+    dev = rt[valid] - mean[cell[valid]]
+    ss = np.bincount(cell[valid], dev * dev, minlength=size)
+    sd = np.sqrt(ss / np.where(n_rt > 1, n_rt - 1, np.nan))
+
+    grid = OrderedDict([
+        ('n_trials', n), ('hit_rate', hits / np.where(n > 0, n, np.nan)),
+        ('n_rt', n_rt), ('mean_rt', mean), ('sd_rt', sd)
+    ])
+    return OrderedDict((k, v.reshape(shape)) for k, v in grid.items())
+
+
+def error_counts(db, ids):
+    id_list = ", ".join(str(int(i)) for i in ids)
+    return db.execute(
+        "SELECT participant_id, session_type, err_type, COUNT(*) FROM trials_err "
+        "WHERE participant_id IN ({0}) GROUP BY 1, 2, 3 ORDER BY 1, 2, 3".format(id_list)
+    ).fetchall()
+
+
+def analyze_participants(job):
+    db_path, ids, baseline, min_rt, max_rt = job
+    db = sqlite3.connect(db_path)
+    try:
+        design = Design(baseline)
+        grid = cell_grid(ids, load_trials(db, ids), design, min_rt, max_rt)
+        errors = error_counts(db, ids)
+    finally:
+        db.close()
+    return ids, grid, errors
+
+
+def group_stats(values, axis=0):
+    """Returns the count, mean, SD and SEM of values across participants, ignoring
+    participants without a value.
+
+    """
+    n = np.isfinite(values).sum(axis=axis).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(values, axis=axis) / np.where(n > 0, n, np.nan)
+        dev = np.where(np.isfinite(values), values - mean, 0.0)
+        sd = np.sqrt((dev * dev).sum(axis=axis) / np.where(n > 1, n - 1, np.nan))
+        sem = sd / np.sqrt(n)
+    return n, mean, sd, sem
+
+
+def flatten(grid, levels, names, keep):
+    """Flattens a dict of equally-shaped arrays into table columns, labelling each
+    row with the factor levels of its position and only keeping rows where keep
+    is True.
+
+    """
+    index = np.nonzero(keep)
+    columns = OrderedDict()
+    for name, values, dim in zip(names, levels, index):
+        columns[name] = np.asarray(values)[dim]
+    for name, values in grid.items():
+        columns[name] = values[index]
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument('database')
+    parser.add_argument('-o', '--output', default="effects.cols")
+    parser.add_argument('--baseline', default='uncued_opposite',
+        help="target location cueing effects are measured relative to")
+    parser.add_argument('--min-rt', type=float, default=0,
+        help="exclude RTs shorter than this (ms)")
+    parser.add_argument('--max-rt', type=float, default=np.inf,
+        help="exclude RTs longer than this (ms)")
+    parser.add_argument('--jobs', type=int, default=cpu_count())
+    args = parser.parse_args()
+
+    start = default_timer()
+    design = Design(args.baseline)
+    db = sqlite3.connect(args.database)
+    ids = [r[0] for r in db.execute("SELECT DISTINCT participant_id FROM trials ORDER BY 1")]
+    db.close()
+    if not len(ids):
+        parser.error("no trials in database '{0}'".format(args.database))
+
+    # Split participants into a few chunks per worker, so work stays balanced
+    n_chunks = min(len(ids), args.jobs * 4)
+    chunks = [list(c) for c in np.array_split(ids, n_chunks)]
+    jobs = [(args.database, c, args.baseline, args.min_rt, args.max_rt) for c in chunks]
+    pool = Pool(max(1, min(args.jobs, len(jobs))))
+    results = pool.map(analyze_participants, jobs)
+    pool.close()
+    pool.join()
+
+    ids = np.concatenate([np.array(r[0], dtype=np.int64) for r in results])
+    grid = OrderedDict(
+        (k, np.concatenate([r[1][k] for r in results])) for k in results[0][1].keys()
+    )
+    has_trials = grid['n_trials'] > 0
+    levels = [ids, SESSION_TYPES, design.alignments, design.locations]
+    names = ['participant_id', 'session_type', 'box_alignment', 'target_location']
+
+    # Cueing effects: (participant, session, alignment, effect)
+    effects = design.effects()
+    mean_rt = grid['mean_rt']
+    loc = dict((l, i) for i, l in enumerate(design.locations))
+    effect_values = np.stack(
+        [mean_rt[..., loc[a]] - mean_rt[..., loc[b]] for name, a, b in effects], axis=-1
+    )
+    effect_names = [e[0] for e in effects]
+    has_effect = np.isfinite(effect_values)
+
+    n, mean, sd, sem = group_stats(mean_rt)
+    group_cells = OrderedDict([
+        ('n_participants', n), ('mean_rt', mean), ('sd_rt', sd), ('sem_rt', sem),
+        ('hit_rate', group_stats(grid['hit_rate'])[1])
+    ])
+    n, mean, sd, sem = group_stats(effect_values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = mean / sem
+    group_effects = OrderedDict([
+        ('n_participants', n), ('mean', mean), ('sd', sd), ('sem', sem), ('t', t)
+    ])
+
+    errors = [row for r in results for row in r[2]]
+    with ColumnWriter(args.output) as out:
+        out.write('cells', flatten(grid, levels, names, has_trials))
+        out.write('effects', flatten(
+            OrderedDict([('effect_ms', effect_values)]), levels[:3] + [effect_names],
+            names[:3] + ['effect'], has_effect
+        ))
+        out.write('group_cells', flatten(
+            group_cells, levels[1:], names[1:], group_cells['n_participants'] > 0
+        ))
+        out.write('group_effects', flatten(
+            group_effects, levels[1:3] + [effect_names], names[1:3] + ['effect'],
+            group_effects['n_participants'] > 0
+        ))
+        out.write('errors', OrderedDict([
+            ('participant_id', np.array([e[0] for e in errors], dtype=np.int64)),
+            ('session_type', np.array([e[1] for e in errors], dtype=np.str_)),
+            ('err_type', np.array([e[2] for e in errors], dtype=np.str_)),
+            ('count', np.array([e[3] for e in errors], dtype=np.int64))
+        ]))
+
+    print("{0} participants analyzed in {1:.2f} s, written to {2}\n".format(
+        len(ids), default_timer() - start, args.output))
+    print("{0:<10} {1:<12} {2:<16} {3:>4} {4:>9} {5:>7}".format(
+        "session", "alignment", "effect", "n", "mean (ms)", "sem"))
+    keep = np.nonzero(group_effects['n_participants'] > 0)
+    for s, a, e in zip(*keep):
+        print("{0:<10} {1:<12} {2:<16} {3:>4.0f} {4:>9.1f} {5:>7.1f}".format(
+            SESSION_TYPES[s], design.alignments[a], effect_names[e],
+            group_effects['n_participants'][s, a, e], group_effects['mean'][s, a, e],
+            group_effects['sem'][s, a, e]
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks of the experiment's per-trial hot paths, run against the
+simulated EyeLink, keyboard, display and event manager from simulation.py (so no
+display or tracker is needed), with the database writer pointed at a temporary
+database.
+
+Reports per-call latency percentiles, the pixel data blitted per call (which
+klibs uploads to the GPU on every blit, so it isn't part of the simulated
+latencies) and, on Python 3, per-call memory allocations. Results can be saved as a baseline and later runs compared against
+it, failing (with exit status 1) if any hot path got slower than the baseline by
+more than the threshold. Baselines are machine-specific, so only compare
+against one saved on the same machine. Run from the root of the project folder,
+e.g.:
+
+    python -m tools.bench_hotpaths --save hotpaths.json
+    python -m tools.bench_hotpaths --compare hotpaths.json --threshold 1.25
+
+"""
+
+import sys
+import json
+import shutil
+import os.path
+import platform
+import argparse
+import tempfile
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2: latencies only
+
+import numpy as np
+
+from simulation import SessionSimulator, SimulatedSaccade, TrialScript
+from timing import FRAME_CUE, FRAME_TARGET
+
+PERCENTILES = [50, 90, 99]
+
+
+class HotPath(object):
+    """A method of the experiment to benchmark.
+
+    Args:
+        name (str): The name to report the hot path under.
+        call (callable): Calls the method once.
+        reset (callable, optional): Puts the experiment back into the state the
+            method expects. Called (untimed) before every call.
+        calls (int, optional): The number of calls to time.
+
+    """
+
+    def __init__(self, name, call, reset=None, calls=2000):
+        self.name = name
+        self.call = call
+        self.reset = reset
+        self.calls = calls
+
+    def run(self, rounds=5, warmup=50):
+        """Returns the time taken by each call in each round (a rounds x calls
+        array), in microseconds.
+
+        """
+        times = np.zeros((rounds, self.calls))
+        for r in range(rounds):
+            for i in range(warmup + self.calls):
+                if self.reset:
+                    self.reset()
+                start = default_timer()
+                self.call()
+                if i >= warmup:
+                    times[r, i - warmup] = default_timer() - start
+        return times * 1e6
+
+    def allocations(self, calls=200):
+        """Returns the median peak memory allocated during a call and the mean memory
+        left allocated after each call (both in bytes), or None for either if it
+        can't be measured.
+
+        """
+        if tracemalloc is None:
+            return None, None
+        peaks, retained = [], 0
+        tracemalloc.start()
+        try:
+            for i in range(calls):
+                if self.reset:
+                    self.reset()
+                before = tracemalloc.get_traced_memory()[0]
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+                self.call()
+                current, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+                retained += current - before
+        finally:
+            tracemalloc.stop()
+        peak = float(np.median(peaks)) if hasattr(tracemalloc, 'reset_peak') else None
+        return peak, retained / float(calls)
+
+
+def hot_paths(sim, session):
+    """Puts a simulated session into the middle of its first trial and returns the
+    hot paths to benchmark.
+
+    """
+    P = sim.P
+    exp, clock = session.experiment, session.clock
+    m = sim.module
+
+    # Start the first trial with a target, with a participant who does nothing
+    block = exp.blocks.blocks[0]
+    exp.blocks.i = 1
+    P.block_number = P.trial_number = 1
+    trial = [t for t in block.trials if t['target_location'] != 'catch'][0]
+    block.i = block.trials.index(trial) + 1
+    for factor, value in trial.items():
+        setattr(exp, factor, value)
+    exp.trial_prep()
+    exp.evm.start_clock()
+    exp.el.begin_trial(TrialScript(), clock.now())
+    exp.flip_timer.begin_trial()
+    exp.timing_trial = True
+
+    def redraw():
+        exp.frames.invalidate()
+        exp.before_target = True
+
+    alignments = sorted(set(f[0] for f in exp.geometry.table.keys()))
+    cycle = {'alignment': 0}
+
+    def next_alignment():
+        cycle['alignment'] = (cycle['alignment'] + 1) % len(alignments)
+        return alignments[cycle['alignment']]
+
+    # A saccade from fixation that lands on the target
+    onset = exp.el.now()
+    saccade = SimulatedSaccade(onset + 200, onset + 240, P.screen_c, exp.target_loc)
+
+    def new_response():
+        exp.saccades = []
+        exp.target_acquired = False
+
+    # A completed trial with 3 saccades and the flips of a normal trial timeline
+    exp.saccades = []
+    for i in range(3):
+        exp.process_saccade(saccade, onset)
+    saccades = list(exp.saccades)
+    trial_row = {
+        'participant_id': P.participant_id, 'block_num': 1, 'trial_num': 1,
+        'session_type': 'saccade' if P.saccade_response_cond else 'keypress',
+        'box_alignment': exp.box_alignment, 'cue_location': exp.cue_location,
+        'target_location': exp.target_location, 'target_acquired': 'TRUE',
+        'keypress_rt': None, 'moved_eyes': 'NA'
+    }
+    timeline = [(0, 0), (m.CUE_ON, FRAME_CUE), (m.CUE_OFF, 0), (m.TARGET_ON, FRAME_TARGET)]
+
+    def completed_trial():
+        P.trial_id = 1
+        exp.trial_row = dict(trial_row)
+        exp.saccades = list(saccades)
+        exp.flip_timer.begin_trial()
+        for trial_ms, content in timeline:
+            exp.flip_timer.start()
+            exp.flip_timer.stop(content, trial_ms)
+
+    return [
+        HotPath("display_refresh (unchanged)", lambda: exp.display_refresh()),
+        HotPath("display_refresh (cue)", lambda: exp.display_refresh(cue=True), redraw),
+        HotPath("display_refresh (target)", lambda: exp.display_refresh(target=True), redraw),
+        HotPath("construct_placeholder", lambda: exp.construct_placeholder(next_alignment()),
+            calls=200),
+        HotPath("construct_cue", lambda: exp.construct_cue(next_alignment()), calls=200),
+        HotPath("wait_time", exp.wait_time, redraw),
+        HotPath("process_saccade", lambda: exp.process_saccade(saccade, onset), new_response),
+        HotPath("trial_clean_up", exp.trial_clean_up, completed_trial),
+    ]
+
+
+def summarize(times, peak, retained):
+    # Each percentile is taken from the round where it was lowest, since slower
+    # rounds mostly measure whatever else the machine was doing at the time
+    percentiles = np.percentile(times, PERCENTILES, axis=1).min(axis=1)
+    result = dict(("p{0}_us".format(p), float(v)) for p, v in zip(PERCENTILES, percentiles))
+    result.update({
+        'max_us': float(times.max()), 'calls': times.size,
+        'peak_bytes': peak, 'retained_bytes': retained
+    })
+    return result
+
+
+def regressions(results, baseline, threshold, min_delta):
+    """Returns (name, stat, baseline, result) for every median or 90th percentile
+    latency that's more than the threshold times (and more than min_delta us
+    above) the baseline.
+
+    """
+    found = []
+    for name, result in results.items():
+        base = baseline['hot_paths'].get(name)
+        if base is None:
+            continue
+        for stat in ('p50_us', 'p90_us'):
+            if result[stat] > base[stat] * threshold and result[stat] - base[stat] > min_delta:
+                found.append((name, stat, base[stat], result[stat]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument('--condition', choices=['saccade', 'keypress'], default='saccade')
+    parser.add_argument('--save', metavar='PATH', help="save the results as a baseline")
+    parser.add_argument('--compare', metavar='PATH', help="compare against a saved baseline")
+    parser.add_argument('--threshold', type=float, default=1.25,
+        help="slowdown (as a ratio of the baseline) counted as a regression")
+    parser.add_argument('--min-delta', type=float, default=2.0,
+        help="slowdowns smaller than this (in us) are never counted as regressions")
+    parser.add_argument('--rounds', type=int, default=5,
+        help="rounds of calls to time for each hot path")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['condition'] != args.condition:
+            parser.error("baseline is for the {0} condition".format(baseline['condition']))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sim = SessionSimulator(os.path.join(tmpdir, "bench.db"), args.condition)
+        session = sim.start_session(seed=1)
+        results = {}
+        print("{0:<30}{1:>10}{2:>10}{3:>10}{4:>10}{5:>12}{6:>12}{7:>12}".format(
+            "hot path", "p50 (us)", "p90 (us)", "p99 (us)", "max (us)", "blit (KB)",
+            "peak (B)", "kept (B)"
+        ))
+        for path in hot_paths(sim, session):
+            blitted = session.display.blitted
+            times = path.run(args.rounds)
+            blitted = (session.display.blitted - blitted) / float(times.size)
+            peak, retained = path.allocations()
+            result = summarize(times, peak, retained)
+            result['blit_kb'] = blitted / 1024.0
+            results[path.name] = result
+            print("{0:<30}{1:>10.1f}{2:>10.1f}{3:>10.1f}{4:>10.1f}{5:>12.1f}{6:>12}{7:>12}".format(
+                path.name, result['p50_us'], result['p90_us'], result['p99_us'],
+                result['max_us'], result['blit_kb'], "n/a" if peak is None else int(peak),
+                "n/a" if retained is None else int(retained)
+            ))
+        session.experiment.clean_up()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'condition': args.condition, 'python': platform.python_version(),
+                'machine': platform.node(), 'hot_paths': results
+            }, f, indent=2, sort_keys=True)
+        print("\nsaved baseline to {0}".format(args.save))
+
+    if baseline is not None:
+        found = regressions(results, baseline, args.threshold, args.min_delta)
+        if not len(found):
+            print("\nno regressions against {0}".format(args.compare))
+            return
+        print("\nregressions against {0} (threshold {1}x):".format(args.compare, args.threshold))
+        for name, stat, base, result in found:
+            print("  {0} {1}: {2:.1f} -> {3:.1f} us ({4:.2f}x)".format(
+                name, stat[:3], base, result, result / base
+            ))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
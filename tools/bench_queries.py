@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of typical export & analysis queries on a synthetic 200-participant
+database, before and after it's upgraded to the current schema (see
+migrations.py).
+
+The 'legacy' database has the original schema (no indexes, text keypress RTs)
+and SQLite's default settings. A copy of it is then upgraded in place with
+migrate() and queried through datastore.connect(), and every query is checked to
+give the same results on both.
+
+Run from the root of the project folder with:
+
+    python -m tools.bench_queries
+
+"""
+
+import os
+import re
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from timeit import default_timer
+
+from datastore import connect, insert_statement
+from migrations import migrate
+from tools.config import SCHEMA_PATH
+
+BLOCKS = 12
+TRIALS_PER_BLOCK = 32
+ALIGNMENTS = ['horizontal', 'vertical']
+CUE_LOCATIONS = ['top_left', 'top_right', 'bottom_left', 'bottom_right']
+TARGET_LOCATIONS = ['cued_location', 'cued_object', 'uncued_adjacent', 'uncued_opposite', 'catch']
+ERR_TYPES = ['eye', 'key', 'early']
+
+KEYPRESS_RT_TEXT = (
+    "CASE WHEN keypress_rt IN ('NA', 'TIMEOUT') THEN NULL ELSE CAST(keypress_rt AS REAL) END"
+)
+
+# (name, per-participant?, legacy query, upgraded query)
+QUERIES = [
+    ("trials by participant", True,
+        "SELECT id, block_num, trial_num, box_alignment, cue_location, target_location, "
+        "target_acquired FROM trials WHERE participant_id = ? ORDER BY block_num, trial_num",
+        None),
+    ("saccades by participant", True,
+        "SELECT * FROM saccades WHERE participant_id = ? ORDER BY id", None),
+    ("trials join saccades", True,
+        "SELECT t.id, t.target_location, s.rt, s.accuracy FROM trials t "
+        "JOIN saccades s ON s.trial_id = t.id WHERE t.participant_id = ? ORDER BY s.id", None),
+    ("first saccade per trial", True,
+        "SELECT trial_id, MIN(id), rt FROM saccades WHERE participant_id = ? "
+        "GROUP BY trial_id ORDER BY trial_id", None),
+    ("errors by type", True,
+        "SELECT session_type, err_type, COUNT(*) FROM trials_err WHERE participant_id = ? "
+        "GROUP BY 1, 2 ORDER BY 1, 2", None),
+    ("mean keypress RT by cell", False,
+        "SELECT participant_id, box_alignment, target_location, "
+        "AVG({0}), COUNT({0}) FROM trials "
+        "WHERE session_type = 'keypress' GROUP BY 1, 2, 3 ORDER BY 1, 2, 3".format(KEYPRESS_RT_TEXT),
+        "SELECT participant_id, box_alignment, target_location, "
+        "AVG(keypress_rt), COUNT(keypress_rt) FROM trials "
+        "WHERE session_type = 'keypress' GROUP BY 1, 2, 3 ORDER BY 1, 2, 3"),
+]
+
+
+def legacy_schema():
+    # The current schema file, as it was before migrations.py existed
+    with open(SCHEMA_PATH) as f:
+        sql = f.read()
+    sql = re.sub(r"CREATE INDEX [^;]*;|PRAGMA [^;]*;", "", sql)
+    return sql.replace("keypress_rt real,", "keypress_rt text not null,")
+
+
+def make_rows(participants, rng):
+    """Returns synthetic rows for the participants, trials, trials_err & saccades
+    tables, interleaved by participant the way sessions would write them.
+
+    """
+    rows = {'participants': [], 'trials': [], 'trials_err': [], 'saccades': []}
+    trial_id = 0
+    for pid in range(1, participants + 1):
+        session = 'saccade' if pid % 2 else 'keypress'
+        rows['participants'].append({
+            'id': pid, 'userhash': "bench-{0}".format(pid), 'gender': 'n', 'age': 20,
+            'handedness': 'r', 'created': 'now'
+        })
+        for block in range(1, BLOCKS + 1):
+            for trial in range(1, TRIALS_PER_BLOCK + 1):
+                factors = {
+                    'session_type': session, 'box_alignment': rng.choice(ALIGNMENTS),
+                    'cue_location': rng.choice(CUE_LOCATIONS),
+                    'target_location': rng.choice(TARGET_LOCATIONS)
+                }
+                while rng.random() < 0.05:
+                    rows['trials_err'].append(dict(
+                        factors, participant_id=pid, block_num=block, trial_num=trial,
+                        err_type=rng.choice(ERR_TYPES), fixation_break_time='NA'
+                    ))
+                trial_id += 1
+                if session == 'keypress':
+                    rt = rng.choice(['TIMEOUT', "{0:.1f}".format(rng.uniform(200, 600))])
+                else:
+                    rt = 'NA'
+                rows['trials'].append(dict(
+                    factors, id=trial_id, participant_id=pid, block_num=block,
+                    trial_num=trial, target_acquired='TRUE', keypress_rt=rt, moved_eyes='NA'
+                ))
+                if session == 'saccade':
+                    for i in range(rng.randint(1, 3)):
+                        rows['saccades'].append({
+                            'participant_id': pid, 'trial_id': trial_id,
+                            'rt': rng.uniform(150, 400), 'accuracy': 'inside',
+                            'dist_from_target': rng.uniform(0, 100),
+                            'start_x': rng.randint(0, 1920), 'start_y': rng.randint(0, 1080),
+                            'end_x': rng.randint(0, 1920), 'end_y': rng.randint(0, 1080),
+                            'duration': rng.uniform(20, 60)
+                        })
+    return rows
+
+
+def make_db(path, rows):
+    db = sqlite3.connect(path)
+    db.executescript(legacy_schema())
+    for table in ['participants', 'trials', 'trials_err', 'saccades']:
+        columns = sorted(rows[table][0].keys())
+        db.executemany(
+            insert_statement(table, columns), [[r[c] for c in columns] for r in rows[table]]
+        )
+    db.commit()
+    db.close()
+
+
+def time_query(db, sql, per_participant, participants, repeats):
+    # Returns the median time (in s) to run the query (for every participant, if
+    # it's per-participant) and the rows it returned
+    times = []
+    for i in range(repeats):
+        result = []
+        start = default_timer()
+        if per_participant:
+            for pid in range(1, participants + 1):
+                result.extend(db.execute(sql, (pid,)).fetchall())
+        else:
+            result = db.execute(sql).fetchall()
+        times.append(default_timer() - start)
+    return sorted(times)[len(times) // 2], result
+
+
+def same_rows(a, b):
+    if len(a) != len(b):
+        return False
+    for row_a, row_b in zip(a, b):
+        for x, y in zip(row_a, row_b):
+            if isinstance(x, float) or isinstance(y, float):
+                if x is None or y is None or abs(x - y) > 1e-6:
+                    return False
+            elif x != y:
+                return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument('--participants', type=int, default=200)
+    parser.add_argument('--repeats', type=int, default=5,
+        help="times to run each query (the median time is reported)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        legacy_path = os.path.join(tmpdir, "legacy.db")
+        upgraded_path = os.path.join(tmpdir, "upgraded.db")
+        rows = make_rows(args.participants, random.Random(args.seed))
+        make_db(legacy_path, rows)
+        shutil.copy(legacy_path, upgraded_path)
+        print("{0} participants: {1} trials, {2} saccades, {3} errors".format(
+            args.participants, len(rows['trials']), len(rows['saccades']),
+            len(rows['trials_err'])
+        ))
+
+        start = default_timer()
+        old, new = migrate(upgraded_path, SCHEMA_PATH)
+        print("upgraded schema version {0} -> {1} in {2:.0f} ms ({3:.1f} -> {4:.1f} MB)\n".format(
+            old, new, (default_timer() - start) * 1000,
+            os.path.getsize(legacy_path) / 1e6, os.path.getsize(upgraded_path) / 1e6
+        ))
+
+        legacy = sqlite3.connect(legacy_path)
+        upgraded = connect(upgraded_path)
+        print("{0:<26}{1:>14}{2:>14}{3:>10}".format(
+            "query", "legacy (ms)", "upgraded (ms)", "speedup"
+        ))
+        for name, per_participant, sql, upgraded_sql in QUERIES:
+            t_old, r_old = time_query(legacy, sql, per_participant, args.participants, args.repeats)
+            t_new, r_new = time_query(
+                upgraded, upgraded_sql or sql, per_participant, args.participants, args.repeats
+            )
+            if not same_rows(r_old, r_new):
+                raise RuntimeError("'{0}' gave different results after upgrading".format(name))
+            print("{0:<26}{1:>14.1f}{2:>14.1f}{3:>9.1f}x".format(
+                name, t_old * 1000, t_new * 1000, t_old / max(t_new, 1e-9)
+            ))
+        legacy.close()
+        upgraded.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
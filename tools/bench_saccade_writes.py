@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark comparing the time the presentation thread spends writing each
+trial's data to the database: the old per-trial writes in trial_clean_up() (one
+commit for the trial row and one per saccade) against queueing the trial and its
+saccades on the AsyncWriter, with and without deferred commits. Runs over a
+simulated 12-block x 32-trial saccade session (3 saccades per trial, the most
+record_saccades() keeps).
+
+Run from the root of the project folder with:
+
+    python -m tools.bench_saccade_writes
+
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+from timeit import default_timer
+
+from datastore import AsyncWriter, insert_statement, SACCADE_COLUMNS
+
+SCHEMA = os.path.join("ExpAssets", "Config", "ObjectBasedCueingEffects_2020_schema.sql")
+
+BLOCKS = 12
+TRIALS_PER_BLOCK = 32
+SACCADES_PER_TRIAL = 3
+
+TRIAL_INSERT = (
+    "INSERT INTO trials (participant_id, block_num, trial_num, session_type, "
+    "box_alignment, cue_location, target_location, target_acquired, keypress_rt, "
+    "moved_eyes) VALUES (1, ?, ?, 'saccade', 'vertical', 'top_left', "
+    "'cued_object', 'TRUE', NULL, 'NA')"
+)
+
+
+def make_db(path):
+    db = sqlite3.connect(path)
+    with open(SCHEMA) as f:
+        db.executescript(f.read())
+    db.execute(
+        "INSERT INTO participants (userhash, gender, age, handedness, created) "
+        "VALUES ('bench', 'n', 1, 'a', 'now')"
+    )
+    db.commit()
+    db.close()
+
+
+def make_saccades(rng):
+    saccades = []
+    for i in range(SACCADES_PER_TRIAL):
+        saccades.append({
+            "rt": rng.uniform(150, 400), "accuracy": "inside",
+            "dist_from_target": rng.uniform(0, 100),
+            "start_x": rng.randint(0, 1920), "start_y": rng.randint(0, 1080),
+            "end_x": rng.randint(0, 1920), "end_y": rng.randint(0, 1080),
+            "duration": rng.uniform(20, 60)
+        })
+    return saccades
+
+
+class LegacyWrites(object):
+    # The trial row written by klibs (one insert + commit), then one last_id_from()
+    # query, one insert and one commit per saccade
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.insert = insert_statement('saccades', SACCADE_COLUMNS)
+
+    def write_trial(self, block, trial, saccades):
+        self.db.execute(TRIAL_INSERT, (block, trial))
+        self.db.commit()
+        for s in saccades:
+            trial_id = self.db.execute("SELECT max(id) FROM trials").fetchone()[0]
+            s = dict(s, trial_id=trial_id, participant_id=1)
+            self.db.execute(self.insert, [s[c] for c in SACCADE_COLUMNS])
+            self.db.commit()
+
+    def end_block(self):
+        pass
+
+    def close(self):
+        self.db.close()
+
+
+class QueuedWrites(object):
+    # The trial row and its saccades queued on the background writer together
+
+    def __init__(self, path, defer_commits):
+        self.writer = AsyncWriter(path, defer_commits=defer_commits)
+
+    def write_trial(self, block, trial, saccades):
+        row = {
+            'participant_id': 1, 'block_num': block, 'trial_num': trial,
+            'session_type': 'saccade', 'box_alignment': 'vertical',
+            'cue_location': 'top_left', 'target_location': 'cued_object',
+            'target_acquired': 'TRUE', 'keypress_rt': None, 'moved_eyes': 'NA'
+        }
+        children = [('saccades', dict(s, participant_id=1)) for s in saccades]
+        self.writer.put_trial(row, children)
+
+    def end_block(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+
+def run(label, tmpdir, make_writer):
+    # Returns the time taken on the presentation thread by each trial (with each
+    # block's end-of-block flush added to its last trial) and the rows written
+    rng = random.Random(1)
+    path = os.path.join(tmpdir, label + ".db")
+    make_db(path)
+    writer = make_writer(path)
+    times = []
+    for block in range(1, BLOCKS + 1):
+        for trial in range(1, TRIALS_PER_BLOCK + 1):
+            saccades = make_saccades(rng)
+            start = default_timer()
+            writer.write_trial(block, trial, saccades)
+            times.append(default_timer() - start)
+        start = default_timer()
+        writer.end_block()
+        times[-1] += default_timer() - start
+    writer.close()
+    db = sqlite3.connect(path)
+    rows = db.execute("SELECT count(*) FROM saccades").fetchone()[0]
+    db.close()
+    return times, rows
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        results = [
+            ("legacy", run("legacy", tmpdir, LegacyWrites)),
+            ("queued", run("queued", tmpdir, lambda path: QueuedWrites(path, False))),
+            ("deferred", run("deferred", tmpdir, lambda path: QueuedWrites(path, True))),
+        ]
+        print("{0:<10}{1:>8}{2:>14}{3:>14}{4:>14}".format(
+            "path", "rows", "total (ms)", "mean (ms)", "max (ms)"
+        ))
+        for label, (times, rows) in results:
+            print("{0:<10}{1:>8}{2:>14.2f}{3:>14.3f}{4:>14.3f}".format(
+                label, rows, sum(times) * 1000, sum(times) * 1000 / len(times),
+                max(times) * 1000
+            ))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+A minimal compressed columnar file format for analysis output, needing nothing
+but numpy.
+
+A file is a zip archive holding one or more named tables. Each column of a table
+is stored as a series of .npy chunks ('<table>/<column>/<chunk>.npy'), so tables
+can be written a chunk at a time in bounded memory and individual columns can be
+read without touching the rest of the file. A 'schema.json' member lists the
+tables, their columns in order, and each column's dtype.
+
+"""
+
+import io
+import json
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+SCHEMA_NAME = "schema.json"
+
+
+def _member(table, column, chunk):
+    return "{0}/{1}/{2:05d}.npy".format(table, column, chunk)
+
+
+class ColumnWriter(object):
+    """Writes tables to a columnar file, one chunk of rows at a time.
+
+    Args:
+        path (str): The path of the file to write.
+        compress (bool, optional): Whether to deflate each chunk.
+
+    """
+
+    def __init__(self, path, compress=True):
+        self.path = path
+        mode = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self.zip = zipfile.ZipFile(path, 'w', mode, allowZip64=True)
+        self.schema = OrderedDict()
+
+    def write(self, table, columns):
+        """Appends a chunk of rows to a table.
+
+        Args:
+            table (str): The name of the table.
+            columns (dict): A {column: array} dict of equal-length arrays. The
+                first chunk written to a table sets its columns & their order
+                (pass an OrderedDict to control it) and dtypes.
+
+        """
+        columns = OrderedDict((k, np.asarray(v)) for k, v in columns.items())
+        lengths = set(len(v) for v in columns.values())
+        if len(lengths) > 1:
+            raise ValueError("Columns of table '{0}' differ in length".format(table))
+
+        if table not in self.schema:
+            self.schema[table] = {
+                'columns': list(columns.keys()),
+                'dtypes': [v.dtype.str for v in columns.values()],
+                'chunks': 0,
+                'rows': 0
+            }
+        info = self.schema[table]
+        if list(columns.keys()) != info['columns']:
+            raise ValueError("Columns of table '{0}' don't match its schema".format(table))
+
+        for name, dtype in zip(info['columns'], info['dtypes']):
+            values = columns[name]
+            if np.dtype(dtype).kind in 'SU':
+                # String widths can vary from chunk to chunk
+                values = values.astype(np.dtype(dtype).kind)
+            else:
+                values = values.astype(dtype, copy=False)
+            buf = io.BytesIO()
+            np.lib.format.write_array(buf, values, allow_pickle=False)
+            self.zip.writestr(_member(table, name, info['chunks']), buf.getvalue())
+        info['chunks'] += 1
+        info['rows'] += lengths.pop() if len(lengths) else 0
+
+    def close(self):
+        self.zip.writestr(SCHEMA_NAME, json.dumps(self.schema, indent=2))
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ColumnReader(object):
+    """Reads tables (or selected columns of them) from a columnar file.
+
+    Args:
+        path (str): The path of the file to read.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path, 'r')
+        self.schema = json.loads(
+            self.zip.read(SCHEMA_NAME).decode('utf-8'), object_pairs_hook=OrderedDict
+        )
+
+    @property
+    def tables(self):
+        return list(self.schema.keys())
+
+    def columns(self, table):
+        return list(self.schema[table]['columns'])
+
+    def chunks(self, table, columns=None):
+        """Yields each chunk of a table as an OrderedDict of {column: array}."""
+        info = self.schema[table]
+        columns = columns or info['columns']
+        for chunk in range(info['chunks']):
+            yield OrderedDict(
+                (name, self._load(_member(table, name, chunk))) for name in columns
+            )
+
+    def read(self, table, columns=None):
+        """Returns a whole table (or only the given columns of it) as an OrderedDict
+        of {column: array}.
+
+        """
+        columns = columns or self.columns(table)
+        parts = OrderedDict((name, []) for name in columns)
+        for chunk in self.chunks(table, columns):
+            for name, values in chunk.items():
+                parts[name].append(values)
+        return OrderedDict(
+            (name, np.concatenate(v) if len(v) else np.zeros(0)) for name, v in parts.items()
+        )
+
+    def _load(self, member):
+        return np.lib.format.read_array(io.BytesIO(self.zip.read(member)), allow_pickle=False)
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
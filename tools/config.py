@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Reads the project's params and independent variables files for offline tools.
+
+Both files import klibs (and refer to P.condition), so they can't simply be
+imported without a klibs runtime. Instead, their import statements are stripped
+from the parsed source and the rest is run against minimal stand-ins for klibs'
+P object and IndependentVariableSet.
+
+"""
+
+import os
+import ast
+from collections import OrderedDict
+
+from geometry import factor_levels
+
+PROJECT_NAME = "ObjectBasedCueingEffects_2020"
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(PROJECT_DIR, "ExpAssets", "Config")
+
+PARAMS_PATH = os.path.join(CONFIG_DIR, PROJECT_NAME + "_params.py")
+IND_VARS_PATH = os.path.join(CONFIG_DIR, PROJECT_NAME + "_independent_variables.py")
+SCHEMA_PATH = os.path.join(CONFIG_DIR, PROJECT_NAME + "_schema.sql")
+
+
+class _Params(object):
+    # Stand-in for klibs.P: only what the config files read from it
+
+    def __init__(self, condition):
+        self.condition = condition
+
+
+class _Variable(object):
+
+    def __init__(self, name, d_type, values=[]):
+        self.name = name
+        self.d_type = d_type
+        self.values = list(values)
+
+    def add_value(self, value, *args, **kwargs):
+        self.values.append(value)
+
+    def add_values(self, *values):
+        for value in values:
+            self.add_value(value)
+
+
+class _VariableSet(object):
+    # Stand-in for klibs' IndependentVariableSet
+
+    def __init__(self):
+        self.variables = OrderedDict()
+
+    def add_variable(self, name, d_type, values=[]):
+        self.variables[name] = _Variable(name, d_type, values)
+
+    def __getitem__(self, name):
+        return self.variables[name]
+
+    @property
+    def names(self):
+        return list(self.variables.keys())
+
+
+def _run_config(path, namespace):
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    tree.body = [n for n in tree.body if not isinstance(n, (ast.Import, ast.ImportFrom))]
+    exec(compile(tree, path, 'exec'), namespace)
+    return namespace
+
+
+def load_params(condition=None):
+    """Returns a {name: value} dict of the project's params for a given condition."""
+    namespace = _run_config(PARAMS_PATH, {'P': _Params(condition)})
+    return dict(
+        (k, v) for k, v in namespace.items() if not k.startswith('_') and k != 'P'
+    )
+
+
+def load_factors(condition=None):
+    """Returns an ordered {factor: [levels]} dict of the project's independent
+    variables for a given condition.
+
+    """
+    namespace = _run_config(IND_VARS_PATH, {
+        'P': _Params(condition), 'IndependentVariableSet': _VariableSet
+    })
+    ind_vars = namespace[PROJECT_NAME + "_ind_vars"]
+    levels = factor_levels(ind_vars, ind_vars.names)
+    return OrderedDict((name, levels[name]) for name in ind_vars.names)
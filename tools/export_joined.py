@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Exports every trial and saccade in the experiment database, joined with the
+trial's factors and the number of trials recycled in its block, to a single
+compressed columnar file (see tools/columnar.py).
+
+Unlike 'klibs export', which writes separate text files for each table and
+participant, everything is written to one file with typed columns: ids and
+counts are integers, RTs, distances & saccade coordinates are floats (NaN where
+there's no value, e.g. keypress RTs on trials without a response), and the
+rest are strings. Run from the root of the project folder, e.g.:
+
+    python -m tools.export_joined ExpAssets/ObjectBasedCueingEffects_2020.db -o joined.cols
+
+The file has two tables:
+
+- 'trials': one row per completed trial, with its number of saccades
+- 'saccades': one row per saccade, with its trial's factors and its position
+  among the trial's saccades ('saccade_num', starting at 1)
+
+Both have a 'block_errors' column with the number of trials recycled in the
+trial's block, and a 'block_errors_<type>' column for each type of error. Rows
+are read from the database and written to the file in chunks of a fixed number
+of rows, so memory use doesn't grow with the size of the database, and the
+export reads a single snapshot of the database, so it can safely be run while a
+session is writing to it. Tables can be read whole or by column with
+tools.columnar.ColumnReader.
+
+"""
+
+import os
+import sqlite3
+import argparse
+from timeit import default_timer
+from collections import OrderedDict
+
+import numpy as np
+
+from migrations import keypress_rt_column
+from tools.columnar import ColumnWriter
+
+INT = 'i8'
+FLOAT = 'f8'
+STR = 'U'
+
+FACTORS = [
+    ('session_type', STR), ('box_alignment', STR), ('cue_location', STR),
+    ('target_location', STR)
+]
+
+TRIAL_COLUMNS = [
+    ('trial_id', INT), ('participant_id', INT), ('block_num', INT), ('trial_num', INT)
+] + FACTORS + [
+    ('target_acquired', STR), ('keypress_rt', FLOAT), ('moved_eyes', STR),
+    ('n_saccades', INT)
+]
+
+SACCADE_COLUMNS = [
+    ('saccade_id', INT), ('trial_id', INT), ('participant_id', INT), ('block_num', INT),
+    ('trial_num', INT)
+] + FACTORS + [
+    ('saccade_num', INT), ('rt', FLOAT), ('accuracy', STR), ('dist_from_target', FLOAT),
+    ('start_x', FLOAT), ('start_y', FLOAT), ('end_x', FLOAT), ('end_y', FLOAT),
+    ('duration', FLOAT)
+]
+
+# Error types recorded by the experiment, which always get a column (along with
+# any others found in the database)
+ERR_TYPES = ['early', 'eye', 'key']
+
+
+def block_errors(db):
+    """Returns the columns for the number of trials recycled in each block (in
+    total and of each type), and the SQL to add them to rows of
+    the trials table (as 't'): a join, the values to select, and their params.
+
+    """
+    found = [row[0] for row in db.execute("SELECT DISTINCT err_type FROM trials_err")]
+    err_types = sorted(set(ERR_TYPES) | set(found))
+    columns = [('block_errors', INT)]
+    counts, values, params = ["COUNT(*) AS n"], ["COALESCE(e.n, 0)"], {}
+    for i, err_type in enumerate(err_types):
+        columns.append(("block_errors_{0}".format(err_type), INT))
+        counts.append("SUM(err_type = :err{0}) AS n{0}".format(i))
+        values.append("COALESCE(e.n{0}, 0)".format(i))
+        params["err{0}".format(i)] = err_type
+    join = (
+        "LEFT JOIN (SELECT participant_id, block_num, {0} FROM trials_err GROUP BY 1, 2) e "
+        "ON e.participant_id = t.participant_id AND e.block_num = t.block_num".format(
+            ", ".join(counts))
+    )
+    return columns, join, values, params
+
+
+def chunks(cursor, size):
+    """Yields the rows of a query in lists of up to the given size (and always at
+    least one list, so empty tables are still written).
+
+    """
+    rows = cursor.fetchmany(size)
+    yield rows
+    while len(rows):
+        rows = cursor.fetchmany(size)
+        if len(rows):
+            yield rows
+
+
+def to_columns(rows, spec):
+    """Converts a chunk of rows to an OrderedDict of typed arrays."""
+    values = list(zip(*rows)) if len(rows) else [[] for c in spec]
+    columns = OrderedDict()
+    for (name, dtype), column in zip(spec, values):
+        if dtype == FLOAT:
+            column = [np.nan if v is None else v for v in column]
+        columns[name] = np.array(column, dtype=dtype)
+    return columns
+
+
+def write_table(writer, table, spec, row_chunks):
+    # Returns the number of rows written
+    n = 0
+    for rows in row_chunks:
+        writer.write(table, to_columns(rows, spec))
+        n += len(rows)
+    return n
+
+
+def number_saccades(row_chunks, trial, num):
+    """Fills in each saccade's position among its trial's saccades (given rows
+    ordered by trial), carrying the count over from one chunk to the next.
+
+    """
+    last_trial, n = None, 0
+    for rows in row_chunks:
+        for i, row in enumerate(rows):
+            if row[trial] != last_trial:
+                last_trial, n = row[trial], 0
+            n += 1
+            rows[i] = row[:num] + (n,) + row[num + 1:]
+        yield rows
+
+
+def export_trials(db, writer, errors, chunk_size):
+    columns, join, values, params = errors
+    cursor = db.execute(
+        "SELECT t.id, t.participant_id, t.block_num, t.trial_num, t.session_type, "
+        "t.box_alignment, t.cue_location, t.target_location, t.target_acquired, {0}, "
+        "t.moved_eyes, COALESCE(sc.n, 0), {1} FROM trials t "
+        "LEFT JOIN (SELECT trial_id, COUNT(*) AS n FROM saccades GROUP BY 1) sc "
+        "ON sc.trial_id = t.id {2} ORDER BY t.id".format(
+            keypress_rt_column(db, 't'), ", ".join(values), join
+        ), params
+    )
+    return write_table(writer, 'trials', TRIAL_COLUMNS + columns, chunks(cursor, chunk_size))
+
+
+def export_saccades(db, writer, errors, chunk_size):
+    columns, join, values, params = errors
+    spec = SACCADE_COLUMNS + columns
+    cursor = db.execute(
+        "SELECT s.id, s.trial_id, t.participant_id, t.block_num, t.trial_num, "
+        "t.session_type, t.box_alignment, t.cue_location, t.target_location, 0, s.rt, "
+        "s.accuracy, s.dist_from_target, s.start_x, s.start_y, s.end_x, s.end_y, "
+        "s.duration, {0} FROM saccades s JOIN trials t ON t.id = s.trial_id {1} "
+        "ORDER BY s.trial_id, s.id".format(", ".join(values), join), params
+    )
+    names = [name for name, dtype in spec]
+    row_chunks = number_saccades(
+        chunks(cursor, chunk_size), names.index('trial_id'), names.index('saccade_num')
+    )
+    return write_table(writer, 'saccades', spec, row_chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument('database')
+    parser.add_argument('-o', '--output', default="joined.cols")
+    parser.add_argument('--chunk-size', type=int, default=20000,
+        help="rows read from the database and written to the file at a time")
+    args = parser.parse_args()
+
+    start = default_timer()
+    db = sqlite3.connect(args.database)
+    db.isolation_level = None
+    db.execute("BEGIN")  # so both tables are read from the same snapshot
+    try:
+        errors = block_errors(db)
+        with ColumnWriter(args.output) as writer:
+            n_trials = export_trials(db, writer, errors, args.chunk_size)
+            n_saccades = export_saccades(db, writer, errors, args.chunk_size)
+    finally:
+        db.execute("COMMIT")
+        db.close()
+
+    print("exported {0} trials and {1} saccades to {2} ({3:.1f} MB) in {4:.1f} s".format(
+        n_trials, n_saccades, args.output, os.path.getsize(args.output) / 1e6,
+        default_timer() - start
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Merges the databases of any number of testing stations into one master database,
+keeping every row's links to its participant and trial intact.
+
+Ids are remapped as rows are imported: each imported participant, trial, error
+and saccade (and every other table's rows) gets a new id in the master database,
+and 'participant_id' & 'trial_id' columns are pointed at the new ids. Participants
+with a userhash already in the master database (e.g. a session resumed on another
+station) are merged into the existing participant. Each imported row is recorded
+in the master's 'merge_map' table, so merging the same station again later only
+imports rows added since the last merge.
+
+Stations are merged with set-based queries on attached databases, several
+stations per transaction (as many as SQLite allows to be attached at once), so
+an interrupted merge leaves the master database either with or without each
+station's new rows, never partway. Run from the root of the project folder, e.g.:
+
+    python -m tools.merge_db master.db room1=/Volumes/room1/ObjectBasedCueingEffects_2020.db ...
+
+Each station can be given a name (as 'name=path') that identifies it across
+merges. Otherwise, it's identified by a hash of its first participant, so the
+same station is recognized even if its database is moved.
+
+Station databases are never modified: they're attached read-only (or, under
+Python 2, which can't open databases read-only, a temporary copy is attached),
+and ones made with older versions of the schema are read as they are, with
+columns added since then left at their defaults and keypress RTs converted to
+numbers as they're imported (see migrations.py).
+
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+from timeit import default_timer
+try:
+    from urllib.request import pathname2url
+except ImportError:  # Python 2
+    from urllib import pathname2url
+
+from datastore import connect
+from migrations import ADDED_COLUMNS, keypress_rt_column, migrate, schema_version
+from tools.config import SCHEMA_PATH
+
+# Stations attached (and merged in one transaction) at once: SQLite's default
+# limit on attached databases is 10
+STATIONS_PER_BATCH = 8
+
+# Whether stations can be attached read-only, which needs the master connection
+# to accept URI filenames (Python 3's sqlite3 only)
+READ_ONLY_ATTACH = sys.version_info[0] >= 3
+
+# Columns that refer to rows of other tables, and the tables they refer to
+FOREIGN_KEYS = {'participant_id': 'participants', 'trial_id': 'trials'}
+
+MERGE_MAP = """
+CREATE TABLE IF NOT EXISTS merge_map (
+	station text not null,
+	source_table text not null,
+	source_id integer not null,
+	master_id integer not null,
+	primary key (station, source_table, source_id)
+)
+"""
+
+
+def open_master(path):
+    """Opens the master database, creating it from the project schema if needed."""
+    if not os.path.exists(path):
+        db = sqlite3.connect(path)
+        with open(SCHEMA_PATH) as f:
+            db.executescript(f.read())
+        db.close()
+    migrate(path, SCHEMA_PATH)
+    db = connect(path, uri=READ_ONLY_ATTACH)
+    db.isolation_level = None  # transactions are managed explicitly
+    db.execute(MERGE_MAP)
+    return db
+
+
+def read_only_uri(path):
+    return "file:{0}?mode=ro".format(pathname2url(os.path.abspath(path)))
+
+
+def station_name(db, alias):
+    # Identifies an attached station by its first participant, which never changes
+    first = db.execute(
+        "SELECT userhash, created FROM {0}.participants ORDER BY id LIMIT 1".format(alias)
+    ).fetchone()
+    if first is None:
+        return None
+    return hashlib.sha1(u"{0}|{1}".format(*first).encode('utf-8')).hexdigest()[:12]
+
+
+def _columns(db, schema, table):
+    return [row[1] for row in db.execute("PRAGMA {0}.table_info({1})".format(schema, table))]
+
+
+def merge_order(db):
+    """Returns the master's tables in the order they need merging (parents first)."""
+    tables = [row[0] for row in db.execute(
+        "SELECT name FROM main.sqlite_master WHERE type = 'table' AND name NOT IN "
+        "('sqlite_sequence', 'merge_map') ORDER BY name"
+    )]
+    parents = [t for t in ['participants', 'trials'] if t in tables]
+    return parents + [t for t in tables if t not in parents and 'id' in _columns(db, 'main', t)]
+
+
+def merge_table(db, alias, station, table):
+    """Imports a table's new rows from an attached station database, returning the
+    number imported and the number skipped (rows whose participant or trial is
+    missing from the station).
+
+    """
+    # Columns added to the schema since a station's database was made get the values
+    # the migration would have given them
+    station_columns = _columns(db, alias, table)
+    defaults = dict((c, d) for t, c, datatype, d in ADDED_COLUMNS if t == table)
+    columns = [
+        c for c in _columns(db, 'main', table) if c in station_columns or c in defaults
+    ]
+    data_columns = [c for c in columns if c != 'id']
+    new = (
+        "s.id NOT IN (SELECT source_id FROM merge_map WHERE station = :station "
+        "AND source_table = :table)"
+    )
+    params = {'station': station, 'table': table}
+
+    if table == 'participants':
+        # Participants whose userhash is already in the master are merged into it
+        db.execute(
+            "INSERT INTO merge_map (station, source_table, source_id, master_id) "
+            "SELECT :station, :table, s.id, MIN(m.id) FROM {0}.participants s "
+            "JOIN main.participants m ON m.userhash = s.userhash WHERE {1} "
+            "GROUP BY s.id".format(alias, new), params
+        )
+
+    # Number the new rows in order, so each one's id in the master is the master's
+    # highest id so far plus its number (with joins on the maps for its parents,
+    # which also leaves out any rows whose parents are missing)
+    joins, values = [], []
+    for c in data_columns:
+        if c in FOREIGN_KEYS:
+            joins.append(
+                "JOIN merge_map map_{0} ON map_{0}.station = :station AND "
+                "map_{0}.source_table = '{1}' AND map_{0}.source_id = s.{0}".format(
+                    c, FOREIGN_KEYS[c])
+            )
+            values.append("map_{0}.master_id".format(c))
+        elif c not in station_columns:
+            values.append(defaults[c])
+        elif table == 'trials' and c == 'keypress_rt':
+            # Text in stations made before RTs were stored as numbers
+            values.append(keypress_rt_column(db, 's', alias))
+        else:
+            values.append("s.{0}".format(c))
+    db.execute("DROP TABLE IF EXISTS temp.pending")
+    db.execute("CREATE TEMP TABLE pending (seq integer primary key, source_id integer)")
+    db.execute(
+        "INSERT INTO temp.pending (source_id) SELECT s.id FROM {0}.{1} s {2} "
+        "WHERE {3} ORDER BY s.id".format(alias, table, " ".join(joins), new), params
+    )
+    base = db.execute(
+        "SELECT MAX(COALESCE((SELECT MAX(id) FROM main.{0}), 0), "
+        "COALESCE((SELECT seq FROM main.sqlite_sequence WHERE name = :table), 0))".format(table),
+        params
+    ).fetchone()[0]
+    params['base'] = base
+
+    db.execute(
+        "INSERT INTO main.{0} (id, {1}) SELECT :base + p.seq, {2} FROM temp.pending p "
+        "JOIN {3}.{0} s ON s.id = p.source_id {4} ORDER BY p.seq".format(
+            table, ", ".join(data_columns), ", ".join(values), alias, " ".join(joins)
+        ), params
+    )
+    db.execute(
+        "INSERT INTO merge_map (station, source_table, source_id, master_id) "
+        "SELECT :station, :table, source_id, :base + seq FROM temp.pending", params
+    )
+    imported = db.execute("SELECT COUNT(*) FROM temp.pending").fetchone()[0]
+    skipped = db.execute(
+        "SELECT COUNT(*) FROM {0}.{1} s WHERE {2}".format(alias, table, new), params
+    ).fetchone()[0]
+    db.execute("DROP TABLE temp.pending")
+    return imported, skipped
+
+
+def attach_stations(db, stations, tmpdir):
+    # Attaches each (name, path) station (read-only, or a copy of it under Python 2)
+    # and returns their aliases, detaching any already attached if one fails
+    aliases = []
+    try:
+        for i, (name, path) in enumerate(stations):
+            alias = "station{0}".format(i)
+            if READ_ONLY_ATTACH:
+                target = read_only_uri(path)
+            else:
+                # Copy the write-ahead log too, since it may hold the latest trials
+                target = os.path.join(tmpdir, "{0}.db".format(alias))
+                shutil.copyfile(path, target)
+                if os.path.exists(path + "-wal"):
+                    shutil.copyfile(path + "-wal", target + "-wal")
+            db.execute("ATTACH DATABASE ? AS {0}".format(alias), (target,))
+            aliases.append(alias)
+    except Exception:
+        detach_stations(db, aliases)
+        raise
+    return aliases
+
+
+def detach_stations(db, aliases):
+    for alias in aliases:
+        db.execute("DETACH DATABASE {0}".format(alias))
+
+
+def merge_batch(db, stations):
+    """Merges a batch of (name, path) stations into the master database in a
+    single transaction, naming any unnamed stations by their first participant.
+
+    Returns:
+        list: The (name, {table: (imported, skipped)}) of each station, in order,
+        with a name of None for stations without any participants (which are
+        skipped).
+
+    """
+    tmpdir = None if READ_ONLY_ATTACH else tempfile.mkdtemp()
+    try:
+        aliases = attach_stations(db, stations, tmpdir)
+        try:
+            return _merge_attached(db, stations, aliases)
+        finally:
+            detach_stations(db, aliases)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+
+def _merge_attached(db, stations, aliases):
+    merged = []
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        tables = merge_order(db)
+        for (name, path), alias in zip(stations, aliases):
+            name = name or station_name(db, alias)
+            if name is None:
+                merged.append((None, {}))
+                continue
+            merged.append((name, dict(
+                (table, merge_table(db, alias, name, table)) for table in tables
+                if len(_columns(db, alias, table))
+            )))
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument('master', help="the database to merge into (created if missing)")
+    parser.add_argument('stations', nargs='+', metavar='[name=]station',
+        help="station databases to merge, optionally named")
+    args = parser.parse_args()
+
+    start = default_timer()
+    stations = []
+    for arg in args.stations:
+        name, path = arg.split('=', 1) if '=' in arg else (None, arg)
+        if not os.path.isfile(path):
+            parser.error("no such database: {0}".format(path))
+        if os.path.abspath(path) == os.path.abspath(args.master):
+            parser.error("can't merge the master database into itself")
+        stations.append((name, path))
+    db = open_master(args.master)
+    version = schema_version(db)
+
+    totals, n_merged = {}, 0
+    for i in range(0, len(stations), STATIONS_PER_BATCH):
+        batch = stations[i:i + STATIONS_PER_BATCH]
+        merged = merge_batch(db, batch)
+        for (given, path), (name, counts) in zip(batch, merged):
+            if name is None:
+                print("{0}: no participants, skipping".format(path))
+                continue
+            n_merged += 1
+            imported = ", ".join(
+                "{0} {1}".format(n, t) for t, (n, s) in sorted(counts.items()) if n
+            )
+            print("{0} ({1}): {2}".format(path, name, imported or "nothing new"))
+            for table, (n, skipped) in sorted(counts.items()):
+                if skipped:
+                    print("  skipped {0} {1} rows with no matching participant/trial".format(
+                        skipped, table))
+                totals[table] = totals.get(table, 0) + n
+    db.close()
+
+    print("merged {0} stations into {1} (schema version {2}) in {3:.2f} s: {4}".format(
+        n_merged, args.master, version, default_timer() - start,
+        ", ".join("{0} {1}".format(n, t) for t, n in sorted(totals.items()) if n) or "nothing new"
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Upgrades experiment databases made with older versions of the project schema to
+the current one, in place and without losing any data (see migrations.py).
+
+The experiment does this itself when launched, so this is only needed to bring
+older databases up to date for the analysis tools. Run from the root of the
+project folder, e.g.:
+
+    python -m tools.migrate_db ExpAssets/ObjectBasedCueingEffects_2020.db
+
+"""
+
+import argparse
+
+from migrations import migrate
+from tools.config import SCHEMA_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument('databases', nargs='+')
+    args = parser.parse_args()
+
+    for path in args.databases:
+        old, new = migrate(path, SCHEMA_PATH)
+        if old == new:
+            print("{0}: already at schema version {1}".format(path, new))
+        else:
+            print("{0}: upgraded from schema version {1} to {2}".format(path, old, new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo estimates of the statistical power of the experiment's design, for
+choosing the number of trials per block, blocks and participants (and the
+proportion of catch trials).
+
+Each simulated study is a whole synthetic dataset: every trial of every
+participant, with trials drawn for each block the same way the experiment
+builds them (replications of the full factorial of the project's independent
+variables, truncated to the number of trials per block), RTs from the same
+ex-Gaussian model as simulation.py, misses and eye movements during the
+response (excluded, as in tools/analyze.py), and fixation breaks and early
+responses (recycled, so they make sessions longer without adding data). Each
+participant's cueing effect is the difference between their mean RTs at two
+target locations, and each study tests the mean effect across participants
+with a two-tailed one-sample t-test. Power is the proportion of studies where
+that test is significant. Run from the root of the project folder, e.g.:
+
+    python -m tools.power_sim keypress --participants 20 30 40 --blocks 6 8 10
+
+By default the design (trials per block, blocks, factors) comes from the
+project's params and independent variables files for the condition, and the
+effect tested is cued_object vs. uncued_opposite. Any of --trials-per-block,
+--blocks, --participants and --catch can be given several values, in which
+case every combination is simulated. Studies are generated as numpy arrays, a
+batch at a time, across a pool of worker processes.
+
+"""
+
+import json
+import math
+import argparse
+import itertools
+from timeit import default_timer
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from simulation import DEFAULT_PARTICIPANT
+from tools.config import load_params, load_factors
+
+CATCH = 'catch'
+
+# Studies simulated per job (each job generates its studies' trials as arrays)
+STUDIES_PER_JOB = 100
+
+
+def betainc(a, b, x):
+    """Returns the regularized incomplete beta function I_x(a, b), evaluated with
+    its continued fraction (modified Lentz's method).
+
+    """
+    if x <= 0.0 or x >= 1.0:
+        return max(0.0, min(1.0, x))
+    if x > (a + 1.0) / (a + b + 2.0):
+        return 1.0 - betainc(b, a, 1.0 - x)  # the fraction converges faster this way
+    front = math.exp(
+        math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+        a * math.log(x) + b * math.log(1.0 - x)
+    ) / a
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    f = d
+    for m in range(1, 500):
+        for numerator in (
+            m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+            -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))
+        ):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            f *= c * d
+        if abs(c * d - 1.0) < 1e-12:
+            break
+    return front * f
+
+
+def t_pvalue(t, df):
+    """Returns the two-tailed p-value of a t statistic."""
+    return betainc(df / 2.0, 0.5, df / (df + t * t))
+
+
+def t_critical(df, alpha=0.05):
+    """Returns the two-tailed critical value of t for the given degrees of freedom."""
+    lo, hi = 0.0, 1e3
+    for i in range(100):
+        mid = (lo + hi) / 2.0
+        if t_pvalue(mid, df) > alpha:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2.0
+
+
+class Design(object):
+    """A design to simulate: the experiment's factors for a response condition,
+    and the block structure and sample size to try.
+
+    Args:
+        condition (str): The response condition ('saccade' or 'keypress').
+        factors (OrderedDict): The {factor: [levels]} of the independent variables.
+        trials_per_block (int): The number of trials in each block.
+        blocks (int): The number of blocks per participant.
+        participants (int): The number of participants per study.
+        catch (float, optional): The proportion of catch trials in each block. If
+            None, catch trials are included only if they're a level of the
+            target_location factor, in the same proportion as the others.
+
+    """
+
+    def __init__(self, condition, factors, trials_per_block, blocks, participants, catch=None):
+        self.condition = condition
+        self.trials_per_block = trials_per_block
+        self.blocks = blocks
+        self.participants = participants
+        self.catch = catch
+        names = list(factors.keys())
+        self.locations = [l for l in factors['target_location'] if l != CATCH]
+        self.codes = dict((l, i) for i, l in enumerate(self.locations))
+        self.codes[CATCH] = len(self.locations)
+
+        # Target location codes of one replication of the full factorial
+        if catch is not None:
+            factors = dict(factors, target_location=self.locations)
+        loc = names.index('target_location')
+        self.factorial = np.array([
+            self.codes[cell[loc]] for cell in itertools.product(*[factors[f] for f in names])
+        ], dtype=np.int8)
+        self.n_catch = 0 if catch is None else int(round(catch * trials_per_block))
+
+    @property
+    def catch_proportion(self):
+        if self.catch is not None:
+            return self.n_catch / float(self.trials_per_block)
+        return np.mean(self.factorial == self.codes[CATCH])
+
+    def block_trials(self, rng, shape):
+        """Returns the target location codes of the trials in the given (number of
+        participants, blocks) shape of blocks, as they'd be generated by the
+        experiment.
+
+        """
+        n = self.trials_per_block - self.n_catch
+        reps = int(math.ceil(n / float(len(self.factorial))))
+        deck = np.tile(self.factorial, reps)
+        if len(deck) == n:
+            trials = np.broadcast_to(deck, shape + (n,))  # every block has every trial
+        else:
+            # Each block gets a random subset of the replications
+            order = np.argsort(rng.random_sample(shape + (len(deck),)), axis=-1)
+            trials = deck[order[..., :n]]
+        if self.n_catch:
+            catch = np.full(shape + (self.n_catch,), self.codes[CATCH], dtype=np.int8)
+            trials = np.concatenate([trials, catch], axis=-1)
+        return trials.reshape(shape[0], -1)
+
+
+def simulate_studies(job):
+    """Simulates a batch of studies of a design, returning each study's t
+    statistic, degrees of freedom and mean effect, and the mean number of usable
+    trials per location and of trials run (including recycled trials) per
+    participant.
+
+    """
+    design, behaviour, effect_sd, location, baseline, rt_limits, studies, seed = job
+    rng = np.random.RandomState(seed)
+    c = behaviour
+    n = studies * design.participants
+    trials = design.block_trials(rng, (n, design.blocks))
+    shape = trials.shape
+
+    # Anticipations: each one recycles the trial, so the number run before every
+    # planned trial is completed is negative binomial
+    recycle = c['fixation_break_rate'] + (1 - c['fixation_break_rate']) * c['early_response_rate']
+    run = shape[1] + rng.negative_binomial(shape[1], 1.0 - recycle, size=n)
+
+    # RTs, with each participant's own effect for the location being tested
+    effects = np.array(
+        [c['rt_effects'].get(l, 0.0) for l in design.locations] + [0.0]
+    )[trials.astype(np.intp)]
+    effects += np.where(trials == design.codes[location], rng.normal(0, effect_sd, (n, 1)), 0)
+    rt = c['rt_mu'][design.condition] + effects + rng.normal(0, c['rt_sigma'], shape)
+    rt += rng.exponential(c['rt_tau'], shape)
+    np.maximum(rt, 80.0, out=rt)
+
+    usable = rng.random_sample(shape) >= c['miss_rate']
+    if design.condition == 'keypress':
+        usable &= rng.random_sample(shape) >= c['response_eye_movement_rate']
+    usable &= (rt >= rt_limits[0]) & (rt <= rt_limits[1])
+
+    means = []
+    for loc in (location, baseline):
+        in_cell = usable & (trials == design.codes[loc])
+        count = in_cell.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means.append(np.where(in_cell, rt, 0).sum(axis=1) / count)
+    diff = (means[0] - means[1]).reshape(studies, design.participants)
+    per_location = [
+        (usable & (trials == design.codes[l])).sum(axis=1).mean() for l in design.locations
+    ]
+
+    # One-sample t-test of the effect across each study's participants (leaving
+    # out any without usable trials at either location)
+    valid = np.isfinite(diff)
+    k = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, diff, 0).sum(axis=1) / k
+        dev = np.where(valid, diff - mean[:, None], 0)
+        sd = np.sqrt((dev * dev).sum(axis=1) / (k - 1))
+        t = mean / (sd / np.sqrt(k))
+    return t, k - 1, mean, np.mean(per_location), run.mean()
+
+
+def run_design(pool, design, args, behaviour, seed):
+    """Simulates a design's studies across the pool, returning its power, the
+    Monte Carlo standard error of the power, the mean effect, the mean number of
+    usable trials per location and the mean number of trials run.
+
+    """
+    jobs, remaining, i = [], args.studies, 0
+    while remaining > 0:
+        studies = min(STUDIES_PER_JOB, remaining)
+        jobs.append((
+            design, behaviour, args.effect_sd, args.location, args.baseline,
+            (args.min_rt, args.max_rt), studies, seed + i
+        ))
+        remaining -= studies
+        i += 1
+    results = pool.map(simulate_studies, jobs)
+    t = np.concatenate([r[0] for r in results])
+    df = np.concatenate([r[1] for r in results])
+    effect = np.concatenate([r[2] for r in results])
+
+    # Studies differ in degrees of freedom only if participants were left out
+    critical = np.full(len(t), np.inf)
+    for d in np.unique(df[df > 0]):
+        critical[df == d] = t_critical(d, args.alpha)
+    power = (np.abs(np.nan_to_num(t)) > critical).mean()
+    weights = [r[1].size for r in results]
+    return (
+        power, math.sqrt(power * (1 - power) / len(t)), np.nanmean(effect),
+        np.average([r[3] for r in results], weights=weights),
+        np.average([r[4] for r in results], weights=weights)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument('condition', choices=['saccade', 'keypress'])
+    parser.add_argument('--participants', type=int, nargs='+', default=[20])
+    parser.add_argument('--trials-per-block', type=int, nargs='+',
+        help="(default: from the params file)")
+    parser.add_argument('--blocks', type=int, nargs='+', help="(default: from the params file)")
+    parser.add_argument('--catch', type=float, nargs='+',
+        help="proportions of catch trials per block (default: as in the ind vars file)")
+    parser.add_argument('--location', default='cued_object',
+        help="target location whose cueing effect is tested")
+    parser.add_argument('--baseline', default='uncued_opposite',
+        help="target location the effect is measured relative to")
+    parser.add_argument('--effect', type=float,
+        help="true mean effect (ms), instead of the simulated participant's")
+    parser.add_argument('--effect-sd', type=float, default=15.0,
+        help="SD of the true effect across participants (ms)")
+    parser.add_argument('--min-rt', type=float, default=0,
+        help="exclude RTs shorter than this (ms)")
+    parser.add_argument('--max-rt', type=float, default=np.inf,
+        help="exclude RTs longer than this (ms)")
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--studies', type=int, default=2000,
+        help="simulated studies per design")
+    parser.add_argument('--config',
+        help="JSON file overriding the synthetic participants' behaviour (as in tools.simulate)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--jobs', type=int, default=cpu_count())
+    args = parser.parse_args()
+
+    params = load_params(args.condition)
+    factors = load_factors(args.condition)
+    for loc in (args.location, args.baseline):
+        if loc not in factors['target_location'] or loc == CATCH:
+            parser.error("unknown target location '{0}'".format(loc))
+    behaviour = dict(DEFAULT_PARTICIPANT)
+    if args.config:
+        with open(args.config) as f:
+            behaviour.update(json.load(f))
+    behaviour['rt_effects'] = dict(behaviour['rt_effects'])
+    if args.effect is not None:
+        behaviour['rt_effects'][args.location] = (
+            behaviour['rt_effects'].get(args.baseline, 0.0) + args.effect
+        )
+    true_effect = (
+        behaviour['rt_effects'].get(args.location, 0.0) -
+        behaviour['rt_effects'].get(args.baseline, 0.0)
+    )
+
+    designs = [
+        Design(args.condition, factors, tpb, blocks, n, catch)
+        for tpb, blocks, catch, n in itertools.product(
+            args.trials_per_block or [params['trials_per_block']],
+            args.blocks or [params['blocks_per_experiment']],
+            args.catch or [None],
+            args.participants
+        )
+    ]
+    print("{0} condition: {1} vs. {2}, true effect {3:.1f} ms (SD {4:.1f} across participants), "
+        "{5} studies per design\n".format(
+            args.condition, args.location, args.baseline, true_effect, args.effect_sd,
+            args.studies))
+    print("{0:>8}{1:>8}{2:>8}{3:>14}{4:>14}{5:>12}{6:>10}{7:>18}".format(
+        "trials", "blocks", "catch", "participants", "usable/loc", "trials run",
+        "effect", "power"
+    ))
+
+    start = default_timer()
+    pool = Pool(max(1, args.jobs))
+    try:
+        for i, design in enumerate(designs):
+            power, se, effect, usable, run = run_design(
+                pool, design, args, behaviour, args.seed + i * 100003
+            )
+            print("{0:>8}{1:>8}{2:>7.0f}%{3:>14}{4:>14.1f}{5:>12.1f}{6:>10.1f}{7:>18}".format(
+                design.trials_per_block, design.blocks, design.catch_proportion * 100,
+                design.participants, usable, run, effect,
+                "{0:.3f} +/- {1:.3f}".format(power, se)
+            ))
+    finally:
+        pool.close()
+        pool.join()
+    print("\nsimulated {0} studies in {1:.1f} s".format(
+        len(designs) * args.studies, default_timer() - start))
+
+
+if __name__ == '__main__':
+    main()
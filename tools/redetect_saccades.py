@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Re-detects saccades offline with new velocity, acceleration and motion thresholds,
+and re-derives the fields of the 'saccades' table for every trial.
+
+Works on EyeLink ASC exports of the session EDFs (made with edf2asc), or on gaze
+samples recorded with record_gaze_samples (read via the 'gaze_index' table of the
+database). Run from the root of the project folder, e.g.:
+
+    python -m tools.redetect_saccades asc ExpAssets/EDF/*.asc --diagonal 19
+    python -m tools.redetect_saccades gaze ExpAssets/ObjectBasedCueingEffects_2020.db --diagonal 19
+
+Thresholds default to the saccadic_*_threshold values in the project's params.
+Saccades are detected with the same 5-sample velocity model EyeLink trackers use,
+then scored exactly as record_saccades() scores them online (see score_saccade()
+in gaze.py). Files are processed in parallel, each one streamed a trial at a time
+so memory use doesn't grow with file size.
+
+"""
+
+import os
+import csv
+import sqlite3
+import argparse
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from geometry import TargetGeometryTable, stimulus_locations, pixels_per_degree
+from gaze import score_saccade, load_gaze_samples
+from tools.config import load_params, load_factors
+
+# As in experiment.py
+RESPONSE_TIMEOUT = 2500  # ms from target onset to make a saccade
+MAX_SACCADES = 3  # record_saccades() keeps at most this many saccades per trial
+LOCATION_OFFSET = 4.8  # degrees between fixation and placeholders
+BOUNDARY = 3.0  # degrees, radius of the fixation & target boundaries
+
+# Velocity kernel for EyeLink's 5-sample model: (x[n+2] + x[n+1] - x[n-1] - x[n-2]) / 6
+KERNEL = np.array([1, 1, 0, -1, -1]) / 6.0
+
+CHUNK_BYTES = 1 << 22  # ASC files are read in chunks of roughly this many bytes
+
+COLUMNS = [
+    'source', 'participant_id', 'trial_order', 'trial_num', 'saccade_num', 'rt',
+    'accuracy', 'dist_from_target', 'start_x', 'start_y', 'end_x', 'end_y',
+    'duration', 'target_acquired'
+]
+
+
+def derivative(values, dt):
+    """Applies the 5-sample velocity model to an array of values sampled every dt
+    seconds. The first & last two samples (and any near missing data) are NaN.
+
+    """
+    out = np.full(len(values), np.nan)
+    if len(values) >= len(KERNEL):
+        out[2:-2] = np.convolve(values, KERNEL, 'valid') / dt
+    return out
+
+
+def detect_saccades(t, x, y, ppd, velocity, acceleration, motion):
+    """Detects saccades in a trace of gaze samples.
+
+    A sample is part of a saccade if eye velocity or acceleration exceeds its
+    threshold. Saccades that border missing data (i.e. blinks) or that move the eye
+    less than the motion threshold are ignored.
+
+    Args:
+        t (:obj:`np.ndarray`): Sample timestamps (ms).
+        x, y (:obj:`np.ndarray`): Gaze coordinates (px), NaN where missing.
+        ppd (float): Pixels per degree of visual angle.
+        velocity (float): Velocity threshold (deg/s).
+        acceleration (float): Acceleration threshold (deg/s²).
+        motion (float): Minimum amplitude (deg).
+
+    Returns:
+        tuple: Arrays of the onset and offset sample indices of each saccade.
+
+    """
+    if len(t) < len(KERNEL) + 2:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    dt = np.median(np.diff(t)) / 1000.0
+    xd, yd = x / ppd, y / ppd
+    speed = np.hypot(derivative(xd, dt), derivative(yd, dt))
+    accel = derivative(speed, dt)
+
+    with np.errstate(invalid='ignore'):
+        moving = (speed > velocity) | (np.abs(accel) > acceleration)
+    valid = np.isfinite(speed)
+    moving &= valid
+
+    edges = np.diff(np.concatenate([[0], moving.astype(np.int8), [0]]))
+    onsets = np.flatnonzero(edges == 1)
+    offsets = np.flatnonzero(edges == -1) - 1
+
+    before = valid[np.maximum(onsets - 1, 0)] & (onsets > 0)
+    after = valid[np.minimum(offsets + 1, len(t) - 1)] & (offsets < len(t) - 1)
+    amplitude = np.hypot(xd[offsets] - xd[onsets], yd[offsets] - yd[onsets])
+    keep = before & after & (amplitude >= motion)
+    return onsets[keep], offsets[keep]
+
+
+def score_trial(t, x, y, target_onset, window_end, centre, target, boundary, settings):
+    """Detects & scores the saccades made on a trial, stopping (like the online
+    response loop) once a saccade lands on the target.
+
+    Returns:
+        tuple: A list of scored saccade dicts (at most MAX_SACCADES) and whether
+        the target was acquired.
+
+    """
+    onsets, offsets = detect_saccades(t, x, y, *settings)
+    saccades = []
+    for on, off in zip(onsets, offsets):
+        # Online, only saccades ending after target onset & before the end of the
+        # response loop were seen
+        if t[off] <= target_onset or t[off] > window_end:
+            continue
+        previous = saccades[-1] if len(saccades) else None
+        scored = score_saccade(
+            t[on], t[off], (x[on], y[on]), (x[off], y[off]), target_onset, previous,
+            centre, target, boundary
+        )
+        if scored is None:
+            continue
+        if len(saccades) < MAX_SACCADES:
+            saccades.append(scored)
+        if scored['dist_from_target'] <= boundary:
+            return saccades, True
+    return saccades, False
+
+
+def trial_rows(source, participant_id, trial_order, trial_num, saccades, acquired):
+    rows = []
+    for i, s in enumerate(saccades):
+        row = dict((k, s[k]) for k in COLUMNS if k in s)
+        row.update({
+            'source': source, 'participant_id': participant_id,
+            'trial_order': trial_order, 'trial_num': trial_num, 'saccade_num': i + 1,
+            'target_acquired': str(acquired).upper()
+        })
+        rows.append(row)
+    return rows
+
+
+def parse_samples(lines, columns):
+    """Parses a list of ASC sample lines into arrays of timestamps, x and y (with
+    missing data as NaN).
+
+    """
+    if not len(lines):
+        empty = np.zeros(0)
+        return empty, empty, empty
+    fields = np.array([line.split()[:columns[-1] + 1] for line in lines])
+    fields = fields[:, columns]
+    fields[fields == '.'] = 'nan'
+    values = fields.astype(np.float64)
+    return values[:, 0], values[:, 1], values[:, 2]
+
+
+def read_asc(path):
+    """Streams an ASC file one response interval at a time, yielding a dict for
+    each trial with a TARGET_ON message. Only the samples of the trial currently
+    being read are kept in memory.
+
+    """
+    columns = [0, 1, 2]
+    display = None
+    trial_num = None
+    trial = None
+    lines = []
+
+    def finish():
+        trial['t'], trial['x'], trial['y'] = parse_samples(lines, columns)
+        return trial
+
+    with open(path) as f:
+        for chunk in iter(lambda: f.readlines(CHUNK_BYTES), []):
+            for line in chunk:
+                if line[0].isdigit():
+                    if trial is not None:
+                        lines.append(line)
+                    continue
+                words = line.split()
+                if not len(words):
+                    continue
+                if words[0] == 'SAMPLES' and 'LEFT' in words and 'RIGHT' in words:
+                    columns = [0, 4, 5]  # binocular: use the right eye
+                if words[0] != 'MSG' or len(words) < 3:
+                    continue
+                msg_time, msg = float(words[1]), words[2]
+                if msg == 'DISPLAY_COORDS':
+                    left, top, right, bottom = [int(float(v)) for v in words[3:7]]
+                    display = (right - left + 1, bottom - top + 1)
+                elif msg == 'TRIALID':
+                    if trial is not None:
+                        yield finish()
+                        trial, lines = None, []
+                    trial_num = int(words[3])
+                elif msg == 'TARGET_ON':
+                    onset = float(words[3])
+                    trial = {
+                        'trial_num': trial_num, 'display': display, 'target': None,
+                        'target_onset': onset, 'window_end': onset + RESPONSE_TIMEOUT
+                    }
+                elif msg == 'TARGET_POS' and trial is not None:
+                    trial['target'] = (int(words[3]), int(words[4]))
+                elif msg == 'RESPONSE_LOOP' and trial is not None:
+                    trial['window_end'] = min(trial['window_end'], msg_time)
+                    yield finish()
+                    trial, lines = None, []
+        if trial is not None:
+            yield finish()
+
+
+def redetect_asc(job):
+    path, settings, boundary_deg = job
+    ppd_for = {}
+    rows, skipped, trial_order = [], 0, 0
+    source = os.path.basename(path)
+    for trial in read_asc(path):
+        trial_order += 1
+        if trial['target'] is None or trial['display'] is None:
+            skipped += 1  # recorded before TARGET_POS messages were added
+            continue
+        display = trial['display']
+        if display not in ppd_for:
+            ppd_for[display] = pixels_per_degree(display, *settings['screen'])
+        ppd = ppd_for[display]
+        centre = (display[0] // 2, display[1] // 2)
+        saccades, acquired = score_trial(
+            trial['t'], trial['x'], trial['y'], trial['target_onset'],
+            trial['window_end'], centre, trial['target'], int(boundary_deg * ppd),
+            (ppd,) + settings['thresholds']
+        )
+        rows += trial_rows(source, 'NA', trial_order, trial['trial_num'], saccades, acquired)
+    return source, rows, trial_order, skipped
+
+
+def redetect_gaze_file(job):
+    gaze_dir, filename, trials, settings, geometry = job
+    path = os.path.join(gaze_dir, filename)
+    ppd, centre, boundary, table = geometry
+    rows, skipped = [], 0
+    for i, trial in enumerate(trials):
+        if trial['target_onset'] == 'NA' or not trial['sample_count']:
+            skipped += 1
+            continue
+        samples = load_gaze_samples(path, trial['sample_offset'], trial['sample_count'])
+        t = samples['t'].astype(np.float64)
+        x = samples['x'].astype(np.float64)
+        y = samples['y'].astype(np.float64)
+        missing = (x == -32768) | (y == -32768) | (samples['phase'] == 3)
+        x[missing] = np.nan
+        y[missing] = np.nan
+        target_onset = float(trial['target_onset'])
+        target = table.lookup(
+            trial['box_alignment'], trial['cue_location'], trial['target_location']
+        ).target
+        saccades, acquired = score_trial(
+            t, x, y, target_onset, target_onset + RESPONSE_TIMEOUT, centre, target,
+            boundary, (ppd,) + settings['thresholds']
+        )
+        rows += trial_rows(
+            filename, trial['participant_id'], i + 1, trial['trial_num'], saccades, acquired
+        )
+    return filename, rows, len(trials), skipped
+
+
+def gaze_jobs(db_path, gaze_dir, settings):
+    db = sqlite3.connect(db_path)
+    db.row_factory = sqlite3.Row
+    query = (
+        "SELECT g.file, g.participant_id, g.trial_num, g.sample_offset, g.sample_count, "
+        "g.target_onset, t.box_alignment, t.cue_location, t.target_location "
+        "FROM gaze_index g JOIN trials t ON t.id = g.trial_id "
+        "WHERE t.session_type = 'saccade' ORDER BY g.file, g.id"
+    )
+    files = {}
+    for row in db.execute(query):
+        files.setdefault(row['file'], []).append(dict(zip(row.keys(), row)))
+    db.close()
+
+    screen_size, diagonal, view_distance = settings['screen']
+    ppd = pixels_per_degree(screen_size, diagonal, view_distance)
+    centre = (screen_size[0] // 2, screen_size[1] // 2)
+    levels = load_factors('saccade')
+    table = TargetGeometryTable(
+        stimulus_locations(centre, int(LOCATION_OFFSET * ppd)), levels['box_alignment'],
+        levels['cue_location'], levels['target_location']
+    )
+    geometry = (ppd, centre, int(BOUNDARY * ppd), table)
+    return [(gaze_dir, f, trials, settings, geometry) for f, trials in sorted(files.items())]
+
+
+def main():
+    params = load_params('saccade')
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument('source', choices=['asc', 'gaze'])
+    parser.add_argument('paths', nargs='+',
+        help="ASC files (asc), or the experiment database (gaze)")
+    parser.add_argument('--gaze-dir', default=os.path.join("ExpAssets", "Data", "gaze"),
+        help="folder of recorded gaze sample files (gaze)")
+    parser.add_argument('--diagonal', type=float, required=True,
+        help="diagonal size of the screen the data were collected on (inches)")
+    parser.add_argument('--screen', type=int, nargs=2, default=[1920, 1080],
+        help="screen resolution (gaze; ASC files record their own)")
+    parser.add_argument('--velocity', type=float, default=params['saccadic_velocity_threshold'])
+    parser.add_argument('--acceleration', type=float,
+        default=params['saccadic_acceleration_threshold'])
+    parser.add_argument('--motion', type=float, default=params['saccadic_motion_threshold'])
+    parser.add_argument('--jobs', type=int, default=cpu_count())
+    parser.add_argument('-o', '--output', default="redetected_saccades.csv")
+    args = parser.parse_args()
+
+    thresholds = (args.velocity, args.acceleration, args.motion)
+    if args.source == 'asc':
+        settings = {'screen': (args.diagonal, params['view_distance']), 'thresholds': thresholds}
+        jobs = [(path, settings, BOUNDARY) for path in args.paths]
+        worker = redetect_asc
+    else:
+        settings = {
+            'screen': (tuple(args.screen), args.diagonal, params['view_distance']),
+            'thresholds': thresholds
+        }
+        jobs = gaze_jobs(args.paths[0], args.gaze_dir, settings)
+        worker = redetect_gaze_file
+
+    pool = Pool(max(1, min(args.jobs, len(jobs))))
+    total_trials, total_skipped, total_saccades = 0, 0, 0
+    with open(args.output, 'w') as out:
+        writer = csv.DictWriter(out, COLUMNS, lineterminator="\n")
+        writer.writeheader()
+        for name, rows, trials, skipped in pool.imap(worker, jobs):
+            writer.writerows(rows)
+            total_trials += trials
+            total_skipped += skipped
+            total_saccades += len(rows)
+            print("{0}: {1} trials ({2} skipped), {3} saccades".format(
+                name, trials, skipped, len(rows)))
+    pool.close()
+    pool.join()
+    print("wrote {0} saccades from {1} trials to {2}".format(
+        total_saccades, total_trials - total_skipped, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Runs full simulated sessions of the experiment with synthetic participants, on a
+virtual clock and without a display or eye tracker (see simulation.py).
+
+Run from the root of the project folder, e.g.:
+
+    python -m tools.simulate saccade --participants 5 --seed 1 --db sim.db
+
+"""
+
+import json
+import argparse
+from timeit import default_timer
+
+from simulation import SessionSimulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument('condition', choices=['saccade', 'keypress'])
+    parser.add_argument('--db', default="simulated.db",
+        help="database to write to (created from the project schema if missing)")
+    parser.add_argument('--participants', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1,
+        help="seed for the first participant (incremented for each one after)")
+    parser.add_argument('--config',
+        help="JSON file overriding the synthetic participant's behaviour")
+    parser.add_argument('--screen', type=int, nargs=2, default=[1920, 1080])
+    parser.add_argument('--diagonal', type=float, default=24.0)
+    parser.add_argument('--refresh', type=float, default=60.0)
+    parser.add_argument('--stop-after', type=int,
+        help="interrupt each session after this many trials (to test resuming)")
+    parser.add_argument('--resume', type=int, metavar='PARTICIPANT_ID',
+        help="resume the interrupted session of a participant in the database")
+    args = parser.parse_args()
+
+    config = None
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+
+    sim = SessionSimulator(
+        args.db, args.condition, tuple(args.screen), args.diagonal, args.refresh, config
+    )
+    participants = 1 if args.resume else args.participants
+    for seed in range(args.seed, args.seed + participants):
+        start = default_timer()
+        summary = sim.run(seed, args.stop_after, args.resume)
+        print(
+            "participant {0} (seed {1}): {2} trials, {3} recycled, {4} flips, "
+            "{5:.1f} simulated min in {6:.2f} s{7}".format(
+                summary['participant_id'], seed, summary['trials'], summary['recycled'],
+                summary['flips'], summary['session_ms'] / 60000.0, default_timer() - start,
+                " (interrupted)" if summary['interrupted'] else ""
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+import json
+import functools
+
+import numpy as np
+
+from timing import clock
+
+SPAN = 1
+COUNTER = 2
+
+
+class Tracer(object):
+    """Records named, nested spans of time (and counters) over a session into a
+    preallocated buffer, for exporting as a Chrome trace (which can be opened in
+    chrome://tracing or https://ui.perfetto.dev).
+
+    Counters are incremented in memory as things happen and only written to the
+    buffer when the outermost span ends, as the totals for that span, so counting
+    something in a tight loop costs no more than a dict update.
+
+    Args:
+        capacity (int, optional): The maximum number of spans & counter values to
+            record. Once the buffer is full, further records are counted as dropped.
+        clock (callable, optional): The clock to timestamp spans with, in seconds.
+
+    """
+
+    enabled = True
+
+    def __init__(self, capacity=65536, clock=clock):
+        self.capacity = capacity
+        self.clock = clock
+        self.kind = np.zeros(capacity, dtype=np.uint8)
+        self.name = np.zeros(capacity, dtype=np.int32)
+        self.start = np.zeros(capacity, dtype=np.float64)
+        self.value = np.zeros(capacity, dtype=np.float64)  # span end, or counter value
+        self.names = []
+        self.count = 0
+        self.dropped = 0
+        self.counters = {}
+        self._ids = {}
+        self._stack = []
+
+    def begin(self, name):
+        """Starts a span, nested inside whichever span is currently open."""
+        self._stack.append((name, self.clock()))
+
+    def end(self):
+        """Ends the most recently started span."""
+        name, start = self._stack.pop()
+        self._record(SPAN, name, start, self.clock())
+        if not len(self._stack):
+            for counter, total in self.counters.items():
+                self._record(COUNTER, counter, start, total)
+            self.counters = {}
+
+    def span(self, name):
+        """Returns a context manager that records a span around its block."""
+        return _Span(self, name)
+
+    def incr(self, name, n=1):
+        """Adds to a counter for the current outermost span."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def _record(self, kind, name, start, value):
+        if self.count >= self.capacity:
+            self.dropped += 1
+            return
+        if name not in self._ids:
+            self._ids[name] = len(self.names)
+            self.names.append(name)
+        i = self.count
+        self.kind[i] = kind
+        self.name[i] = self._ids[name]
+        self.start[i] = start
+        self.value[i] = value
+        self.count += 1
+
+    def events(self):
+        """Returns everything recorded as a list of Chrome trace events."""
+        n = self.count
+        if not n:
+            return []
+        t0 = self.start[:n].min()
+        events = []
+        for kind, name, start, value in zip(
+                self.kind[:n], self.name[:n], self.start[:n], self.value[:n]):
+            event = {
+                'name': self.names[name], 'pid': 1, 'tid': 1,
+                'ts': round((start - t0) * 1e6, 1)
+            }
+            if kind == SPAN:
+                event.update({'ph': 'X', 'dur': round((value - start) * 1e6, 1)})
+            else:
+                event.update({'ph': 'C', 'args': {self.names[name]: int(value)}})
+            events.append(event)
+        return events
+
+    def export(self, path, metadata={}):
+        """Writes everything recorded to a Chrome trace JSON file."""
+        trace = {
+            'traceEvents': self.events(),
+            'displayTimeUnit': 'ms',
+            'otherData': dict(metadata, dropped=self.dropped)
+        }
+        with open(path, 'w') as f:
+            json.dump(trace, f)
+
+
+class _Span(object):
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.tracer.begin(self.name)
+
+    def __exit__(self, *exc):
+        self.tracer.end()
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+class NullTracer(object):
+    """A tracer that records nothing, used when tracing is disabled."""
+
+    enabled = False
+    _span = _NullSpan()
+
+    def begin(self, name):
+        pass
+
+    def end(self):
+        pass
+
+    def span(self, name):
+        return self._span
+
+    def incr(self, name, n=1):
+        pass
+
+
+def traced(name):
+    """Decorates an experiment method so that each call is recorded as a span by
+    the experiment's tracer.
+
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.tracer.span(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate